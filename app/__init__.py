@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, g
 
 
 def create_app() -> Flask:
@@ -8,4 +8,50 @@ def create_app() -> Flask:
 	from .routes import pages
 	app.register_blueprint(pages)
 
+	from .closed_samples_store import link_closed_samples
+	from .samples_store import cleanup_temp_files
+	from .table import UnitOfWork
+
+	# Exports now stream; drop files the old two-step export left in temp/
+	cleanup_temp_files()
+	# Closed samples saved before they carried customer_id and sample_id get them
+	link_closed_samples()
+
+	# One unit of work per request: each store is read at most once. Writes are
+	# flushed when the store call (write step) making them ends, so no file lock
+	# is held while the view or its template runs
+	@app.before_request
+	def open_unit_of_work() -> None:
+		g.unit_of_work = UnitOfWork().begin()
+
+	@app.teardown_request
+	def close_unit_of_work(exc: BaseException = None) -> None:
+		unit = g.pop("unit_of_work", None)
+		if unit is not None:
+			try:
+				# A failed request drops whatever it still holds instead of saving it
+				unit.close(discard=exc is not None)
+			except Exception:
+				app.logger.exception("Could not write the changes of the request")
+
+	@app.cli.command("import-json-to-sqlite")
+	def import_json_to_sqlite() -> None:
+		"""Copy data/*.json into the SQLite database used by NAA_STORAGE_BACKEND=sqlite"""
+		from .sqlite_backend import DATABASE_FILE, import_json_files
+		for table, count in import_json_files().items():
+			print(f"{table}: {count} records")
+		print(f"Imported into {DATABASE_FILE}")
+
+	@app.cli.command("cleanup-temp-files")
+	def cleanup_temp_files_command() -> None:
+		"""Remove files older than NAA_TEMP_FILE_TTL seconds from temp/"""
+		print(f"Removed {cleanup_temp_files()} temp files")
+
+	@app.cli.command("rebuild-customer-counters")
+	def rebuild_customer_counters() -> None:
+		"""Recount the samples, closed boxes and irradiations of every customer"""
+		from .customers_store import rebuild_customer_counts
+		for field, count in rebuild_customer_counts().items():
+			print(f"{field}: {count}")
+
 	return app
@@ -1,66 +1,60 @@
 import json
-import os
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional
 
-DATA_FILE = "data/channel_7_1_irradiations.json"
+from .customers_store import count_change, irradiation_customer
+from .pagination import Page, paginate, paginate_range
+from .storage import data_path
+from .table import open_table, write_step
+
+DATA_FILE = data_path("channel_7_1_irradiations.json")
+
+def _created_date(record: Dict) -> str:
+	"""Day part (YYYY-MM-DD) of created_at"""
+	return (record.get('created_at') or '')[:10]
+
+# Sorted by day for range queries (Table.between)
+_irradiations = open_table(DATA_FILE, "irradiations", seed={"irradiations": []}, stamp_field="last_updated", indexes={"created_date": _created_date})
 
 def load_channel_7_1_irradiations() -> List[Dict]:
 	"""Load channel 7-1 irradiations from JSON file"""
-	if not os.path.exists(DATA_FILE):
-		return []
-	
 	try:
-		with open(DATA_FILE, 'r', encoding='utf-8') as f:
-			data = json.load(f)
-			return data.get('irradiations', [])
-	except (json.JSONDecodeError, FileNotFoundError):
+		return _irradiations.rows()
+	except json.JSONDecodeError:
 		return []
 
+@write_step()
 def save_channel_7_1_irradiations(irradiations: List[Dict]) -> None:
 	"""Save channel 7-1 irradiations to JSON file"""
-	os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-	
-	data = {
-		'irradiations': irradiations,
-		'last_updated': datetime.now().isoformat()
-	}
-	
-	with open(DATA_FILE, 'w', encoding='utf-8') as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+	old = _irradiations.rows()
+	_irradiations.replace_all(irradiations)
+	count_change("irradiations", removed=[irradiation_customer(r) for r in old], added=[irradiation_customer(r) for r in irradiations])
 
 def list_channel_7_1_irradiations() -> List[Dict]:
 	"""Get all channel 7-1 irradiations"""
 	return load_channel_7_1_irradiations()
 
-def list_channel_7_1_irradiations_paginated(page: int = 1, per_page: int = 20) -> Tuple[List[Dict], int, int]:
-	"""Get paginated channel 7-1 irradiations"""
-	irradiations = load_channel_7_1_irradiations()
-	
-	# Calculate pagination
-	total_count = len(irradiations)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	# Get page data
-	start_idx = (page - 1) * per_page
-	end_idx = start_idx + per_page
-	page_irradiations = irradiations[start_idx:end_idx]
-	
-	return page_irradiations, total_pages, total_count
+def list_channel_7_1_irradiations_between(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict]:
+	"""Channel 7-1 irradiations created between two dates (YYYY-MM-DD, inclusive, None for no bound), by date"""
+	return _irradiations.between("created_date", date_from or None, date_to or None)
 
+def list_channel_7_1_irradiations_paginated(page: int = 1, per_page: int = 20, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Page:
+	"""Get paginated channel 7-1 irradiations (see pagination.paginate for the cursors), optionally created between two dates"""
+	if date_from or date_to:
+		return paginate_range(_irradiations, "created_date", _created_date, date_from or None, date_to or None, page, per_page, after, before)
+	return paginate(_irradiations, page, per_page, after, before, with_total=with_total)
+
+@write_step()
 def create_channel_7_1_irradiation(sample_code: str, sample_name: str, channel_position: str, 
 								  irradiation_time: float, power: float, temperature: float = None, 
 								  note: str = "") -> Dict:
 	"""Create a new channel 7-1 irradiation"""
-	irradiations = load_channel_7_1_irradiations()
-	
-	# Generate new ID
-	next_id = max([i.get('id', 0) for i in irradiations], default=0) + 1
-	
+	# The table numbers it max(id) + 1
 	irradiation = {
-		'id': next_id,
 		'sample_code': sample_code,
 		'sample_name': sample_name,
+		# Counted for this customer until the record is deleted
+		'customer_id': irradiation_customer({'sample_code': sample_code}),
 		'channel_position': channel_position,
 		'irradiation_time': irradiation_time,
 		'power': power,
@@ -69,62 +63,54 @@ def create_channel_7_1_irradiation(sample_code: str, sample_name: str, channel_p
 		'created_at': datetime.now().isoformat()
 	}
 	
-	irradiations.append(irradiation)
-	save_channel_7_1_irradiations(irradiations)
+	irradiation_id = _irradiations.insert(irradiation)
+	count_change("irradiations", added=[irradiation['customer_id']])
 	
-	return irradiation
+	return _irradiations.get(irradiation_id)
 
 def get_channel_7_1_irradiation(irradiation_id: int) -> Optional[Dict]:
 	"""Get a specific channel 7-1 irradiation by ID"""
-	irradiations = load_channel_7_1_irradiations()
-	
-	for irradiation in irradiations:
-		if irradiation.get('id') == irradiation_id:
-			return irradiation
-	
-	return None
+	return _irradiations.get(irradiation_id)
 
+@write_step()
 def update_channel_7_1_irradiation(irradiation_id: int, sample_code: str, sample_name: str, 
 								   channel_position: str, irradiation_time: float, power: float, 
 								   temperature: float = None, note: str = "") -> bool:
 	"""Update a channel 7-1 irradiation"""
-	irradiations = load_channel_7_1_irradiations()
-	
-	for i, irradiation in enumerate(irradiations):
-		if irradiation.get('id') == irradiation_id:
-			irradiations[i].update({
-				'sample_code': sample_code,
-				'sample_name': sample_name,
-				'channel_position': channel_position,
-				'irradiation_time': irradiation_time,
-				'power': power,
-				'temperature': temperature,
-				'note': note,
-				'updated_at': datetime.now().isoformat()
-			})
-			save_channel_7_1_irradiations(irradiations)
-			return True
-	
-	return False
+	old = _irradiations.get(irradiation_id)
+	if old is None:
+		return False
+	customer_id = irradiation_customer(old) if old.get('sample_code') == sample_code else irradiation_customer({'sample_code': sample_code})
+	if not _irradiations.update(irradiation_id, {
+		'sample_code': sample_code,
+		'sample_name': sample_name,
+		'customer_id': customer_id,
+		'channel_position': channel_position,
+		'irradiation_time': irradiation_time,
+		'power': power,
+		'temperature': temperature,
+		'note': note,
+		'updated_at': datetime.now().isoformat()
+	}):
+		return False
+	count_change("irradiations", removed=[irradiation_customer(old)], added=[customer_id])
+	return True
 
+@write_step()
 def delete_channel_7_1_irradiation(irradiation_id: int) -> bool:
 	"""Delete a channel 7-1 irradiation"""
-	irradiations = load_channel_7_1_irradiations()
-	
-	for i, irradiation in enumerate(irradiations):
-		if irradiation.get('id') == irradiation_id:
-			del irradiations[i]
-			save_channel_7_1_irradiations(irradiations)
-			return True
-	
-	return False
+	old = _irradiations.get(irradiation_id)
+	if old is None or not _irradiations.delete(irradiation_id):
+		return False
+	count_change("irradiations", removed=[irradiation_customer(old)])
+	return True
 
-def export_channel_7_1_irradiations_to_excel() -> str:
-	"""Export channel 7-1 irradiations to Excel format"""
+def export_channel_7_1_irradiations_to_excel(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export channel 7-1 irradiations (optionally only those created between two dates) to Excel format"""
 	import io
 	from openpyxl import Workbook
 	
-	irradiations = load_channel_7_1_irradiations()
+	irradiations = list_channel_7_1_irradiations_between(date_from, date_to) if date_from or date_to else load_channel_7_1_irradiations()
 	
 	wb = Workbook()
 	ws = wb.active
@@ -1,55 +1,129 @@
-import json
-import os
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-CLOSED_SAMPLES_FILE = os.path.join(DATA_DIR, "closed_samples.json")
+from .customers_store import count_change, find_customer_by_name
+from .pagination import Page, paginate, paginate_range
+from .samples_store import find_sample_by_identity
+from .storage import data_path
+from .table import open_table, write_step
 
+CLOSED_SAMPLES_FILE = data_path("closed_samples.json")
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(CLOSED_SAMPLES_FILE):
-		with open(CLOSED_SAMPLES_FILE, "w", encoding="utf-8") as f:
-			json.dump({"next_id": 1, "closed_samples": []}, f, ensure_ascii=False, indent=2)
+def _closing_date(record: Dict[str, Any]) -> str:
+	return record.get("closing_date") or ""
 
 
-def _read() -> Dict[str, Any]:
-	_ensure_store()
-	with open(CLOSED_SAMPLES_FILE, "r", encoding="utf-8") as f:
-		return json.load(f)
+_closed_samples = open_table(
+	CLOSED_SAMPLES_FILE,
+	"closed_samples",
+	seed={"next_id": 1, "closed_samples": []},
+	indexes={
+		"customer_name": lambda s: (s.get("customer_name") or "").lower(),
+		# Names as written, for the filter dropdown (Table.distinct)
+		"customer_names": lambda s: s.get("customer_name") or None,
+		# Links to the receiving module: a customer's boxes, a sample's boxes
+		"customer_id": lambda s: s.get("customer_id"),
+		"sample_id": lambda s: s.get("sample_id"),
+		# Sorted by date for range queries (Table.between)
+		"closing_date": _closing_date,
+	},
+	versioned=True,
+	lines=True,
+)
 
 
-def _write(data: Dict[str, Any]) -> None:
-	with open(CLOSED_SAMPLES_FILE, "w", encoding="utf-8") as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+def _links(record: Dict[str, Any]) -> Dict[str, Optional[int]]:
+	"""customer_id and sample_id of a closed sample saved without them (link_closed_samples):
+	those it carries, else the customer with its customer name and that customer's sample
+	with its name and code (None if not found)
+	"""
+	customer_id = closed_sample_customer(record)
+	sample_id = record.get("sample_id")
+	if sample_id is None and customer_id is not None:
+		sample = find_sample_by_identity(customer_id, record.get("sample_name") or "", record.get("encoding") or "")
+		sample_id = sample["id"] if sample else None
+	return {"customer_id": customer_id, "sample_id": sample_id}
+
+
+def closed_sample_customer(record: Dict[str, Any]) -> Optional[int]:
+	"""ID of the customer a closed box belongs to: its customer_id, else the customer with its customer name, else None"""
+	if record.get("customer_id") is not None:
+		return record["customer_id"]
+	customer = find_customer_by_name(record.get("customer_name") or "")
+	return customer["id"] if customer else None
+
+
+def link_closed_samples() -> int:
+	"""Fill in customer_id and sample_id on the closed samples missing them (saved before
+	they existed, or whose sample was not received yet) and return how many changed
+	"""
+	linked = 0
+	# Every update goes into one write per store
+	with write_step():
+		for record in _closed_samples.find("sample_id", None):
+			links = _links(record)
+			
+			def link(current: Dict[str, Any]) -> Optional[bool]:
+				# Checked under the write lock: another worker may have linked it meanwhile
+				if all(k in current and current[k] == v for k, v in links.items()):
+					return False
+				current.update(links)
+			
+			before = closed_sample_customer(record)
+			if _closed_samples.update(record["id"], link):
+				count_change("closed_boxes", removed=[before], added=[links["customer_id"]])
+				linked += 1
+	return linked
 
 
 def list_closed_samples() -> List[Dict[str, Any]]:
 	"""Get all closed samples"""
-	return _read().get("closed_samples", [])
+	return _closed_samples.rows()
 
 
-def list_closed_samples_paginated(page: int = 1, per_page: int = 20, customer_name: Optional[str] = None) -> tuple[List[Dict[str, Any]], int, int]:
-	"""Get paginated closed samples with optional customer filter. Returns (samples, total_pages, total_count)"""
-	all_samples = _read().get("closed_samples", [])
-	
-	# Filter by customer name if specified
+def list_closed_sample_customers() -> List[str]:
+	"""The customer names of the closed samples, sorted, each once (from the index, without a scan)"""
+	return [name for name in _closed_samples.distinct("customer_names") if name]
+
+
+def list_closed_samples_by_sample(sample_id: int) -> List[Dict[str, Any]]:
+	"""The closed boxes of a received sample (sample_id index)"""
+	return _closed_samples.find("sample_id", sample_id)
+
+
+def count_closed_samples_by_sample(sample_id: int) -> int:
+	"""Number of closed boxes of a received sample (sample_id index)"""
+	return _closed_samples.count("sample_id", sample_id)
+
+
+def list_closed_samples_by_customer(customer_id: int) -> List[Dict[str, Any]]:
+	"""The closed boxes of a customer (customer_id index)"""
+	return _closed_samples.find("customer_id", customer_id)
+
+
+def list_closed_samples_between(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Closed samples closed between two dates (YYYY-MM-DD, inclusive, None for no bound), in date order"""
+	return _closed_samples.between("closing_date", date_from or None, date_to or None)
+
+
+def list_closed_samples_paginated(page: int = 1, per_page: int = 20, customer_name: Optional[str] = None, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Page:
+	"""Get paginated closed samples with optional customer filter. Returns (samples, total_pages, total_count, cursors)
+
+	With an after/before cursor token the page is found by key at the same cost
+	at any depth; with_total=False skips counting (see pagination.paginate).
+	date_from/date_to (YYYY-MM-DD, inclusive) keep the samples closed on those
+	days, found by binary search on the closing date index, in date order.
+	"""
+	if date_from or date_to:
+		where = (lambda s: (s.get("customer_name") or "").lower() == customer_name.lower()) if customer_name else None
+		return paginate_range(_closed_samples, "closing_date", _closing_date, date_from or None, date_to or None, page, per_page, after, before, where)
+	# Filter by customer name if specified; the table cuts the page itself
 	if customer_name:
-		all_samples = [s for s in all_samples if s.get("customer_name", "").lower() == customer_name.lower()]
-	
-	total_count = len(all_samples)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	# Calculate offset
-	offset = (page - 1) * per_page
-	
-	# Get samples for current page
-	samples = all_samples[offset:offset + per_page]
-	
-	return samples, total_pages, total_count
+		return paginate(_closed_samples, page, per_page, after, before, "customer_name", customer_name.lower(), with_total)
+	return paginate(_closed_samples, page, per_page, after, before, with_total=with_total)
 
 
+@write_step()
 def create_closed_sample(
 	closing_date: str,
 	customer_name: str,
@@ -58,22 +132,22 @@ def create_closed_sample(
 	box_symbol: str,
 	weight: float,
 	moisture: float,
-	note: str = ""
+	note: str = "",
+	customer_id: Optional[int] = None,
+	sample_id: Optional[int] = None
 ) -> int:
-	"""Create a new closed sample record"""
-	data = _read()
-	closed_sample_id = data["next_id"]
-	
+	"""Create a new closed sample record of the received sample sample_id (of customer_id)"""
 	# Calculate corrected weight (weight - moisture weight)
 	moisture_weight = weight * (moisture / 100) if moisture > 0 else 0
 	corrected_weight = weight - moisture_weight
 	
 	closed_sample = {
-		"id": closed_sample_id,
 		"closing_date": closing_date,
 		"customer_name": customer_name,
 		"sample_name": sample_name,
 		"encoding": encoding,
+		"customer_id": customer_id,
+		"sample_id": sample_id,
 		"box_symbol": box_symbol,
 		"weight": weight,
 		"moisture": moisture,
@@ -82,28 +156,26 @@ def create_closed_sample(
 		"created_at": datetime.now().isoformat()
 	}
 	
-	data["closed_samples"].append(closed_sample)
-	data["next_id"] += 1
-	_write(data)
-	
+	closed_sample_id = _closed_samples.insert(closed_sample)
+	count_change("closed_boxes", added=[closed_sample_customer(closed_sample)])
 	return closed_sample_id
 
 
+@write_step()
 def create_closed_sample_with_boxes(
 	closing_date: str,
 	customer_name: str,
 	sample_name: str,
 	encoding: str,
 	boxes: List[Dict[str, Any]],
-	note: str = ""
+	note: str = "",
+	customer_id: Optional[int] = None,
+	sample_id: Optional[int] = None
 ) -> List[int]:
-	"""Create multiple closed sample records for the same sample with different boxes"""
-	data = _read()
-	created_ids = []
+	"""Create multiple closed sample records for the same received sample (sample_id of customer_id) with different boxes"""
+	records = []
 	
 	for box in boxes:
-		closed_sample_id = data["next_id"]
-		
 		# Calculate corrected weight (weight - moisture weight)
 		weight = float(box.get("weight", 0))
 		moisture = float(box.get("moisture", 0))
@@ -111,11 +183,12 @@ def create_closed_sample_with_boxes(
 		corrected_weight = weight - moisture_weight
 		
 		closed_sample = {
-			"id": closed_sample_id,
 			"closing_date": closing_date,
 			"customer_name": customer_name,
 			"sample_name": sample_name,
 			"encoding": encoding,
+			"customer_id": customer_id,
+			"sample_id": sample_id,
 			"box_symbol": box.get("box_symbol", ""),
 			"weight": weight,
 			"moisture": moisture,
@@ -124,23 +197,20 @@ def create_closed_sample_with_boxes(
 			"created_at": datetime.now().isoformat()
 		}
 		
-		data["closed_samples"].append(closed_sample)
-		data["next_id"] += 1
-		created_ids.append(closed_sample_id)
+		records.append(closed_sample)
 	
-	_write(data)
-	return created_ids
+	# All boxes are written at once
+	closed_sample_ids = _closed_samples.insert_many(records)
+	count_change("closed_boxes", added=[closed_sample_customer(r) for r in records])
+	return closed_sample_ids
 
 
 def get_closed_sample(closed_sample_id: int) -> Optional[Dict[str, Any]]:
 	"""Get a specific closed sample by ID"""
-	closed_samples = list_closed_samples()
-	for sample in closed_samples:
-		if sample["id"] == closed_sample_id:
-			return sample
-	return None
+	return _closed_samples.get(closed_sample_id)
 
 
+@write_step()
 def update_closed_sample(
 	closed_sample_id: int,
 	closing_date: str,
@@ -150,45 +220,56 @@ def update_closed_sample(
 	box_symbol: str,
 	weight: float,
 	moisture: float,
-	note: str = ""
+	note: str = "",
+	expected_version: Optional[int] = None,
+	customer_id: Optional[int] = None,
+	sample_id: Optional[int] = None
 ) -> bool:
-	"""Update an existing closed sample"""
-	data = _read()
-	for sample in data["closed_samples"]:
-		if sample["id"] == closed_sample_id:
-			# Calculate corrected weight
-			moisture_weight = weight * (moisture / 100) if moisture > 0 else 0
-			corrected_weight = weight - moisture_weight
-			
-			sample["closing_date"] = closing_date
-			sample["customer_name"] = customer_name
-			sample["sample_name"] = sample_name
-			sample["encoding"] = encoding
-			sample["box_symbol"] = box_symbol
-			sample["weight"] = weight
-			sample["moisture"] = moisture
-			sample["corrected_weight"] = corrected_weight
-			sample["note"] = note
-			
-			_write(data)
-			return True
-	return False
+	"""Update an existing closed sample (VersionConflictError if expected_version is stale);
+	customer_id and sample_id relink it, else it keeps its links
+	"""
+	# Calculate corrected weight
+	moisture_weight = weight * (moisture / 100) if moisture > 0 else 0
+	corrected_weight = weight - moisture_weight
+	
+	old = _closed_samples.get(closed_sample_id)
+	if old is None:
+		return False
+	if customer_id is None and sample_id is None:
+		customer_id, sample_id = old.get("customer_id"), old.get("sample_id")
+	if not _closed_samples.update(closed_sample_id, {
+		"closing_date": closing_date,
+		"customer_name": customer_name,
+		"sample_name": sample_name,
+		"encoding": encoding,
+		"customer_id": customer_id,
+		"sample_id": sample_id,
+		"box_symbol": box_symbol,
+		"weight": weight,
+		"moisture": moisture,
+		"corrected_weight": corrected_weight,
+		"note": note,
+	}, expected_version=expected_version):
+		return False
+	count_change("closed_boxes", removed=[closed_sample_customer(old)], added=[closed_sample_customer({**old, "customer_name": customer_name, "customer_id": customer_id})])
+	return True
 
 
+@write_step()
 def delete_closed_sample(closed_sample_id: int) -> bool:
 	"""Delete a closed sample"""
-	data = _read()
-	data["closed_samples"] = [s for s in data["closed_samples"] if s["id"] != closed_sample_id]
-	_write(data)
+	old = _closed_samples.get(closed_sample_id)
+	if old is not None and _closed_samples.delete(closed_sample_id):
+		count_change("closed_boxes", removed=[closed_sample_customer(old)])
 	return True
 
 
-def export_closed_samples_to_excel() -> str:
-	"""Export closed samples to Excel format"""
+def export_closed_samples_to_excel(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export closed samples (optionally only those closed between two dates) to Excel format"""
 	import io
 	import pandas as pd
 	
-	closed_samples = list_closed_samples()
+	closed_samples = list_closed_samples_between(date_from, date_to) if date_from or date_to else list_closed_samples()
 	
 	# Create DataFrame
 	df = pd.DataFrame(closed_samples)
@@ -228,37 +309,29 @@ def export_closed_samples_to_excel() -> str:
 	return output.getvalue()
 
 
-def validate_sample_exists(customer_name: str, sample_name: str, encoding: str) -> tuple[bool, str]:
-	"""Validate if sample exists in the samples module. Returns (is_valid, error_message)"""
-	from .samples_store import list_samples
-	from .customers_store import list_customers
-	
-	# Get all samples and customers
-	all_samples = list_samples()
-	all_customers = list_customers()
-	
-	# Find customer by name
-	customer = None
-	for c in all_customers:
-		if c.get("name", "").lower() == customer_name.lower():
-			customer = c
-			break
+def find_sample_for_closing(customer_name: str, sample_name: str, encoding: str) -> tuple[Optional[Dict[str, Any]], str]:
+	"""Received sample a closed sample names. Returns (sample or None, error_message)"""
+	# Find customer by name (name index)
+	customer = find_customer_by_name(customer_name)
 	
 	if not customer:
-		return False, f"Không tìm thấy khách hàng '{customer_name}' trong module Nhận mẫu"
-	
-	customer_id = customer.get("id")
+		return None, f"Không tìm thấy khách hàng '{customer_name}' trong module Nhận mẫu"
 	
-	# Find sample by customer_id, sample_name, and sample_code
-	for sample in all_samples:
-		if (sample.get("customer_id") == customer_id and 
-			sample.get("sample_name", "").lower() == sample_name.lower() and
-			sample.get("sample_code", "").lower() == encoding.lower()):
-			return True, ""
+	# Find sample by sample_name and sample_code (identity index)
+	sample = find_sample_by_identity(customer.get("id"), sample_name, encoding)
+	if sample:
+		return sample, ""
 	
-	return False, f"Không tìm thấy mẫu '{sample_name}' với mã hóa '{encoding}' của khách hàng '{customer_name}' trong module Nhận mẫu"
+	return None, f"Không tìm thấy mẫu '{sample_name}' với mã hóa '{encoding}' của khách hàng '{customer_name}' trong module Nhận mẫu"
+
+
+def validate_sample_exists(customer_name: str, sample_name: str, encoding: str) -> tuple[bool, str]:
+	"""Validate if sample exists in the samples module. Returns (is_valid, error_message)"""
+	sample, error_msg = find_sample_for_closing(customer_name, sample_name, encoding)
+	return sample is not None, error_msg
 
 
+@write_step()
 def import_closed_samples_from_csv(csv_content: str) -> tuple[int, List[str]]:
 	"""Import closed samples from CSV content. Returns (success_count, error_messages)"""
 	import csv
@@ -340,13 +413,13 @@ def import_closed_samples_from_csv(csv_content: str) -> tuple[int, List[str]]:
 				moisture = float(row.get('moisture', 0))
 				
 				# Validate sample exists in samples module
-				is_valid, error_msg = validate_sample_exists(
+				sample, error_msg = find_sample_for_closing(
 					row['customer_name'],
 					row['sample_name'],
 					row.get('encoding', '')
 				)
 				
-				if not is_valid:
+				if sample is None:
 					errors.append(f"Dòng {i}: {error_msg}")
 					continue
 				
@@ -359,7 +432,9 @@ def import_closed_samples_from_csv(csv_content: str) -> tuple[int, List[str]]:
 					box_symbol=row.get('box_symbol', ''),
 					weight=weight,
 					moisture=moisture,
-					note=row.get('note', '')
+					note=row.get('note', ''),
+					customer_id=sample.get('customer_id'),
+					sample_id=sample['id']
 				)
 				success_count += 1
 			except Exception as e:
@@ -1,86 +1,193 @@
-import json
-import os
 import io
 import csv
-from typing import Dict, Any, List, Optional
+import bisect
+from collections import Counter
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-CUSTOMERS_FILE = os.path.join(DATA_DIR, "customers.json")
+from . import storage
+from .similarity import fold
+from .table import open_table, write_step
 
+CUSTOMERS_FILE = storage.data_path("customers.json")
+COUNTERS_FILE = storage.data_path("customer_counters.json")
+# Records kept per customer by the samples, closing and irradiation stores
+COUNTER_FIELDS = ("samples", "closed_boxes", "irradiations")
+# Customers returned per autocomplete lookup
+SUGGEST_LIMIT = 10
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(CUSTOMERS_FILE):
-		with open(CUSTOMERS_FILE, "w", encoding="utf-8") as f:
-			json.dump({"next_id": 1, "customers": []}, f, ensure_ascii=False, indent=2)
 
+def customer_key(name: Optional[str]) -> str:
+	"""Customer name as looked up: trimmed, single-spaced, case-insensitive"""
+	return " ".join((name or "").split()).casefold()
 
-def _read() -> Dict[str, Any]:
-	_ensure_store()
-	with open(CUSTOMERS_FILE, "r", encoding="utf-8") as f:
-		return json.load(f)
 
-
-def _write(data: Dict[str, Any]) -> None:
-	with open(CUSTOMERS_FILE, "w", encoding="utf-8") as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+_customers = open_table(
+	CUSTOMERS_FILE,
+	"customers",
+	seed={"next_id": 1, "customers": []},
+	indexes={"name_key": lambda c: customer_key(c.get("name"))},
+)
+# One row of COUNTER_FIELDS per customer, kept up to date by count_change()
+_counters = open_table(COUNTERS_FILE, "counters", seed={"counters": []}, primary_key="customer_id", journal=True)
 
 
 def list_customers() -> List[Dict[str, Any]]:
-	return _read().get("customers", [])
+	return _customers.rows()
 
 
 def get_customer(customer_id: int) -> Optional[Dict[str, Any]]:
-	for c in list_customers():
-		if c.get("id") == customer_id:
-			return c
-	return None
+	"""Primary key lookup"""
+	return _customers.get(customer_id)
+
+
+def find_customer_by_name(name: str) -> Optional[Dict[str, Any]]:
+	"""The customer with this name, ignoring case and spacing (index lookup)"""
+	matches = _customers.find("name_key", customer_key(name))
+	return matches[0] if matches else None
+
+
+def customer_names() -> Dict[int, str]:
+	"""Read-only id -> name map of every customer, rebuilt only after customers.json changes"""
+	return _customers.memo("names", lambda rows: storage.freeze({c["id"]: c.get("name", "") for c in rows}))
+
+
+def _prefix_keys(rows: List[Dict[str, Any]]) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+	"""Sorted (folded key, id) arrays: whole names, then the later words of names and every word of organizations"""
+	names, words = [], []
+	for c in rows:
+		name = fold(c.get("name")).split()
+		organization = fold(c.get("organization")).split()
+		names.append((" ".join(name), c["id"]))
+		words.extend((" ".join(name[i:]), c["id"]) for i in range(1, len(name)))
+		words.extend((" ".join(organization[i:]), c["id"]) for i in range(len(organization)))
+	return sorted(names), sorted(words)
+
+
+def suggest_customers(q: str, limit: int = SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+	"""Up to `limit` customers as {id, name} whose name, a later word of it or their
+	organization starts with q, ignoring case and diacritics ("dat v" finds "Công ty
+	Đất Việt"). Names matching from their start come first, each group alphabetical.
+
+	Binary searches in sorted key arrays, rebuilt only after customers.json changes.
+	"""
+	prefix = fold(q)
+	names = customer_names()
+	found: List[int] = []
+	for keys in _customers.memo("prefixes", _prefix_keys):
+		i = bisect.bisect_left(keys, (prefix,))
+		while len(found) < limit and i < len(keys) and keys[i][0].startswith(prefix):
+			if keys[i][1] not in found:
+				found.append(keys[i][1])
+			i += 1
+	return [{"id": pk, "name": names.get(pk, "")} for pk in found]
 
 
 def create_customer(name: str, organization: str, phone: str, address: str, note: str) -> int:
-	data = _read()
-	customer_id = data.get("next_id", 1)
-	record = {
-		"id": customer_id,
+	return _customers.insert({
 		"name": name.strip(),
 		"organization": organization.strip(),
 		"phone": phone.strip(),
 		"address": address.strip(),
 		"note": note.strip(),
-	}
-	data.setdefault("customers", []).append(record)
-	data["next_id"] = customer_id + 1
-	_write(data)
-	return customer_id
+	})
 
 
 def update_customer(customer_id: int, name: str, organization: str, phone: str, address: str, note: str) -> bool:
-	data = _read()
-	found = False
-	for c in data.get("customers", []):
-		if c.get("id") == customer_id:
-			c["name"] = name.strip()
-			c["organization"] = organization.strip()
-			c["phone"] = phone.strip()
-			c["address"] = address.strip()
-			c["note"] = note.strip()
-			found = True
-			break
-	if not found:
-		return False
-	_write(data)
-	return True
+	return _customers.update(customer_id, {
+		"name": name.strip(),
+		"organization": organization.strip(),
+		"phone": phone.strip(),
+		"address": address.strip(),
+		"note": note.strip(),
+	})
 
 
+@write_step()
 def delete_customer(customer_id: int) -> bool:
-	data = _read()
-	customers = data.get("customers", [])
-	new_customers = [c for c in customers if c.get("id") != customer_id]
-	if len(new_customers) == len(customers):
-		return False
-	data["customers"] = new_customers
-	_write(data)
-	return True
+	"""Delete a customer; ValueError if samples, closed boxes or irradiations still refer to it"""
+	counts = customer_counts().get(customer_id)
+	if counts and any(counts.values()):
+		raise ValueError(
+			f"Không thể xóa khách hàng: còn {counts['samples']} mẫu, {counts['closed_boxes']} hộp mẫu đóng "
+			f"và {counts['irradiations']} lượt chiếu xạ"
+		)
+	_counters.delete(customer_id)
+	return _customers.delete(customer_id)
+
+
+def customer_counts() -> Dict[int, Dict[str, int]]:
+	"""Read-only customer id -> {samples, closed_boxes, irradiations} map (customers with a count only)"""
+	if not _counters.size():
+		rebuild_customer_counts()
+	return _counters.memo("counts", lambda rows: storage.freeze({
+		r["customer_id"]: {field: r.get(field, 0) for field in COUNTER_FIELDS} for r in rows
+	}))
+
+
+def count_change(field: str, removed: Iterable[Any] = (), added: Iterable[Any] = ()) -> None:
+	"""Move a customer counter after a write: one per customer id in added, minus one per id in
+	removed (None ids, i.e. records not attributed to a customer, are ignored).
+	"""
+	delta = Counter(pk for pk in added if pk is not None)
+	delta.subtract(pk for pk in removed if pk is not None)
+	delta = {pk: n for pk, n in delta.items() if n}
+	if not delta:
+		return
+	if not _counters.size():
+		# First write since the counters were dropped: count everything, this write included
+		rebuild_customer_counts()
+		return
+	for pk, n in delta.items():
+		_bump(pk, field, n)
+
+
+def _bump(customer_id: Any, field: str, n: int) -> None:
+	def bump(row: Dict[str, Any]) -> None:
+		row[field] = max(row.get(field, 0) + n, 0)
+	if not _counters.update(customer_id, bump):
+		# The customer's first record: add its row under the write lock, then count
+		_counters.insert_many(lambda: [] if _counters.get(customer_id) else [
+			{"customer_id": customer_id, **{f: 0 for f in COUNTER_FIELDS}}
+		])
+		_counters.update(customer_id, bump)
+
+
+def rebuild_customer_counts() -> Dict[str, int]:
+	"""Recount every customer's records from the stores (after an import or a manual edit of
+	the data files) and return the totals per counter.
+	"""
+	from .samples_store import list_samples
+	from .closed_samples_store import closed_sample_customer, list_closed_samples
+	from .channel_7_1_store import list_channel_7_1_irradiations
+	from .thermal_column_store import list_thermal_column_irradiations
+	from .rotating_disk_store import batch_customers, load_rotating_disk_irradiations
+	
+	counts = {field: Counter() for field in COUNTER_FIELDS}
+	counts["samples"].update(s.get("customer_id") for s in list_samples())
+	counts["closed_boxes"].update(closed_sample_customer(r) for r in list_closed_samples())
+	for irradiation in list_channel_7_1_irradiations() + list_thermal_column_irradiations():
+		counts["irradiations"][irradiation_customer(irradiation)] += 1
+	for batch in load_rotating_disk_irradiations():
+		counts["irradiations"].update(batch_customers(batch))
+	for counter in counts.values():
+		counter.pop(None, None)
+	
+	ids = {c["id"] for c in list_customers()}.union(*counts.values())
+	_counters.replace_all([
+		{"customer_id": pk, **{field: counts[field][pk] for field in COUNTER_FIELDS}}
+		for pk in sorted(ids)
+	])
+	return {field: sum(counts[field].values()) for field in COUNTER_FIELDS}
+
+
+def irradiation_customer(irradiation: Dict[str, Any]) -> Optional[int]:
+	"""Customer an irradiation record counts for: the one stamped on it when it was created,
+	else the only customer with a sample of its code, else None
+	"""
+	if irradiation.get("customer_id") is not None:
+		return irradiation["customer_id"]
+	from .samples_store import customer_of_sample_code
+	return customer_of_sample_code(irradiation.get("sample_code"))
 
 
 def export_customers_to_excel() -> str:
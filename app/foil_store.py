@@ -1,53 +1,60 @@
-import json
-import os
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-FOILS_FILE = os.path.join(DATA_DIR, "foils.json")
+from .pagination import Page, paginate, paginate_range
+from .storage import data_path
+from .table import open_table
 
+FOILS_FILE = data_path("foils.json")
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(FOILS_FILE):
-		with open(FOILS_FILE, "w", encoding="utf-8") as f:
-			json.dump({"next_id": 1, "foils": []}, f, ensure_ascii=False, indent=2)
+def _closing_date(record: Dict[str, Any]) -> str:
+	return record.get("closing_date") or ""
 
 
-def _read() -> Dict[str, Any]:
-	_ensure_store()
-	with open(FOILS_FILE, "r", encoding="utf-8") as f:
-		return json.load(f)
-
-
-def _write(data: Dict[str, Any]) -> None:
-	with open(FOILS_FILE, "w", encoding="utf-8") as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+_foils = open_table(
+	FOILS_FILE,
+	"foils",
+	seed={"next_id": 1, "foils": []},
+	indexes={
+		"foil_type": lambda f: (f.get("foil_type") or "").lower(),
+		# Types as written, for the filter dropdown (Table.distinct)
+		"foil_types": lambda f: f.get("foil_type") or None,
+		# Sorted by date for range queries (Table.between)
+		"closing_date": _closing_date,
+	},
+)
 
 
 def list_foils() -> List[Dict[str, Any]]:
 	"""Get all foils"""
-	return _read().get("foils", [])
+	return _foils.rows()
 
 
-def list_foils_paginated(page: int = 1, per_page: int = 20, foil_type: Optional[str] = None) -> tuple[List[Dict[str, Any]], int, int]:
-	"""Get paginated foils with optional type filter. Returns (foils, total_pages, total_count)"""
-	all_foils = _read().get("foils", [])
-	
-	# Filter by foil type if specified
+def list_foil_types() -> List[str]:
+	"""The foil types in use, sorted, each once (from the index, without a scan)"""
+	return [foil_type for foil_type in _foils.distinct("foil_types") if foil_type]
+
+
+def list_foils_between(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Foils closed between two dates (YYYY-MM-DD, inclusive, None for no bound), in date order"""
+	return _foils.between("closing_date", date_from or None, date_to or None)
+
+
+def list_foils_paginated(page: int = 1, per_page: int = 20, foil_type: Optional[str] = None, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Page:
+	"""Get paginated foils with optional type filter. Returns (foils, total_pages, total_count, cursors)
+
+	With an after/before cursor token the page is found by key at the same cost
+	at any depth; with_total=False skips counting (see pagination.paginate).
+	date_from/date_to (YYYY-MM-DD, inclusive) keep the foils closed on those
+	days, found by binary search on the closing date index, in date order.
+	"""
+	if date_from or date_to:
+		where = (lambda r: (r.get("foil_type") or "").lower() == foil_type.lower()) if foil_type else None
+		return paginate_range(_foils, "closing_date", _closing_date, date_from or None, date_to or None, page, per_page, after, before, where)
+	# Filter by foil type if specified; the table cuts the page itself
 	if foil_type:
-		all_foils = [f for f in all_foils if f.get("foil_type", "").lower() == foil_type.lower()]
-	
-	total_count = len(all_foils)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	# Calculate offset
-	offset = (page - 1) * per_page
-	
-	# Get foils for current page
-	foils = all_foils[offset:offset + per_page]
-	
-	return foils, total_pages, total_count
+		return paginate(_foils, page, per_page, after, before, "foil_type", foil_type.lower(), with_total)
+	return paginate(_foils, page, per_page, after, before, with_total=with_total)
 
 
 def create_foil(
@@ -57,11 +64,7 @@ def create_foil(
 	note: str = ""
 ) -> int:
 	"""Create a new foil record"""
-	data = _read()
-	foil_id = data["next_id"]
-	
 	foil = {
-		"id": foil_id,
 		"foil_code": foil_code,
 		"foil_type": foil_type,
 		"weight": weight,
@@ -70,20 +73,12 @@ def create_foil(
 		"created_at": datetime.now().isoformat()
 	}
 	
-	data["foils"].append(foil)
-	data["next_id"] += 1
-	_write(data)
-	
-	return foil_id
+	return _foils.insert(foil)
 
 
 def get_foil(foil_id: int) -> Optional[Dict[str, Any]]:
 	"""Get a specific foil by ID"""
-	foils = list_foils()
-	for foil in foils:
-		if foil["id"] == foil_id:
-			return foil
-	return None
+	return _foils.get(foil_id)
 
 
 def update_foil(
@@ -94,33 +89,26 @@ def update_foil(
 	note: str = ""
 ) -> bool:
 	"""Update an existing foil"""
-	data = _read()
-	for foil in data["foils"]:
-		if foil["id"] == foil_id:
-			foil["foil_code"] = foil_code
-			foil["foil_type"] = foil_type
-			foil["weight"] = weight
-			foil["note"] = note
-			
-			_write(data)
-			return True
-	return False
+	return _foils.update(foil_id, {
+		"foil_code": foil_code,
+		"foil_type": foil_type,
+		"weight": weight,
+		"note": note,
+	})
 
 
 def delete_foil(foil_id: int) -> bool:
 	"""Delete a foil"""
-	data = _read()
-	data["foils"] = [f for f in data["foils"] if f["id"] != foil_id]
-	_write(data)
+	_foils.delete(foil_id)
 	return True
 
 
-def export_foils_to_excel() -> str:
-	"""Export foils to Excel format"""
+def export_foils_to_excel(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export foils (optionally only those closed between two dates) to Excel format"""
 	import io
 	import pandas as pd
 	
-	foils = list_foils()
+	foils = list_foils_between(date_from, date_to) if date_from or date_to else list_foils()
 	
 	# Create DataFrame
 	df = pd.DataFrame(foils)
@@ -0,0 +1,476 @@
+import itertools
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+
+from . import serializer, storage
+from .table import JOURNAL_COMPACT_BYTES, JOURNAL_SEQ_FIELD, VERSION_FIELD, Record, Table, check_version, key_range, keyset_bounds, order_key
+
+# Offset index layout: header, the document fields as JSON (padded to 8 bytes),
+# then int64 arrays of n entries: primary keys in record order, primary keys
+# sorted, and the (offset, length) of each sorted key's line (2n entries)
+_MAGIC = b"NAAJSNL1"
+_HEADER = struct.Struct("<8sqqqq")  # magic, generation, data size, n, document length
+
+
+def index_path(path: str) -> str:
+	"""Offset index of the JSON Lines table replacing the data file `path`"""
+	return os.path.splitext(path)[0] + ".jsonl.idx"
+
+
+def _check_pk(pk: Any) -> None:
+	if not isinstance(pk, int) or isinstance(pk, bool):
+		raise TypeError(f"JSON Lines tables need integer primary keys, got {pk!r}")
+
+
+class LinesTable(Table):
+	"""Table kept as JSON Lines, one record per line, with a sidecar offset index.
+
+	`<name>.<generation>.jsonl` holds the records and `<name>.jsonl.idx` maps
+	primary keys to the byte range of their line. The index is read through
+	mmap, so get() and page() decode only the records they return instead of
+	the whole file. An update appends the new version of the record and
+	repoints the index; superseded lines are dropped when the file is
+	rewritten as the next generation (compaction), after which the index is
+	swapped atomically.
+
+	Primary keys must be integers. Secondary indexes are built on first use by
+	reading every line once, then kept up to date by the writes.
+	"""
+
+	def __init__(self, path: str, collection: str, **options: Any) -> None:
+		super().__init__(path, collection, **options)
+		self.index_path = index_path(path)
+		self._sig: Optional[Tuple[int, int, int]] = None
+		self._map: Optional[mmap.mmap] = None
+		self._views: List[memoryview] = []
+		self._data = None  # unbuffered handle on the current generation
+		self._gen = 0
+		self._flushed = 0  # bytes of the data file covered by the index
+		self._tail = bytearray()  # appended lines not flushed yet
+		self._fields: Record = {}  # document fields (next_id, last_updated, ...)
+		self._order: Any = array("q")
+		self._keys: Any = array("q")
+		self._locs: Any = array("q")
+		self._built = False
+		self._all: Optional[List[Record]] = None
+
+	def _data_path(self, gen: int) -> str:
+		return f"{os.path.splitext(self.path)[0]}.{gen}.jsonl"
+
+	# Loading
+
+	def _ensure_store(self) -> None:
+		if os.path.exists(self.index_path):
+			return
+		with storage.file_lock(self.path):
+			if os.path.exists(self.index_path):
+				return
+			if os.path.exists(self.path):
+				# First start on this format: convert the JSON data file (and any journal)
+				doc = Table(self.path, self.collection, primary_key=self.primary_key, journal=True).document()
+			else:
+				doc = self.seed() if callable(self.seed) else self.seed
+			fields = {k: v for k, v in doc.items() if k not in (self.collection, JOURNAL_SEQ_FIELD)}
+			self._write_generation(doc.get(self.collection, []), fields)
+
+	def _refresh(self) -> None:
+		"""Map the offset index again if another process replaced it"""
+		self._ensure_store()
+		st = os.stat(self.index_path)
+		if (st.st_mtime_ns, st.st_size, st.st_ino) != self._sig:
+			self._load()
+			self._built = False
+			self._all = None
+
+	def _token(self) -> Any:
+		return self._sig
+
+	def _load(self) -> None:
+		for attempt in range(3):
+			self._close()
+			try:
+				with open(self.index_path, "rb") as f:
+					st = os.fstat(f.fileno())
+					self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				magic, gen, size, n, fields_len = _HEADER.unpack_from(self._map)
+				if magic != _MAGIC:
+					raise ValueError(f"Not a JSON Lines index: {self.index_path}")
+				# The generation may have been compacted away since the index was read
+				self._data = open(self._data_path(gen), "rb", buffering=0)
+			except FileNotFoundError:
+				if attempt == 2:
+					raise
+				continue
+			break
+		start = _HEADER.size
+		self._fields = storage.freeze(serializer.loads(self._map[start:start + fields_len]))
+		start += -(-fields_len // 8) * 8
+		view = memoryview(self._map)
+		self._order = view[start:start + 8 * n].cast("q")
+		self._keys = view[start + 8 * n:start + 16 * n].cast("q")
+		self._locs = view[start + 16 * n:start + 32 * n].cast("q")
+		self._views = [self._order, self._keys, self._locs, view]
+		self._gen = gen
+		self._flushed = size
+		self._tail = bytearray()
+		self._sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+	def _close(self) -> None:
+		for view in self._views:
+			view.release()
+		self._views = []
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+		if self._data is not None:
+			self._data.close()
+			self._data = None
+
+	# Record access
+
+	def _find(self, pk: Any) -> int:
+		"""Position of pk in the sorted keys, or -1"""
+		if not isinstance(pk, int):
+			return -1
+		i = bisect_left(self._keys, pk)
+		return i if i < len(self._keys) and self._keys[i] == pk else -1
+
+	def _read(self, offset: int, length: int) -> bytes:
+		if offset >= self._flushed:
+			offset -= self._flushed
+			return bytes(self._tail[offset:offset + length])
+		self._data.seek(offset)
+		return self._data.read(length)
+
+	def _decode(self, i: int) -> Record:
+		return storage.freeze(serializer.loads(self._read(self._locs[2 * i], self._locs[2 * i + 1])))
+
+	def _records(self, pks: Iterable[Any]) -> List[Record]:
+		return [self._decode(self._find(pk)) for pk in pks]
+
+	def _rows(self) -> List[Record]:
+		if self._all is None:
+			self._data.seek(0)
+			chunk = bytearray()
+			while len(chunk) < self._flushed:
+				block = self._data.read(self._flushed - len(chunk))
+				if not block:
+					break
+				chunk += block
+			chunk += self._tail
+			locs = {pk: (self._locs[2 * i], self._locs[2 * i + 1]) for i, pk in enumerate(self._keys)}
+			rows = []
+			for pk in self._order:
+				offset, length = locs[pk]
+				rows.append(storage.freeze(serializer.loads(chunk[offset:offset + length])))
+			self._all = storage.FrozenList(rows)
+		return self._all
+
+	def _index(self, name: str) -> Any:
+		"""A secondary index, built from every line the first time it is used"""
+		if not self._built:
+			for index in self.indexes.values():
+				index.clear()
+			self._seq = {}
+			rows = self._rows() if self.indexes else []
+			for seq, record in enumerate(rows):
+				pk = record[self.primary_key]
+				self._seq[pk] = seq
+				for index in self.indexes.values():
+					index.add(seq, pk, record)
+			self._counter = itertools.count(len(rows))
+			self._built = True
+		return self.indexes[name]
+
+	# Reads
+
+	def document(self) -> Record:
+		with self._lock:
+			self._sync()
+			return storage.freeze({**self._fields, self.collection: self._rows()})
+
+	def rows(self) -> List[Record]:
+		with self._lock:
+			self._sync()
+			return self._rows()
+
+	def get(self, pk: Any) -> Optional[Record]:
+		with self._lock:
+			self._sync()
+			i = self._find(pk)
+			return self._decode(i) if i >= 0 else None
+
+	def find(self, index: str, key: Any) -> List[Record]:
+		with self._lock:
+			self._sync()
+			return self._records(self._index(index).lookup(key))
+
+	def count(self, index: str, key: Any) -> int:
+		with self._lock:
+			self._sync()
+			return self._index(index).count(key)
+
+	def size(self) -> int:
+		with self._lock:
+			self._sync()
+			return len(self._order)
+
+	def page(self, offset: int, limit: int, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], int]:
+		"""One page of records, decoding only the lines on that page"""
+		offset = max(offset, 0)
+		with self._lock:
+			self._sync()
+			if index is None:
+				return self._records(self._order[offset:offset + limit].tolist()), len(self._order)
+			pks = self._index(index).lookup(key)
+			return self._records(pks[offset:offset + limit]), len(pks)
+
+	def seek(self, limit: int, after: Any = None, before: Any = None, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], bool]:
+		"""Keyset page in primary key order, bisecting the sorted keys of the offset index"""
+		with self._lock:
+			self._sync()
+			if index is None:
+				start, end, more = keyset_bounds(self._keys, limit, after, before)
+				return [self._decode(i) for i in range(start, end)], more
+			pks = sorted(self._index(index).lookup(key))
+			start, end, more = keyset_bounds(pks, limit, after, before)
+			return self._records(pks[start:end]), more
+
+	def sort(self, order: str, descending: bool = False, index: Optional[str] = None, key: Any = None) -> List[Record]:
+		"""Records (all, or those whose indexed key equals `key`) ordered by index `order`, then by primary key"""
+		with self._lock:
+			self._sync()
+			pks = self._index(order).ordered(None if index is None else self._index(index).lookup(key))
+			records = self._records(pks)
+		return records[::-1] if descending else records
+
+	def between(self, index: str, low: Any = None, high: Any = None) -> List[Record]:
+		"""Records whose key in `index` lies between low and high (inclusive, None for no bound), in key order"""
+		with self._lock:
+			self._sync()
+			ix = self._index(index)
+			keys = ix.keys()
+			start, end = key_range([order_key(k) for k in keys], low, high)
+			return self._records(pk for k in keys[start:end] for pk in sorted(ix.lookup(k)))
+
+	def distinct(self, index: str) -> List[Any]:
+		"""The distinct keys of an index, sorted (read from the index alone, no record is decoded)"""
+		with self._lock:
+			self._sync()
+			return self._index(index).keys()
+
+	def overlap(self, index: str, tokens: Iterable[Any], at_least: int = 1) -> List[Tuple[Record, int]]:
+		"""Records filed under at least `at_least` of `tokens` in a TokenIndex, with how many, most first"""
+		with self._lock:
+			self._sync()
+			counts = self._index(index).overlap(tokens)
+			pks = sorted((pk for pk, n in counts.items() if n >= at_least), key=lambda pk: (-counts[pk], pk))
+			return list(zip(self._records(pks), (counts[pk] for pk in pks)))
+
+	# Writes
+
+	def _edit(self) -> None:
+		"""Copy the mapped arrays before the first change of a write"""
+		if not isinstance(self._order, array):
+			self._order, self._keys, self._locs = array("q", self._order), array("q", self._keys), array("q", self._locs)
+		self._all = None
+		self._dirty = True
+
+	def _append(self, record: Record) -> Tuple[int, int]:
+		line = serializer.dumps(record) + b"\n"
+		offset = self._flushed + len(self._tail)
+		self._tail += line
+		return offset, len(line)
+
+	def _set_fields(self, fields: Record) -> None:
+		self._fields = storage.freeze({**self._fields, **self._meta(fields)})
+
+	def _index_record(self, pk: Any, old: Optional[Record], new: Optional[Record]) -> None:
+		if not self._built:
+			return
+		seq = self._seq[pk] if old is not None else next(self._counter)
+		for index in self.indexes.values():
+			if old is not None:
+				index.remove(seq, pk, old)
+			if new is not None:
+				index.add(seq, pk, new)
+		if new is None:
+			del self._seq[pk]
+		else:
+			self._seq[pk] = seq
+
+	def insert_many(self, records: Union[Iterable[Record], Callable[[], Iterable[Record]]]) -> List[Any]:
+		def insert() -> List[Any]:
+			new_rows = records() if callable(records) else records
+			fields: Record = {}
+			top = self._keys[-1] if self._keys else 0
+			new_records = []
+			seen = set()
+			# Check every record before touching the table, so a bad one writes nothing
+			for record in new_rows:
+				pk = record.get(self.primary_key)
+				if pk is None:
+					if "next_id" in self._fields:
+						pk = fields.get("next_id", self._fields["next_id"])
+						while pk in seen or self._find(pk) >= 0:
+							pk += 1
+						fields["next_id"] = pk + 1
+					else:
+						pk = top + 1
+					# Keep the primary key as the first field, like the hand-written records
+					record = {self.primary_key: pk, **record}
+				_check_pk(pk)
+				if pk in seen or self._find(pk) >= 0:
+					raise ValueError(f"Duplicate primary key {pk} in {self.collection}")
+				seen.add(pk)
+				top = max(top, pk)
+				if self.versioned and VERSION_FIELD not in record:
+					record = {**record, VERSION_FIELD: 1}
+				new_records.append((pk, record))
+			if not new_records:
+				return []
+			self._edit()
+			new_pks = []
+			for pk, record in new_records:
+				i = bisect_left(self._keys, pk)
+				self._keys.insert(i, pk)
+				self._locs[2 * i:2 * i] = array("q", self._append(record))
+				self._order.append(pk)
+				self._index_record(pk, None, storage.freeze(record))
+				new_pks.append(pk)
+			self._set_fields(fields)
+			return new_pks
+		return self._mutate(insert)
+
+	def update(
+		self,
+		pk: Any,
+		change: Union[Record, Callable[[Record], Optional[bool]]],
+		expected_version: Optional[int] = None,
+	) -> bool:
+		def update() -> bool:
+			i = self._find(pk)
+			if i < 0:
+				return False
+			old = self._decode(i)
+			check_version(pk, old, expected_version)
+			record = storage.thaw(old)
+			if callable(change):
+				if change(record) is False:
+					return False
+			else:
+				record.update(change)
+			if self.versioned:
+				record[VERSION_FIELD] = old.get(VERSION_FIELD, 0) + 1
+			self._edit()
+			self._locs[2 * i], self._locs[2 * i + 1] = self._append(record)
+			self._index_record(pk, old, storage.freeze(record))
+			self._set_fields({})
+			return True
+		return self._mutate(update)
+
+	def delete(self, pk: Any) -> bool:
+		def delete() -> bool:
+			i = self._find(pk)
+			if i < 0:
+				return False
+			old = self._decode(i) if self._built else None
+			self._edit()
+			del self._keys[i]
+			del self._locs[2 * i:2 * i + 2]
+			self._order.remove(pk)
+			if old is not None:
+				self._index_record(pk, old, None)
+			self._set_fields({})
+			return True
+		return self._mutate(delete)
+
+	def replace_all(self, rows: Iterable[Record], **meta: Any) -> None:
+		def replace() -> None:
+			self._write_generation(list(rows), {**self._fields, **self._meta(meta)})
+		self._mutate(replace)
+
+	def compact(self) -> None:
+		"""Rewrite the live records as a new generation, dropping superseded lines"""
+		self._mutate(lambda: self._write_generation(self._rows(), self._fields))
+
+	# Persistence
+
+	def _discard(self) -> None:
+		self._sig = None
+		self._tail = bytearray()
+		self._dirty = False
+		self._built = False
+		self._all = None
+
+	def _flush(self) -> None:
+		if not self._dirty:
+			return
+		if self._tail:
+			data_path = self._data_path(self._gen)
+			with open(data_path, "r+b") as f:
+				# Anything past the indexed size is a torn append from a crashed writer
+				f.seek(self._flushed)
+				f.truncate()
+				f.write(self._tail)
+				f.flush()
+				if storage.fsync_due(data_path):
+					os.fsync(f.fileno())
+		size = self._flushed + len(self._tail)
+		live = sum(self._locs[1::2])
+		if size - live > max(JOURNAL_COMPACT_BYTES, live):
+			self._write_generation(self._rows(), self._fields)
+		else:
+			self._write_index(self._gen, size, self._order, self._keys, self._locs)
+		self._dirty = False
+
+	def _write_index(self, gen: int, size: int, order: array, keys: array, locs: array) -> None:
+		fields = serializer.dumps(self._fields)
+		fields += b" " * (-len(fields) % 8)
+		content = _HEADER.pack(_MAGIC, gen, size, len(order), len(fields)) + fields
+		self._close()
+		storage.write_bytes(self.index_path, content + order.tobytes() + keys.tobytes() + locs.tobytes())
+		self._load()
+
+	def _write_generation(self, rows: List[Record], fields: Record) -> None:
+		"""Write `rows` as a new data file and point the index at it"""
+		gen = self._gen + 1
+		data_path = self._data_path(gen)
+		order = array("q")
+		entries = []
+		seen = set()
+		offset = 0
+		with open(data_path, "wb") as f:
+			for record in rows:
+				pk = record.get(self.primary_key)
+				_check_pk(pk)
+				if pk in seen:
+					# First match wins, like the JSON tables
+					continue
+				seen.add(pk)
+				line = serializer.dumps(record) + b"\n"
+				f.write(line)
+				order.append(pk)
+				entries.append((pk, offset, len(line)))
+				offset += len(line)
+			f.flush()
+			if storage.fsync_due(data_path):
+				os.fsync(f.fileno())
+		entries.sort()
+		keys = array("q", [pk for pk, _, _ in entries])
+		locs = array("q", [n for _, offset, length in entries for n in (offset, length)])
+		self._fields = storage.freeze(fields)
+		self._write_index(gen, offset, order, keys, locs)
+		old_path = self._data_path(gen - 1)
+		try:
+			if os.path.exists(old_path):
+				os.remove(old_path)
+		except OSError:
+			pass  # still open elsewhere (Windows): leave the old generation behind
+		self._built = False
+		self._all = None
+		self._dirty = False
@@ -0,0 +1,132 @@
+import base64
+import binascii
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import serializer
+from .table import Record, keyset_bounds
+
+# (records, total_pages, total_count, cursors) returned by the list_*_paginated functions
+Page = Tuple[List[Record], Optional[int], Optional[int], Dict[str, Optional[str]]]
+
+
+def encode_cursor(key: Any) -> str:
+	"""Opaque query-string token for the sort key of a record"""
+	return base64.urlsafe_b64encode(serializer.dumps(key)).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Any:
+	"""Sort key carried by a token, or None if it is missing or malformed"""
+	if not token:
+		return None
+	try:
+		return serializer.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+	except (binascii.Error, ValueError):
+		return None
+
+
+def paginate(
+	table: Any,
+	page: int = 1,
+	per_page: int = 20,
+	after: Optional[str] = None,
+	before: Optional[str] = None,
+	index: Optional[str] = None,
+	key: Any = None,
+	with_total: bool = True,
+) -> Page:
+	"""One page of a table, or of the records whose indexed key equals `key`.
+
+	With an `after`/`before` token the page is found by primary key through
+	table.seek(), at the same cost at any depth, and `page` is ignored.
+	Otherwise it is the page-th page. cursors holds the "prev" and "next"
+	tokens, None at either end. with_total=False skips counting: both totals
+	are then None.
+	"""
+	after_key, before_key = decode_cursor(after), decode_cursor(before)
+	total_count = None
+	try:
+		if after_key is not None or before_key is not None:
+			records, more = table.seek(per_page, after=after_key, before=before_key, index=index, key=key)
+			has_prev, has_next = (True, more) if after_key is not None else (more, True)
+			if with_total:
+				total_count = table.size() if index is None else table.count(index, key)
+			return _page(records, has_prev, has_next, total_count, per_page, lambda r: r[table.primary_key])
+	except TypeError:
+		pass  # a token from another table: start over at page 1
+	page = max(page, 1)
+	if with_total or page > 1:
+		records, total_count = table.page((page - 1) * per_page, per_page, index, key)
+		has_next = page * per_page < total_count
+	else:
+		records, has_next = table.seek(per_page, index=index, key=key)
+	return _page(records, page > 1, has_next, total_count if with_total else None, per_page, lambda r: r[table.primary_key])
+
+
+def paginate_sorted(
+	records: Sequence[Record],
+	key_of: Callable[[Record], Any],
+	page: int = 1,
+	per_page: int = 20,
+	after: Optional[str] = None,
+	before: Optional[str] = None,
+	reverse: bool = False,
+) -> Page:
+	"""paginate() for records already filtered and sorted by key_of (descending with reverse=True)"""
+	ordered = list(reversed(records)) if reverse else list(records)
+	keys = [key_of(r) for r in ordered]
+	after_key, before_key = decode_cursor(after), decode_cursor(before)
+	if reverse:
+		# Following a key in descending order is preceding it in ascending order
+		after_key, before_key = before_key, after_key
+	try:
+		if after_key is not None or before_key is not None:
+			start, end, more = keyset_bounds(keys, per_page, after_key, before_key)
+			has_prev, has_next = (True, more) if after_key is not None else (more, True)
+			if reverse:
+				has_prev, has_next = has_next, has_prev
+			chunk = ordered[start:end]
+			return _page(chunk[::-1] if reverse else chunk, has_prev, has_next, len(records), per_page, key_of)
+	except TypeError:
+		pass
+	page = max(page, 1)
+	offset = (page - 1) * per_page
+	chunk = list(records[offset:offset + per_page])
+	return _page(chunk, page > 1, offset + per_page < len(records), len(records), per_page, key_of)
+
+
+def paginate_range(
+	table: Any,
+	index: str,
+	key_of: Callable[[Record], Any],
+	low: Any = None,
+	high: Any = None,
+	page: int = 1,
+	per_page: int = 20,
+	after: Optional[str] = None,
+	before: Optional[str] = None,
+	where: Optional[Callable[[Record], bool]] = None,
+) -> Page:
+	"""paginate() over the records whose key in `index` (key_of(record)) lies between
+	low and high, inclusive, found by binary search (see Table.between). They come
+	in key order; where(record) filters them further.
+	"""
+	records = table.between(index, low, high)
+	if where is not None:
+		records = [r for r in records if where(r)]
+	return paginate_sorted(records, lambda r: [key_of(r), r[table.primary_key]], page, per_page, after, before)
+
+
+def _page(
+	records: List[Record],
+	has_prev: bool,
+	has_next: bool,
+	total_count: Optional[int],
+	per_page: int,
+	key_of: Callable[[Record], Any],
+) -> Page:
+	cursors = {
+		"prev": encode_cursor(key_of(records[0])) if records and has_prev else None,
+		"next": encode_cursor(key_of(records[-1])) if records and has_next else None,
+	}
+	total_pages = (total_count + per_page - 1) // per_page if total_count is not None else None
+	return records, total_pages, total_count, cursors
@@ -1,66 +1,71 @@
 import json
-import os
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from .customers_store import count_change, irradiation_customer
+from .pagination import Page, paginate, paginate_range
+from .storage import data_path
+from .table import open_table, write_step
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-ROTATING_DISK_FILE = os.path.join(DATA_DIR, "rotating_disk_irradiations.json")
 
+ROTATING_DISK_FILE = data_path("rotating_disk_irradiations.json")
 
-def _ensure_store() -> None:
-	"""Ensure the data directory and file exist"""
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(ROTATING_DISK_FILE):
-		with open(ROTATING_DISK_FILE, 'w', encoding='utf-8') as f:
-			json.dump({"batches": []}, f, ensure_ascii=False, indent=2)
+
+def _created_date(batch: Dict) -> str:
+	"""Day part (YYYY-MM-DD) of created_at"""
+	return (batch.get('created_at') or '')[:10]
+
+
+# Sorted by day for range queries (Table.between)
+_batches = open_table(ROTATING_DISK_FILE, "batches", seed={"batches": []}, primary_key="batch_id", indexes={"created_date": _created_date})
+
+
+def batch_customers(batch: Dict) -> List[Optional[int]]:
+	"""Customer each sample of a batch counts for (see customers_store.irradiation_customer)"""
+	return [irradiation_customer(sample) for sample in batch.get('samples') or []]
 
 
 def load_rotating_disk_irradiations() -> List[Dict]:
 	"""Load all rotating disk irradiations from file"""
-	_ensure_store()
 	try:
-		with open(ROTATING_DISK_FILE, 'r', encoding='utf-8') as f:
-			data = json.load(f)
-			return data.get("batches", [])
-	except (FileNotFoundError, json.JSONDecodeError):
+		return _batches.rows()
+	except json.JSONDecodeError:
 		return []
 
 
+@write_step()
 def save_rotating_disk_irradiations(batches: List[Dict]) -> None:
 	"""Save rotating disk irradiations to file"""
-	_ensure_store()
-	with open(ROTATING_DISK_FILE, 'w', encoding='utf-8') as f:
-		json.dump({"batches": batches}, f, ensure_ascii=False, indent=2)
+	old = _batches.rows()
+	_batches.replace_all(batches)
+	count_change("irradiations", removed=[c for b in old for c in batch_customers(b)], added=[c for b in batches for c in batch_customers(b)])
 
 
-def list_rotating_disk_irradiations_paginated(page: int = 1, per_page: int = 20) -> Tuple[List[Dict], int, int]:
-	"""Get paginated list of rotating disk irradiation batches"""
-	batches = load_rotating_disk_irradiations()
-	total_count = len(batches)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	start_idx = (page - 1) * per_page
-	end_idx = start_idx + per_page
-	page_batches = batches[start_idx:end_idx]
-	
-	return page_batches, total_pages, total_count
+def list_rotating_disk_irradiations_between(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict]:
+	"""Rotating disk batches created between two dates (YYYY-MM-DD, inclusive, None for no bound), by date"""
+	return _batches.between("created_date", date_from or None, date_to or None)
+
 
+def list_rotating_disk_irradiations_paginated(page: int = 1, per_page: int = 20, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Page:
+	"""Get paginated list of rotating disk irradiation batches (see pagination.paginate for the cursors), optionally created between two dates"""
+	if date_from or date_to:
+		return paginate_range(_batches, "created_date", _created_date, date_from or None, date_to or None, page, per_page, after, before)
+	return paginate(_batches, page, per_page, after, before, with_total=with_total)
 
+
+@write_step()
 def create_rotating_disk_batch(start_time: str, irradiation_time: float, power: float, 
 							  samples: List[Dict], batch_note: str = "") -> Dict:
 	"""Create a new rotating disk irradiation batch"""
-	batches = load_rotating_disk_irradiations()
-	
-	# Generate new batch ID
-	next_batch_id = max([b.get('batch_id', 0) for b in batches], default=0) + 1
-	
 	# Calculate end time
 	start_dt = datetime.fromisoformat(start_time.replace('T', ' '))
 	end_dt = datetime.fromtimestamp(start_dt.timestamp() + (irradiation_time * 60))
 	
+	# Each sample is counted for its customer until the batch is deleted
+	samples = [{**sample, 'customer_id': irradiation_customer(sample)} for sample in samples]
+	
+	# The table numbers it max(batch_id) + 1
 	batch = {
-		'batch_id': next_batch_id,
 		'start_time': start_time,
 		'end_time': end_dt.isoformat(),
 		'irradiation_time': irradiation_time,
@@ -71,48 +76,48 @@ def create_rotating_disk_batch(start_time: str, irradiation_time: float, power:
 		'created_at': datetime.now().isoformat()
 	}
 	
-	batches.append(batch)
-	save_rotating_disk_irradiations(batches)
+	batch_id = _batches.insert(batch)
+	count_change("irradiations", added=batch_customers(batch))
 	
-	return batch
+	return _batches.get(batch_id)
 
 
 def get_rotating_disk_batch(batch_id: int) -> Optional[Dict]:
 	"""Get a specific rotating disk irradiation batch by ID"""
-	batches = load_rotating_disk_irradiations()
-	for batch in batches:
-		if batch.get('batch_id') == batch_id:
-			return batch
-	return None
+	return _batches.get(batch_id)
 
 
+@write_step()
 def update_rotating_disk_batch(batch_id: int, **kwargs) -> bool:
 	"""Update a rotating disk irradiation batch"""
-	batches = load_rotating_disk_irradiations()
-	for batch in batches:
-		if batch.get('batch_id') == batch_id:
-			batch.update(kwargs)
-			batch['updated_at'] = datetime.now().isoformat()
-			save_rotating_disk_irradiations(batches)
-			return True
-	return False
+	old = _batches.get(batch_id)
+	if old is None:
+		return False
+	if 'samples' in kwargs:
+		kwargs['samples'] = [{**sample, 'customer_id': irradiation_customer(sample)} for sample in kwargs['samples']]
+	if not _batches.update(batch_id, {**kwargs, 'updated_at': datetime.now().isoformat()}):
+		return False
+	if 'samples' in kwargs:
+		count_change("irradiations", removed=batch_customers(old), added=batch_customers(kwargs))
+	return True
 
 
+@write_step()
 def delete_rotating_disk_batch(batch_id: int) -> bool:
 	"""Delete a rotating disk irradiation batch"""
-	batches = load_rotating_disk_irradiations()
-	batches = [b for b in batches if b.get('batch_id') != batch_id]
-	save_rotating_disk_irradiations(batches)
+	old = _batches.get(batch_id)
+	if old is not None and _batches.delete(batch_id):
+		count_change("irradiations", removed=batch_customers(old))
 	return True
 
 
-def export_rotating_disk_irradiations_to_excel() -> str:
-	"""Export rotating disk irradiations to Excel file"""
+def export_rotating_disk_irradiations_to_excel(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export rotating disk irradiations (optionally only batches created between two dates) to Excel file"""
 	import pandas as pd
 	from io import BytesIO
 	import base64
 	
-	batches = load_rotating_disk_irradiations()
+	batches = list_rotating_disk_irradiations_between(date_from, date_to) if date_from or date_to else load_rotating_disk_irradiations()
 	
 	# Flatten data for Excel export
 	export_data = []
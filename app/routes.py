@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Blueprint, Response, abort, current_app, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context
+from itsdangerous import BadData, URLSafeTimedSerializer
+from typing import Optional
+from urllib.parse import quote
+import codecs
 import os
+import re
+import unicodedata
 
 from .auth import login_required, verify_credentials, admin_required, permission_required
-from .users_store import load_users, create_user, delete_user, DEFAULT_SECTIONS, get_workflow_roles, has_workflow_role, get_user, update_user, has_detailed_permission
+from .users_store import load_users, create_user, delete_user, DEFAULT_SECTIONS, get_workflow_roles, has_workflow_role, get_user, update_user, has_detailed_permission, has_permission
 from .task_assignment_store import (
     create_task_assignment, get_task_assignment, update_task_assignment, delete_task_assignment,
     get_tasks_by_user as get_assigned_tasks, get_tasks_assigned_by_user, handover_task,
@@ -10,20 +16,61 @@ from .task_assignment_store import (
     get_task_stage_info, load_task_assignments, can_handover_task, is_workflow_completed,
     upload_task_file, get_task_files, delete_task_file
 )
-from .customers_store import list_customers, create_customer, delete_customer, get_customer, update_customer, export_customers_to_excel
-from .samples_store import list_samples, list_samples_paginated, create_sample, delete_sample, get_sample, update_sample, import_samples_from_csv, export_samples_to_excel, save_filtered_samples_to_temp, load_filtered_samples_from_temp, cleanup_temp_file
-from .closed_samples_store import list_closed_samples, list_closed_samples_paginated, create_closed_sample, delete_closed_sample, export_closed_samples_to_excel, import_closed_samples_from_csv
-from .foil_store import list_foils, list_foils_paginated, create_foil, delete_foil, get_foil, update_foil, export_foils_to_excel, import_foils_from_csv
-from .standard_store import list_standards, list_standards_paginated, create_standard, delete_standard, get_standard, update_standard, export_standards_to_excel, import_standards_from_csv
-from .standard_inventory_store import list_inventories, list_inventories_paginated, create_inventory, delete_inventory, get_inventory, update_inventory, upload_certificate, get_certificate_path, export_inventories_to_excel
+from .customers_store import list_customers, create_customer, delete_customer, get_customer, update_customer, export_customers_to_excel, customer_names, customer_counts, suggest_customers, SUGGEST_LIMIT
+from .samples_store import list_samples, list_samples_by_customer, list_samples_paginated, create_sample, delete_sample, get_sample, update_sample, find_sample_conflict, find_similar_samples, describe_similar, import_samples_from_csv, iter_samples_csv, list_samples_between
+from .closed_samples_store import list_closed_sample_customers, list_closed_samples_by_customer, list_closed_samples_by_sample, list_closed_samples_paginated, create_closed_sample, delete_closed_sample, export_closed_samples_to_excel, import_closed_samples_from_csv
+from .foil_store import list_foil_types, list_foils_paginated, create_foil, delete_foil, get_foil, update_foil, export_foils_to_excel, import_foils_from_csv
+from .standard_store import list_standard_types, list_standards_paginated, create_standard, delete_standard, get_standard, update_standard, export_standards_to_excel, import_standards_from_csv
+from .standard_inventory_store import list_inventories, list_inventory_types, list_inventories_paginated, create_inventory, delete_inventory, get_inventory, update_inventory, upload_certificate, get_certificate_path, export_inventories_to_excel
 from .rotating_disk_store import list_rotating_disk_irradiations_paginated, create_rotating_disk_batch, delete_rotating_disk_batch, get_rotating_disk_batch, update_rotating_disk_batch, export_rotating_disk_irradiations_to_excel, create_rotating_disk_irradiation, get_rotating_disk_irradiation
 from .channel_7_1_store import list_channel_7_1_irradiations, list_channel_7_1_irradiations_paginated, create_channel_7_1_irradiation, delete_channel_7_1_irradiation, get_channel_7_1_irradiation, update_channel_7_1_irradiation, export_channel_7_1_irradiations_to_excel
 from .thermal_column_store import list_thermal_column_irradiations, list_thermal_column_irradiations_paginated, create_thermal_column_irradiation, delete_thermal_column_irradiation, get_thermal_column_irradiation, update_thermal_column_irradiation, export_thermal_column_irradiations_to_excel
+from .table import VersionConflictError
 
 
 pages = Blueprint("pages", __name__)
 
 
+def _form_version():
+	"""Record version the edit form was rendered with (None for forms without one)"""
+	version = request.form.get("version", "")
+	return int(version) if version.isdigit() else None
+
+
+def _cursor_args():
+	"""after/before cursor tokens of a list page; stepping by cursor skips counting the total"""
+	after, before = request.args.get("after"), request.args.get("before")
+	return {"after": after, "before": before, "with_total": not (after or before)}
+
+
+DATE_ARG = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _date_range_args(args=None):
+	"""from/to query arguments (YYYY-MM-DD, inclusive) as date_from/date_to; malformed dates are ignored"""
+	args = request.args if args is None else args
+	dates = {}
+	for name, arg in (("date_from", "from"), ("date_to", "to")):
+		value = (args.get(arg) or "").strip()
+		dates[name] = value if DATE_ARG.fullmatch(value) else None
+	return dates
+
+
+def _date_range_query(dates):
+	"""The same range as query arguments for the page's links, without the empty bounds"""
+	return {arg: dates[name] for name, arg in (("date_from", "from"), ("date_to", "to")) if dates[name]}
+
+
+SAMPLE_LIST_ARGS = ("q", "sample_type", "analysis_target", "sort", "dir")
+
+
+def _sample_filter_args(args=None):
+	"""The text filters and sort of the samples list as list_samples_paginated arguments"""
+	args = request.args if args is None else args
+	filters = {name: (args.get(name) or "").strip() for name in ("sample_type", "analysis_target", "q")}
+	return dict(filters, sort=args.get("sort") or None, descending=args.get("dir") == "desc")
+
+
 @pages.app_context_processor
 def inject_permissions():
 	"""Inject permission checking functions into template context"""
@@ -250,7 +297,7 @@ def users_update(username: str):
 @permission_required("customers")
 def customers_list():
 	customers = list_customers()
-	return render_template("customers/list.html", customers=customers)
+	return render_template("customers/list.html", customers=customers, counts=customer_counts())
 
 
 @pages.route("/customers/create", methods=["POST"]) 
@@ -272,10 +319,13 @@ def customers_create():
 @pages.route("/customers/delete/<int:customer_id>", methods=["POST"]) 
 @permission_required("customers")
 def customers_delete(customer_id: int):
-	if delete_customer(customer_id):
-		flash("Đã xoá khách hàng", "success")
-	else:
-		flash("Không tìm thấy khách hàng", "danger")
+	try:
+		if delete_customer(customer_id):
+			flash("Đã xoá khách hàng", "success")
+		else:
+			flash("Không tìm thấy khách hàng", "danger")
+	except ValueError as e:
+		flash(str(e), "danger")
 	return redirect(url_for("pages.customers_list"))
 
 
@@ -352,22 +402,34 @@ def samples_list():
 	# Convert customer_id to int if provided
 	customer_id = int(customer_id) if customer_id and customer_id.isdigit() else None
 	
-	# Get paginated samples
-	samples, total_pages, total_count = list_samples_paginated(page, per_page, customer_id)
-	customers = list_customers()
+	# Sorting and the other filters
+	sort = request.args.get('sort', '')
+	descending = request.args.get('dir') == 'desc'
+	filters = {name: request.args.get(name, '').strip() for name in ('sample_type', 'analysis_target', 'q')}
+	dates = _date_range_args()
 	
-	# Create customer lookup for display
-	customer_lookup = {c["id"]: c["name"] for c in customers}
+	# Get paginated samples
+	samples, total_pages, total_count, cursors = list_samples_paginated(
+		page, per_page, customer_id, sort=sort or None, descending=descending, **filters, **dates, **_cursor_args()
+	)
+	# Query arguments carried by the pagination and sort links
+	date_range = _date_range_query(dates)
+	list_args = {name: value for name, value in dict(filters, customer_id=customer_id, sort=sort, dir=request.args.get('dir', ''), **date_range).items() if value}
 	
 	return render_template("samples/list.html", 
 		samples=samples, 
-		customers=customers, 
-		customer_lookup=customer_lookup,
+		customer_lookup=customer_names(),
 		current_page=page,
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
-		selected_customer_id=customer_id
+		cursors=cursors,
+		selected_customer_id=customer_id,
+		filters=filters,
+		date_range=date_range,
+		sort=sort,
+		descending=descending,
+		list_args=list_args
 	)
 
 
@@ -385,8 +447,11 @@ def samples_create():
 		return redirect(url_for("pages.samples_list"))
 	
 	try:
-		create_sample(int(customer_id), sample_name, sample_code, sample_type, analysis_target, note)
+		sample_id = create_sample(int(customer_id), sample_name, sample_code, sample_type, analysis_target, note)
 		flash("Đã thêm mẫu", "success")
+		similar = find_similar_samples(sample_name, sample_code, exclude_id=sample_id)
+		if similar:
+			flash(f"Mẫu vừa thêm có thể trùng với mẫu {describe_similar(similar, int(customer_id))}", "warning")
 	except ValueError as e:
 		flash(str(e), "danger")
 	except Exception as e:
@@ -398,10 +463,13 @@ def samples_create():
 @pages.route("/receiving/delete/<int:sample_id>", methods=["POST"]) 
 @permission_required("receiving")
 def samples_delete(sample_id: int):
-	if delete_sample(sample_id):
-		flash("Đã xoá mẫu", "success")
-	else:
-		flash("Không tìm thấy mẫu", "danger")
+	try:
+		if delete_sample(sample_id):
+			flash("Đã xoá mẫu", "success")
+		else:
+			flash("Không tìm thấy mẫu", "danger")
+	except ValueError as e:
+		flash(str(e), "danger")
 	return redirect(url_for("pages.samples_list"))
 
 
@@ -430,10 +498,13 @@ def samples_update(sample_id: int):
 		return redirect(url_for("pages.samples_edit", sample_id=sample_id))
 	
 	try:
-		if update_sample(sample_id, int(customer_id), sample_name, sample_code, sample_type, analysis_target, note):
+		if update_sample(sample_id, int(customer_id), sample_name, sample_code, sample_type, analysis_target, note, expected_version=_form_version()):
 			flash("Đã cập nhật mẫu", "success")
 		else:
 			flash("Cập nhật thất bại", "danger")
+	except VersionConflictError as e:
+		flash(str(e), "warning")
+		return redirect(url_for("pages.samples_edit", sample_id=sample_id))
 	except ValueError as e:
 		flash(str(e), "danger")
 	except Exception as e:
@@ -468,7 +539,8 @@ def samples_import():
 			except UnicodeDecodeError:
 				csv_content = file.read().decode('cp1252')
 		
-		success_count, errors = import_samples_from_csv(csv_content)
+		all_or_nothing = request.form.get("import_mode") == "all"
+		success_count, errors = import_samples_from_csv(csv_content, all_or_nothing=all_or_nothing)
 		
 		if success_count > 0:
 			flash(f"Đã import thành công {success_count} mẫu", "success")
@@ -525,200 +597,84 @@ def samples_template():
 	return response
 
 
+EXPORT_TOKEN_MAX_AGE = 300  # seconds a token from /receiving/save-filtered stays valid
+
+
+def _export_signer() -> URLSafeTimedSerializer:
+	return URLSafeTimedSerializer(current_app.secret_key, salt="samples-export")
+
+
+def _export_filename(customer_id: Optional[int]) -> str:
+	"""ASCII download name, e.g. mau_khach_hang_Cong_ty_Dat_Viet.csv"""
+	if not customer_id:
+		return "tat_ca_mau.csv"
+	customer = get_customer(customer_id)
+	customer_name = customer["name"] if customer else f"KhachHang_{customer_id}"
+	# Drop Vietnamese accents (đ has no decomposition), then anything else unsafe
+	safe_name = unicodedata.normalize("NFKD", customer_name.replace('đ', 'd').replace('Đ', 'D'))
+	safe_name = safe_name.encode("ascii", "ignore").decode("ascii")
+	safe_name = re.sub(r'[^a-zA-Z0-9\-_]+', '_', safe_name).strip('_')[:30] or f"KhachHang_{customer_id}"
+	if safe_name[0].isdigit() or safe_name[0] in '._-':
+		safe_name = f"KhachHang_{safe_name}"
+	return f"mau_khach_hang_{safe_name}.csv"
+
+
 @pages.route("/receiving/export")
 @permission_required("receiving")
 def samples_export():
-	from flask import Response
-	
-	# Get filter parameters
-	customer_id = request.args.get('customer_id', '')
-	print(f"DEBUG: Received customer_id: {customer_id}")
-	print(f"DEBUG: Request args: {dict(request.args)}")
-	customer_id = int(customer_id) if customer_id and customer_id.isdigit() else None
-	print(f"DEBUG: Parsed customer_id: {customer_id}")
-	
-	# Export samples to Excel format
-	try:
-		csv_content = export_samples_to_excel(customer_id)
-		print(f"DEBUG: CSV content length: {len(csv_content)}")
-		print(f"DEBUG: CSV content preview: {csv_content[:200]}...")
-	except Exception as e:
-		print(f"DEBUG: Error in export_samples_to_excel: {e}")
-		flash(f"Lỗi xuất dữ liệu: {str(e)}", "danger")
-		return redirect(url_for("pages.samples_list"))
-	
-	# Determine filename - sanitize for safe download
-	if customer_id:
-		customers = list_customers()
-		customer_lookup = {c["id"]: c["name"] for c in customers}
-		customer_name = customer_lookup.get(customer_id, f"KhachHang_{customer_id}")
-		
-		# Sanitize customer name for filename
-		import re
-		safe_name = re.sub(r'[^\w\-_\.]', '_', customer_name)
-		safe_name = safe_name.replace(' ', '_')
-		# Limit filename length to avoid issues
-		if len(safe_name) > 50:
-			safe_name = safe_name[:50]
-		filename = f"mau_khach_hang_{safe_name}.csv"
+	"""Stream the samples (all, or one customer's) as CSV while they are read.
+
+	The filter (customer_id, the from/to received dates, the text filters and
+	the sort of the list) comes from the query string or from a signed ?token=
+	issued by /receiving/save-filtered.
+	"""
+	token = request.args.get('token')
+	if token:
+		try:
+			payload = _export_signer().loads(token, max_age=EXPORT_TOKEN_MAX_AGE)
+		except BadData:
+			flash("Liên kết xuất dữ liệu không hợp lệ hoặc đã hết hạn, vui lòng thử lại", "danger")
+			return redirect(url_for("pages.samples_list"))
+		customer_id = payload.get('customer_id')
+		dates = _date_range_args(payload)
+		filters = _sample_filter_args(payload)
 	else:
-		filename = "tat_ca_mau.csv"
+		customer_id = request.args.get('customer_id', '')
+		customer_id = int(customer_id) if customer_id and customer_id.isdigit() else None
+		dates = _date_range_args()
+		filters = _sample_filter_args()
 	
-	print(f"DEBUG: Filename: {filename}")
+	filename = _export_filename(customer_id)
 	
-	# Return with proper headers
-	from urllib.parse import quote
-	response = Response(
-		csv_content.encode('utf-8-sig'),  # Add BOM for Excel compatibility
+	def generate():
+		yield codecs.BOM_UTF8  # for Excel
+		for chunk in iter_samples_csv(customer_id, **dates, **filters):
+			yield chunk.encode('utf-8')
+	
+	return Response(
+		stream_with_context(generate()),
 		mimetype='text/csv; charset=utf-8',
 		headers={
 			'Content-Disposition': f'attachment; filename="{filename}"; filename*=UTF-8\'\'{quote(filename)}',
-			'Content-Type': 'text/csv; charset=utf-8',
 			'Cache-Control': 'no-cache'
 		}
 	)
-	return response
 
 
 @pages.route("/receiving/save-filtered")
 @permission_required("receiving")
 def samples_save_filtered():
-	"""Save filtered samples to temporary file and return temp file ID."""
-	try:
-		customer_id = request.args.get('customer_id', '')
-		customer_id = int(customer_id) if customer_id and customer_id.isdigit() else None
-		
-		print(f"DEBUG: Saving filtered samples for customer_id: {customer_id}")
-		
-		# Save filtered samples to temp file
-		temp_path = save_filtered_samples_to_temp(customer_id)
-		
-		# Return temp file ID (just the filename)
-		import os
-		temp_filename = os.path.basename(temp_path)
-		
-		return jsonify({"temp_file": temp_filename, "message": "Dữ liệu đã lọc đã được lưu"})
-		
-	except Exception as e:
-		print(f"DEBUG: Error in save-filtered: {e}")
-		return jsonify({"error": str(e)}), 500
-
-
-@pages.route("/receiving/export-from-temp/<temp_filename>")
-@permission_required("receiving")
-def samples_export_from_temp(temp_filename):
-	"""Export samples from temporary file."""
-	from flask import Response
-	import os
-	
-	# Construct temp file path
-	temp_dir = os.path.join(os.path.dirname(__file__), "..", "temp")
-	temp_path = os.path.join(temp_dir, temp_filename)
-	
-	print(f"DEBUG: Exporting from temp file: {temp_path}")
-	
-	try:
-		# Load filtered samples from temp file
-		filtered_samples, customer_id = load_filtered_samples_from_temp(temp_path)
-		
-		if not filtered_samples:
-			flash("Không tìm thấy dữ liệu đã lọc", "danger")
-			return redirect(url_for("pages.samples_list"))
-		
-		# Create CSV content
-		import io
-		import csv
-		output = io.StringIO()
-		writer = csv.writer(output)
-		
-		# Write header
-		writer.writerow(['ID', 'Ngày nhận', 'ID Khách hàng', 'Tên mẫu', 'Mã hóa mẫu', 'Loại mẫu', 'Chỉ tiêu phân tích', 'Ghi chú'])
-		
-		# Write data
-		for sample in filtered_samples:
-			writer.writerow([
-				sample.get('id', ''),
-				sample.get('received_date', ''),
-				sample.get('customer_id', ''),
-				sample.get('sample_name', ''),
-				sample.get('sample_code', ''),
-				sample.get('sample_type', ''),
-				sample.get('analysis_target', ''),
-				sample.get('note', '')
-			])
-		
-		csv_content = output.getvalue()
-		print(f"DEBUG: CSV content length: {len(csv_content)}")
-		
-		# Determine filename based on customer
-		if customer_id:
-			# Get customer name
-			customers = list_customers()
-			customer_lookup = {c["id"]: c["name"] for c in customers}
-			customer_name = customer_lookup.get(customer_id, f"KhachHang_{customer_id}")
-			
-			# Strong sanitize customer name for filename
-			import re
-			# Remove all non-ASCII characters and replace with ASCII equivalents
-			safe_name = customer_name
-			# Replace Vietnamese characters
-			safe_name = safe_name.replace('à', 'a').replace('á', 'a').replace('ạ', 'a').replace('ả', 'a').replace('ã', 'a')
-			safe_name = safe_name.replace('â', 'a').replace('ầ', 'a').replace('ấ', 'a').replace('ậ', 'a').replace('ẩ', 'a').replace('ẫ', 'a')
-			safe_name = safe_name.replace('ă', 'a').replace('ằ', 'a').replace('ắ', 'a').replace('ặ', 'a').replace('ẳ', 'a').replace('ẵ', 'a')
-			safe_name = safe_name.replace('è', 'e').replace('é', 'e').replace('ẹ', 'e').replace('ẻ', 'e').replace('ẽ', 'e')
-			safe_name = safe_name.replace('ê', 'e').replace('ề', 'e').replace('ế', 'e').replace('ệ', 'e').replace('ể', 'e').replace('ễ', 'e')
-			safe_name = safe_name.replace('ì', 'i').replace('í', 'i').replace('ị', 'i').replace('ỉ', 'i').replace('ĩ', 'i')
-			safe_name = safe_name.replace('ò', 'o').replace('ó', 'o').replace('ọ', 'o').replace('ỏ', 'o').replace('õ', 'o')
-			safe_name = safe_name.replace('ô', 'o').replace('ồ', 'o').replace('ố', 'o').replace('ộ', 'o').replace('ổ', 'o').replace('ỗ', 'o')
-			safe_name = safe_name.replace('ơ', 'o').replace('ờ', 'o').replace('ớ', 'o').replace('ợ', 'o').replace('ở', 'o').replace('ỡ', 'o')
-			safe_name = safe_name.replace('ù', 'u').replace('ú', 'u').replace('ụ', 'u').replace('ủ', 'u').replace('ũ', 'u')
-			safe_name = safe_name.replace('ư', 'u').replace('ừ', 'u').replace('ứ', 'u').replace('ự', 'u').replace('ử', 'u').replace('ữ', 'u')
-			safe_name = safe_name.replace('ỳ', 'y').replace('ý', 'y').replace('ỵ', 'y').replace('ỷ', 'y').replace('ỹ', 'y')
-			safe_name = safe_name.replace('đ', 'd').replace('Đ', 'D')
-			
-			# Remove all non-alphanumeric characters except underscore and hyphen
-			safe_name = re.sub(r'[^a-zA-Z0-9\-_]', '_', safe_name)
-			# Replace multiple underscores with single underscore
-			safe_name = re.sub(r'_+', '_', safe_name)
-			# Remove leading/trailing underscores
-			safe_name = safe_name.strip('_')
-			# Limit filename length to avoid issues
-			if len(safe_name) > 30:
-				safe_name = safe_name[:30]
-			# Ensure filename is not empty
-			if not safe_name:
-				safe_name = f"KhachHang_{customer_id}"
-			
-			# Ensure filename doesn't start with number or special character
-			if safe_name and (safe_name[0].isdigit() or safe_name[0] in '._-'):
-				safe_name = f"KhachHang_{safe_name}"
-			
-			filename = f"mau_khach_hang_{safe_name}.csv"
-			print(f"DEBUG: Original name: {customer_name}, Safe name: {safe_name}, Filename: {filename}")
-		else:
-			filename = f"tat_ca_mau_{len(filtered_samples)}_mau.csv"
-		
-		# Return with proper headers
-		from urllib.parse import quote
-		response = Response(
-			csv_content.encode('utf-8-sig'),
-			mimetype='text/csv; charset=utf-8',
-			headers={
-				'Content-Disposition': f'attachment; filename="{filename}"; filename*=UTF-8\'\'{quote(filename)}',
-				'Content-Type': 'text/csv; charset=utf-8',
-				'Cache-Control': 'no-cache'
-			}
-		)
-		
-		# Clean up temp file after successful export
-		cleanup_temp_file(temp_path)
-		
-		return response
-		
-	except Exception as e:
-		print(f"DEBUG: Error exporting from temp file: {e}")
-		flash(f"Lỗi xuất dữ liệu: {str(e)}", "danger")
-		return redirect(url_for("pages.samples_list"))
+	"""Sign the current filter into a short-lived export link (nothing is written to disk)"""
+	customer_id = request.args.get('customer_id', '')
+	customer_id = int(customer_id) if customer_id and customer_id.isdigit() else None
+	payload = {"customer_id": customer_id, **_date_range_query(_date_range_args())}
+	payload.update((name, request.args[name]) for name in SAMPLE_LIST_ARGS if request.args.get(name))
+	token = _export_signer().dumps(payload)
+	return jsonify({
+		"token": token,
+		"url": url_for("pages.samples_export", token=token),
+		"message": "Dữ liệu đã lọc đã sẵn sàng để xuất",
+	})
 
 
 # Sample Closing Module (permission: closing)
@@ -742,14 +698,13 @@ def closing_regular():
 	page = int(request.args.get('page', 1))
 	per_page = int(request.args.get('per_page', 20))
 	customer_name = request.args.get('customer_name', '')
+	dates = _date_range_args()
 	
 	# Get paginated closed samples
-	closed_samples, total_pages, total_count = list_closed_samples_paginated(page, per_page, customer_name)
+	closed_samples, total_pages, total_count, cursors = list_closed_samples_paginated(page, per_page, customer_name, **dates, **_cursor_args())
 	
 	# Get unique customer names for filter dropdown
-	all_samples = list_closed_samples()
-	unique_customers = list(set([s.get("customer_name", "") for s in all_samples if s.get("customer_name")]))
-	unique_customers.sort()
+	unique_customers = list_closed_sample_customers()
 	
 	return render_template("closing/regular.html", 
 		closed_samples=closed_samples,
@@ -758,7 +713,9 @@ def closing_regular():
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
-		selected_customer_name=customer_name
+		cursors=cursors,
+		selected_customer_name=customer_name,
+		date_range=_date_range_query(dates)
 	)
 
 
@@ -842,7 +799,9 @@ def closing_regular_add():
 			sample_name=actual_sample_name,
 			encoding=encoding,
 			boxes=boxes,
-			note=note
+			note=note,
+			customer_id=int(customer_id),
+			sample_id=int(sample_id)
 		)
 		
 		flash(f"Đã thêm mẫu đóng thành công với {len(created_ids)} box!", "success")
@@ -864,9 +823,7 @@ def closing_regular_edit(closed_sample_id):
 		return redirect(url_for("pages.closing_regular"))
 	
 	# Get unique customer names for dropdown
-	all_samples = list_closed_samples()
-	unique_customers = list(set([s.get("customer_name", "") for s in all_samples if s.get("customer_name")]))
-	unique_customers.sort()
+	unique_customers = list_closed_sample_customers()
 	
 	return render_template("closing/edit_regular.html", 
 		closed_sample=closed_sample,
@@ -894,14 +851,14 @@ def closing_regular_update(closed_sample_id):
 			return redirect(url_for("pages.closing_regular_edit", closed_sample_id=closed_sample_id))
 		
 		# Validate that the sample exists in the samples module
-		from .closed_samples_store import validate_sample_exists
-		is_valid, error_msg = validate_sample_exists(
+		from .closed_samples_store import find_sample_for_closing
+		sample, error_msg = find_sample_for_closing(
 			customer_name,
 			sample_name,
 			encoding
 		)
 		
-		if not is_valid:
+		if sample is None:
 			flash(f"Lỗi validation: {error_msg}", "danger")
 			return redirect(url_for("pages.closing_regular_edit", closed_sample_id=closed_sample_id))
 		
@@ -916,12 +873,18 @@ def closing_regular_update(closed_sample_id):
 			box_symbol=box_symbol,
 			weight=weight,
 			moisture=moisture,
-			note=note
+			note=note,
+			expected_version=_form_version(),
+			customer_id=sample.get("customer_id"),
+			sample_id=sample["id"]
 		):
 			flash("Đã cập nhật mẫu đóng thành công!", "success")
 		else:
 			flash("Không tìm thấy mẫu đóng để cập nhật", "danger")
 		
+	except VersionConflictError as e:
+		flash(str(e), "warning")
+		return redirect(url_for("pages.closing_regular_edit", closed_sample_id=closed_sample_id))
 	except Exception as e:
 		flash(f"Lỗi khi cập nhật mẫu đóng: {str(e)}", "danger")
 	
@@ -946,7 +909,7 @@ def closing_regular_delete(closed_sample_id):
 def closing_regular_export():
 	"""Export closed samples to Excel"""
 	try:
-		excel_data = export_closed_samples_to_excel()
+		excel_data = export_closed_samples_to_excel(**_date_range_args())
 		
 		from flask import Response
 		response = Response(
@@ -1039,14 +1002,13 @@ def closing_foil():
 	page = int(request.args.get('page', 1))
 	per_page = int(request.args.get('per_page', 20))
 	foil_type = request.args.get('foil_type', '')
+	dates = _date_range_args()
 	
 	# Get paginated foils
-	foils, total_pages, total_count = list_foils_paginated(page, per_page, foil_type)
+	foils, total_pages, total_count, cursors = list_foils_paginated(page, per_page, foil_type, **dates, **_cursor_args())
 	
 	# Get unique foil types for filter dropdown
-	all_foils = list_foils()
-	unique_types = list(set([f.get("foil_type", "") for f in all_foils if f.get("foil_type")]))
-	unique_types.sort()
+	unique_types = list_foil_types()
 	
 	return render_template("closing/foil.html", 
 		foils=foils,
@@ -1055,7 +1017,9 @@ def closing_foil():
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
-		selected_foil_type=foil_type
+		cursors=cursors,
+		selected_foil_type=foil_type,
+		date_range=_date_range_query(dates)
 	)
 
 
@@ -1100,9 +1064,7 @@ def closing_foil_edit(foil_id):
 		return redirect(url_for("pages.closing_foil"))
 	
 	# Get unique foil types for dropdown
-	all_foils = list_foils()
-	unique_types = list(set([f.get("foil_type", "") for f in all_foils if f.get("foil_type")]))
-	unique_types.sort()
+	unique_types = list_foil_types()
 	
 	return render_template("closing/edit_foil.html", 
 		foil=foil,
@@ -1161,7 +1123,7 @@ def closing_foil_delete(foil_id):
 def closing_foil_export():
 	"""Export foils to Excel"""
 	try:
-		excel_data = export_foils_to_excel()
+		excel_data = export_foils_to_excel(**_date_range_args())
 		
 		from flask import Response
 		response = Response(
@@ -1254,14 +1216,13 @@ def closing_standard():
 	page = int(request.args.get('page', 1))
 	per_page = int(request.args.get('per_page', 20))
 	standard_type = request.args.get('standard_type', '')
+	dates = _date_range_args()
 	
 	# Get paginated standards
-	standards, total_pages, total_count = list_standards_paginated(page, per_page, standard_type)
+	standards, total_pages, total_count, cursors = list_standards_paginated(page, per_page, standard_type, **dates, **_cursor_args())
 	
 	# Get unique standard types for filter dropdown
-	all_standards = list_standards()
-	unique_types = list(set([s.get("standard_type", "") for s in all_standards if s.get("standard_type")]))
-	unique_types.sort()
+	unique_types = list_standard_types()
 	
 	return render_template("closing/standard.html", 
 		standards=standards,
@@ -1270,7 +1231,9 @@ def closing_standard():
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
-		selected_standard_type=standard_type
+		cursors=cursors,
+		selected_standard_type=standard_type,
+		date_range=_date_range_query(dates)
 	)
 
 
@@ -1317,9 +1280,7 @@ def closing_standard_edit(standard_id):
 		return redirect(url_for("pages.closing_standard"))
 	
 	# Get unique standard types for dropdown
-	all_standards = list_standards()
-	unique_types = list(set([s.get("standard_type", "") for s in all_standards if s.get("standard_type")]))
-	unique_types.sort()
+	unique_types = list_standard_types()
 	
 	return render_template("closing/edit_standard.html", 
 		standard=standard,
@@ -1380,7 +1341,7 @@ def closing_standard_delete(standard_id):
 def closing_standard_export():
 	"""Export standards to Excel"""
 	try:
-		excel_data = export_standards_to_excel()
+		excel_data = export_standards_to_excel(**_date_range_args())
 		
 		from flask import Response
 		response = Response(
@@ -1476,12 +1437,10 @@ def closing_standard_inventory():
 	standard_type = request.args.get('standard_type', '')
 	
 	# Get paginated inventories
-	inventories, total_pages, total_count = list_inventories_paginated(page, per_page, standard_type)
+	inventories, total_pages, total_count, cursors = list_inventories_paginated(page, per_page, standard_type, **_cursor_args())
 	
 	# Get unique standard types for filter dropdown
-	all_inventories = list_inventories()
-	unique_types = list(set([i.get("standard_type", "") for i in all_inventories if i.get("standard_type")]))
-	unique_types.sort()
+	unique_types = list_inventory_types()
 	
 	return render_template("closing/standard_inventory.html", 
 		inventories=inventories,
@@ -1490,6 +1449,7 @@ def closing_standard_inventory():
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
+		cursors=cursors,
 		selected_standard_type=standard_type
 	)
 
@@ -1553,9 +1513,7 @@ def closing_standard_inventory_edit(inventory_id):
 		return redirect(url_for("pages.closing_standard_inventory"))
 	
 	# Get unique standard types for dropdown
-	all_inventories = list_inventories()
-	unique_types = list(set([i.get("standard_type", "") for i in all_inventories if i.get("standard_type")]))
-	unique_types.sort()
+	unique_types = list_inventory_types()
 	
 	return render_template("closing/edit_standard_inventory.html", 
 		inventory=inventory,
@@ -1586,12 +1544,16 @@ def closing_standard_inventory_update(inventory_id):
 			box_symbol=box_symbol,
 			total_weight=total_weight,
 			standard_type=standard_type,
-			note=note
+			note=note,
+			expected_version=_form_version()
 		):
 			flash("Đã cập nhật mẫu chuẩn thành công!", "success")
 		else:
 			flash("Không tìm thấy mẫu chuẩn để cập nhật", "danger")
 		
+	except VersionConflictError as e:
+		flash(str(e), "warning")
+		return redirect(url_for("pages.closing_standard_inventory_edit", inventory_id=inventory_id))
 	except Exception as e:
 		flash(f"Lỗi khi cập nhật mẫu chuẩn: {str(e)}", "danger")
 	
@@ -1687,6 +1649,25 @@ def api_customers():
 	return jsonify(customers)
 
 
+@pages.route("/api/customers/suggest", methods=["GET"])
+@login_required
+def api_customers_suggest():
+	"""Customers matching ?q= (prefix of the name, a word of it or the organization, diacritics ignored) as [{id, name}], for the customer pickers"""
+	username = session.get("user_id")
+	if not (has_permission(username, "receiving") or has_permission(username, "closing")):
+		abort(403)
+	limit = min(max(request.args.get("limit", SUGGEST_LIMIT, type=int), 1), 50)
+	return jsonify(suggest_customers(request.args.get("q", ""), limit))
+
+
+@pages.route("/api/storage/stats", methods=["GET"])
+@admin_required
+def api_storage_stats():
+	"""Snapshot cache hit/miss counters of the JSON stores"""
+	from .storage import cache_stats
+	return jsonify(cache_stats())
+
+
 @pages.route("/api/standard-inventory", methods=["GET"])
 @permission_required("closing")
 def api_standard_inventory():
@@ -1695,13 +1676,67 @@ def api_standard_inventory():
 	return jsonify(inventories)
 
 
+@pages.route("/api/samples/check-code", methods=["GET"])
+@permission_required("receiving")
+def api_samples_check_code():
+	"""Whether a sample code (and optionally name) is still free for a customer, for the receiving forms.
+
+	"similar" lists the samples that look alike (diacritics, case, spacing),
+	the customer's own first, and "warning" describes them.
+	"""
+	customer_id = request.args.get("customer_id", type=int)
+	exclude_id = request.args.get("exclude_id", type=int)
+	if customer_id is None:
+		return jsonify({"error": "Thiếu customer_id"}), 400
+	sample_name = request.args.get("sample_name", "")
+	sample_code = request.args.get("sample_code", "")
+	message = find_sample_conflict(customer_id, sample_name, sample_code, exclude_id=exclude_id)
+	similar = [] if message else find_similar_samples(sample_name, sample_code, exclude_id=exclude_id)
+	similar.sort(key=lambda s: s.get("customer_id") != customer_id)
+	return jsonify({
+		"available": message is None,
+		"message": message,
+		"similar": [
+			{name: s.get(name) for name in ("id", "customer_id", "sample_name", "sample_code", "similarity")}
+			for s in similar
+		],
+		"warning": f"Có thể trùng với mẫu {describe_similar(similar, customer_id)}" if similar else None,
+	})
+
+
+@pages.route("/api/samples", methods=["GET"])
+@permission_required("receiving")
+def api_samples():
+	"""Samples received between ?from= and ?to= (YYYY-MM-DD, inclusive), optionally of one ?customer_id="""
+	dates = _date_range_args()
+	customer_id = request.args.get("customer_id", type=int)
+	if not (dates["date_from"] or dates["date_to"]):
+		return jsonify(list_samples_by_customer(customer_id) if customer_id is not None else list_samples())
+	return jsonify(list_samples_between(customer_id=customer_id, **dates))
+
+
 @pages.route("/api/samples-by-customer/<int:customer_id>", methods=["GET"])
 @permission_required("closing")
 def api_samples_by_customer(customer_id: int):
-	"""Get samples by customer ID"""
-	all_samples = list_samples()
-	customer_samples = [s for s in all_samples if s.get("customer_id") == customer_id]
-	return jsonify(customer_samples)
+	"""Get samples by customer ID, optionally received between ?from= and ?to="""
+	dates = _date_range_args()
+	if dates["date_from"] or dates["date_to"]:
+		return jsonify(list_samples_between(customer_id=customer_id, **dates))
+	return jsonify(list_samples_by_customer(customer_id))
+
+
+@pages.route("/api/samples/<int:sample_id>/closed-samples", methods=["GET"])
+@permission_required("closing")
+def api_sample_closed_samples(sample_id: int):
+	"""The closed boxes of a received sample"""
+	return jsonify(list_closed_samples_by_sample(sample_id))
+
+
+@pages.route("/api/closed-samples-by-customer/<int:customer_id>", methods=["GET"])
+@permission_required("closing")
+def api_closed_samples_by_customer(customer_id: int):
+	"""The closed boxes of a customer"""
+	return jsonify(list_closed_samples_by_customer(customer_id))
 
 
 # Irradiation Module (permission: irradiation)
@@ -1725,15 +1760,19 @@ def irradiation_rotating_disk():
 	page = int(request.args.get('page', 1))
 	per_page = int(request.args.get('per_page', 20))
 	
+	dates = _date_range_args()
+	
 	# Get paginated rotating disk irradiation batches
-	irradiation_batches, total_pages, total_count = list_rotating_disk_irradiations_paginated(page, per_page)
+	irradiation_batches, total_pages, total_count, cursors = list_rotating_disk_irradiations_paginated(page, per_page, **dates, **_cursor_args())
 	
 	return render_template("irradiation/rotating_disk.html", 
 		irradiation_batches=irradiation_batches,
 		current_page=page,
 		total_pages=total_pages,
 		total_count=total_count,
-		per_page=per_page
+		per_page=per_page,
+		cursors=cursors,
+		date_range=_date_range_query(dates)
 	)
 
 
@@ -1745,15 +1784,19 @@ def irradiation_channel_7_1():
 	page = int(request.args.get('page', 1))
 	per_page = int(request.args.get('per_page', 20))
 	
+	dates = _date_range_args()
+	
 	# Get paginated channel 7-1 irradiations
-	irradiations, total_pages, total_count = list_channel_7_1_irradiations_paginated(page, per_page)
+	irradiations, total_pages, total_count, cursors = list_channel_7_1_irradiations_paginated(page, per_page, **dates, **_cursor_args())
 	
 	return render_template("irradiation/channel_7_1.html", 
 		irradiations=irradiations,
 		current_page=page,
 		total_pages=total_pages,
 		total_count=total_count,
-		per_page=per_page
+		per_page=per_page,
+		cursors=cursors,
+		date_range=_date_range_query(dates)
 	)
 
 
@@ -1765,15 +1808,19 @@ def irradiation_thermal_column():
 	page = int(request.args.get('page', 1))
 	per_page = int(request.args.get('per_page', 20))
 	
+	dates = _date_range_args()
+	
 	# Get paginated thermal column irradiations
-	irradiations, total_pages, total_count = list_thermal_column_irradiations_paginated(page, per_page)
+	irradiations, total_pages, total_count, cursors = list_thermal_column_irradiations_paginated(page, per_page, **dates, **_cursor_args())
 	
 	return render_template("irradiation/thermal_column.html", 
 		irradiations=irradiations,
 		current_page=page,
 		total_pages=total_pages,
 		total_count=total_count,
-		per_page=per_page
+		per_page=per_page,
+		cursors=cursors,
+		date_range=_date_range_query(dates)
 	)
 
 
@@ -1952,7 +1999,7 @@ def task_assignment_index():
 	stats = get_task_statistics(username)
 	
 	# Lấy danh sách công việc gần đây
-	recent_tasks, _, _ = get_tasks_paginated(page=1, per_page=5, assigned_to=username)
+	recent_tasks, _, _, _ = get_tasks_paginated(page=1, per_page=5, assigned_to=username)
 	
 	return render_template("task_assignment/index.html", 
 		username=username,
@@ -1981,8 +2028,9 @@ def task_assignment_list():
 		tasks = search_tasks(search_query)
 		total_pages = 1
 		total_count = len(tasks)
+		cursors = {"prev": None, "next": None}
 	else:
-		tasks, total_pages, total_count = get_tasks_paginated(page, per_page, status, priority, assigned_to)
+		tasks, total_pages, total_count, cursors = get_tasks_paginated(page, per_page, status, priority, assigned_to, **_cursor_args())
 	
 	# Thêm thông tin giai đoạn cho mỗi công việc
 	tasks_with_stages = []
@@ -2001,6 +2049,7 @@ def task_assignment_list():
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
+		cursors=cursors,
 		selected_status=status,
 		selected_priority=priority,
 		selected_assigned_to=assigned_to,
@@ -2026,8 +2075,9 @@ def task_assignment_my_tasks():
 		tasks = search_tasks(search_query, username)
 		total_pages = 1
 		total_count = len(tasks)
+		cursors = {"prev": None, "next": None}
 	else:
-		tasks, total_pages, total_count = get_tasks_paginated(page, per_page, status, priority, username)
+		tasks, total_pages, total_count, cursors = get_tasks_paginated(page, per_page, status, priority, username, **_cursor_args())
 	
 	# Lấy thống kê cá nhân
 	stats = get_task_statistics(username)
@@ -2050,6 +2100,7 @@ def task_assignment_my_tasks():
 		total_pages=total_pages,
 		total_count=total_count,
 		per_page=per_page,
+		cursors=cursors,
 		selected_status=status,
 		selected_priority=priority,
 		search_query=search_query
@@ -2199,17 +2250,24 @@ def task_assignment_edit(task_id):
 		flash("Vui lòng điền đầy đủ thông tin bắt buộc", "warning")
 		return redirect(url_for("pages.task_assignment_edit_form", task_id=task_id))
 	
-	if update_task_assignment(
-		task_id=task_id,
-		title=title,
-		description=description,
-		assigned_to=assigned_to,
-		priority=priority,
-		status=status,
-		due_date=due_date if due_date else None,
-		category=category if category else None,
-		note=note if note else None
-	):
+	try:
+		updated = update_task_assignment(
+			task_id=task_id,
+			title=title,
+			description=description,
+			assigned_to=assigned_to,
+			priority=priority,
+			status=status,
+			due_date=due_date if due_date else None,
+			category=category if category else None,
+			note=note if note else None,
+			expected_version=_form_version()
+		)
+	except VersionConflictError as e:
+		flash(str(e), "warning")
+		return redirect(url_for("pages.task_assignment_edit_form", task_id=task_id))
+	
+	if updated:
 		flash("Đã cập nhật công việc thành công", "success")
 	else:
 		flash("Lỗi khi cập nhật công việc", "danger")
@@ -2280,7 +2338,13 @@ def task_assignment_handover(task_id):
 		flash("Vui lòng chọn người nhận bàn giao", "warning")
 		return redirect(url_for("pages.task_assignment_handover_form", task_id=task_id))
 	
-	if handover_task(task_id, username, to_user, handover_note):
+	try:
+		handed_over = handover_task(task_id, username, to_user, handover_note, expected_version=_form_version())
+	except VersionConflictError as e:
+		flash(str(e), "warning")
+		return redirect(url_for("pages.task_assignment_handover_form", task_id=task_id))
+	
+	if handed_over:
 		flash("Đã bàn giao công việc thành công", "success")
 		return redirect(url_for("pages.task_assignment_my_tasks"))
 	else:
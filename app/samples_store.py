@@ -1,169 +1,447 @@
-import json
 import os
 import csv
+import glob
+import io
+import time
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-SAMPLES_FILE = os.path.join(DATA_DIR, "samples.json")
+from .customers_store import count_change
+from .pagination import Page, paginate, paginate_sorted
+from .sharded_table import ShardedTable
+from .similarity import min_shared, rank, trigrams
+from .storage import data_path
+from .table import TokenIndex, open_table, write_step
 
+SAMPLES_FILE = data_path("samples.json")
+TEMP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "temp")
+TEMP_FILE_TTL = int(os.environ.get("NAA_TEMP_FILE_TTL", "3600"))  # seconds
+EXPORT_HEADER = ['ID', 'Ngày nhận', 'ID Khách hàng', 'Tên mẫu', 'Mã hóa mẫu', 'Loại mẫu', 'Chỉ tiêu phân tích', 'Ghi chú']
+EXPORT_FIELDS = ['id', 'received_date', 'customer_id', 'sample_name', 'sample_code', 'sample_type', 'analysis_target', 'note']
+# One file per customer under data/samples.shards/ (json and journal backends)
+SHARDED = os.environ.get("NAA_SHARD_SAMPLES", "").strip().lower() in ("1", "true", "yes")
+# Likely duplicates reported per name or code, and per CSV import
+SIMILAR_LIMIT = 5
+IMPORT_WARNING_LIMIT = 20
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(SAMPLES_FILE):
-		with open(SAMPLES_FILE, "w", encoding="utf-8") as f:
-			json.dump({"next_id": 1, "samples": []}, f, ensure_ascii=False, indent=2)
 
+def unique_key(customer_id: Any, value: Optional[str]) -> Optional[str]:
+	"""Key of a name or code unique per customer: "<customer_id>:<trimmed lowercase value>", None if blank"""
+	value = (value or "").strip().lower()
+	return f"{customer_id}:{value}" if value else None
 
-def _read() -> Dict[str, Any]:
-	_ensure_store()
-	with open(SAMPLES_FILE, "r", encoding="utf-8") as f:
-		return json.load(f)
 
+def _folded(value: Optional[str]) -> str:
+	return (value or "").strip().lower()
 
-def _write(data: Dict[str, Any]) -> None:
-	with open(SAMPLES_FILE, "w", encoding="utf-8") as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+
+def identity_key(customer_id: Any, sample_name: Optional[str], sample_code: Optional[str]) -> str:
+	"""Key of a sample as the closing module names it: customer, trimmed lowercase name and code"""
+	return "\x1f".join((str(customer_id), _folded(sample_name), _folded(sample_code)))
+
+
+# Columns the receiving list can be sorted by and their sort keys, kept as indexes
+SAMPLE_SORTS = {
+	"received_date": lambda s: s.get("received_date") or "",
+	"sample_name": lambda s: _folded(s.get("sample_name")),
+	"sample_code": lambda s: _folded(s.get("sample_code")),
+	"sample_type": lambda s: _folded(s.get("sample_type")),
+	"analysis_target": lambda s: _folded(s.get("analysis_target")),
+}
+
+
+_samples = open_table(
+	SAMPLES_FILE,
+	"samples",
+	seed={"next_id": 1, "samples": []},
+	indexes={
+		"customer_id": lambda s: s.get("customer_id"),
+		# Sort keys, also used for the exact type and target filters
+		**SAMPLE_SORTS,
+		# Uniqueness of name and code within a customer
+		"customer_name": lambda s: unique_key(s.get("customer_id"), s.get("sample_name")),
+		"customer_code": lambda s: unique_key(s.get("customer_id"), s.get("sample_code")),
+		# Name and code together, for the closing module's checks
+		"identity": lambda s: identity_key(s.get("customer_id"), s.get("sample_name"), s.get("sample_code")),
+		# Trigrams of the folded name and code, for the likely-duplicate warnings
+		"name_grams": TokenIndex(lambda s: trigrams(s.get("sample_name"))),
+		"code_grams": TokenIndex(lambda s: trigrams(s.get("sample_code"))),
+	},
+	versioned=True,
+	# A delete is one tombstone line in samples.json.log, dropped by the next compaction
+	journal=True,
+	shard_by="customer_id" if SHARDED else None,
+)
+
+
+def _customer_table(customer_id: Any):
+	"""The table holding one customer's samples (its shard when sharded), or all samples for None"""
+	return _samples.shard(customer_id) if customer_id is not None and isinstance(_samples, ShardedTable) else _samples
+
+
+def find_sample_conflict(customer_id: int, sample_name: str = "", sample_code: str = "", exclude_id: Optional[int] = None) -> Optional[str]:
+	"""Error message if another sample of the customer has this name or code, else None"""
+	for index, label, value in (("customer_name", "Tên mẫu", sample_name), ("customer_code", "Mã hóa mẫu", sample_code)):
+		key = unique_key(customer_id, value)
+		if key is not None and any(s.get("id") != exclude_id for s in _customer_table(customer_id).find(index, key)):
+			return f"{label} '{value.strip()}' đã tồn tại cho khách hàng này"
+	return None
+
+
+def find_similar_samples(
+	sample_name: str = "",
+	sample_code: str = "",
+	customer_id: Optional[int] = None,
+	exclude_id: Optional[int] = None,
+	limit: int = SIMILAR_LIMIT,
+) -> List[Dict[str, Any]]:
+	"""Samples whose name or code looks like these once case, diacritics, spacing and
+	leading zeros are ignored ("Đất nền 01" / "dat nen 1"), best first.
+
+	Only the customer's samples with customer_id, else all of them. Candidates
+	come from the trigram indexes, so the cost follows the matches, not the
+	number of samples. Each result is the sample plus "similarity" (0-1) and
+	"field", the field that matched.
+	"""
+	table = _customer_table(customer_id)
+	found: Dict[Any, Dict[str, Any]] = {}
+	for field, index, value in (("sample_name", "name_grams", sample_name), ("sample_code", "code_grams", sample_code)):
+		grams = trigrams(value)
+		if not grams:
+			continue
+		matches = table.overlap(index, grams, min_shared(grams))
+		if customer_id is not None:
+			matches = [m for m in matches if m[0].get("customer_id") == customer_id]
+		for sample, score in rank(value, matches, lambda s: s.get(field)):
+			if sample.get("id") == exclude_id:
+				continue
+			if sample["id"] not in found or score > found[sample["id"]]["similarity"]:
+				found[sample["id"]] = dict(sample, similarity=score, field=field)
+	return sorted(found.values(), key=lambda s: -s["similarity"])[:limit]
+
+
+def describe_similar(similar: List[Dict[str, Any]], customer_id: Optional[int] = None) -> str:
+	"""One line naming likely duplicates: "#12 'Đất nền 01' (khách hàng này), ..." """
+	return ", ".join(
+		f"#{s['id']} '{s.get(s['field'], '')}'" + (" (khách hàng này)" if s.get("customer_id") == customer_id else " (khách hàng khác)")
+		for s in similar
+	)
 
 
 def list_samples() -> List[Dict[str, Any]]:
-	return _read().get("samples", [])
+	return _samples.rows()
 
 
-def list_samples_paginated(page: int = 1, per_page: int = 20, customer_id: Optional[int] = None) -> tuple[List[Dict[str, Any]], int, int]:
-	"""Get paginated samples with optional customer filter. Returns (samples, total_pages, total_count)"""
-	all_samples = _read().get("samples", [])
-	
-	# Filter by customer if specified
+def list_samples_by_customer(customer_id: int) -> List[Dict[str, Any]]:
+	"""Get all samples of one customer (index lookup)"""
+	return _customer_table(customer_id).find("customer_id", customer_id)
+
+
+def list_samples_between(date_from: Optional[str] = None, date_to: Optional[str] = None, customer_id: Optional[int] = None) -> List[Dict[str, Any]]:
+	"""Samples received between two dates (YYYY-MM-DD, inclusive, None for no bound), in date order.
+
+	Binary search on the sorted received_date index instead of a scan.
+	"""
+	samples = _customer_table(customer_id).between("received_date", date_from or None, date_to or None)
 	if customer_id is not None:
-		all_samples = [s for s in all_samples if s.get("customer_id") == customer_id]
-	
-	total_count = len(all_samples)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	# Calculate offset
-	offset = (page - 1) * per_page
-	
-	# Get samples for current page
-	samples = all_samples[offset:offset + per_page]
-	
-	return samples, total_pages, total_count
+		samples = [s for s in samples if s.get("customer_id") == customer_id]
+	return samples
+
+
+def _filtered_samples(
+	customer_id: Optional[int],
+	sort: Optional[str],
+	descending: bool,
+	sample_type: str,
+	analysis_target: str,
+	date_from: Optional[str],
+	date_to: Optional[str],
+	q: str,
+) -> List[Dict[str, Any]]:
+	"""The samples matching the list filters, in list order (see list_samples_paginated)"""
+	# Start from the smallest index bucket among the exact filters and test the others per sample
+	exact = [
+		(index, key) for index, key in (
+			("customer_id", customer_id),
+			("sample_type", _folded(sample_type)),
+			("analysis_target", _folded(analysis_target)),
+		) if key not in (None, "")
+	]
+	table = _customer_table(customer_id)
+	index, key = min(exact, key=lambda f: table.count(*f)) if exact else (None, None)
+	if not index and (date_from or date_to):
+		# Only a date range: binary search on the received_date index
+		samples = table.between("received_date", date_from or None, date_to or None)
+		if sort:
+			samples = sorted(samples, key=lambda s: (SAMPLE_SORTS[sort](s), s["id"]), reverse=descending)
+		else:
+			samples = sorted(samples, key=lambda s: s["id"])
+	elif sort:
+		# Sorted by the table, which keeps the order until the samples change
+		samples = table.sort(sort, descending, index, key)
+	else:
+		samples = table.find(index, key) if index else table.rows()
+	
+	keys = {"customer_id": lambda s: s.get("customer_id"), **SAMPLE_SORTS}
+	others = [(keys[name], value) for name, value in exact if name != index]
+	text = _folded(q)
+	
+	def matches(sample: Dict[str, Any]) -> bool:
+		if any(key_of(sample) != value for key_of, value in others):
+			return False
+		received_date = sample.get("received_date") or ""
+		if (date_from and received_date < date_from) or (date_to and received_date > date_to):
+			return False
+		if text:
+			fields = ("sample_name", "sample_code", "sample_type", "analysis_target", "note")
+			return any(text in _folded(sample.get(field)) for field in fields)
+		return True
+	
+	return [s for s in samples if matches(s)]
+
+
+def list_samples_paginated(
+	page: int = 1,
+	per_page: int = 20,
+	customer_id: Optional[int] = None,
+	after: Optional[str] = None,
+	before: Optional[str] = None,
+	with_total: bool = True,
+	sort: Optional[str] = None,
+	descending: bool = False,
+	sample_type: str = "",
+	analysis_target: str = "",
+	date_from: str = "",
+	date_to: str = "",
+	q: str = "",
+) -> Page:
+	"""Get paginated samples with optional filters. Returns (samples, total_pages, total_count, cursors)
+
+	With an after/before cursor token the page is found by key at the same cost
+	at any depth; with_total=False skips counting (see pagination.paginate).
+
+	sort is one of SAMPLE_SORTS (descending=True reverses it). sample_type and
+	analysis_target match whole values ignoring case, date_from/date_to bound
+	received_date (YYYY-MM-DD, inclusive) and q is searched in the name, code,
+	type, target and note.
+	"""
+	if sort not in SAMPLE_SORTS:
+		sort = None
+	if not (sort or sample_type or analysis_target or date_from or date_to or q):
+		# Filter by customer if specified; the table cuts the page itself
+		if customer_id is not None:
+			return paginate(_customer_table(customer_id), page, per_page, after, before, "customer_id", customer_id, with_total)
+		return paginate(_samples, page, per_page, after, before, with_total=with_total)
+	
+	samples = _filtered_samples(customer_id, sort, descending, sample_type, analysis_target, date_from, date_to, q)
+	if sort:
+		order = SAMPLE_SORTS[sort]
+		return paginate_sorted(samples, lambda s: [order(s), s["id"]], page, per_page, after, before, descending)
+	return paginate_sorted(samples, lambda s: s["id"], page, per_page, after, before)
 
 
 def get_sample(sample_id: int) -> Optional[Dict[str, Any]]:
-	for s in list_samples():
-		if s.get("id") == sample_id:
-			return s
-	return None
+	return _samples.get(sample_id)
+
 
+def find_sample_by_identity(customer_id: int, sample_name: str, sample_code: str) -> Optional[Dict[str, Any]]:
+	"""The customer's sample with this name and code, ignoring case and surrounding spaces (index lookup)"""
+	matches = _customer_table(customer_id).find("identity", identity_key(customer_id, sample_name, sample_code))
+	return matches[0] if matches else None
 
+
+def customer_of_sample_code(sample_code: Optional[str]) -> Optional[int]:
+	"""The customer whose sample has this code (index lookup), None if no or several customers have it"""
+	if not _folded(sample_code):
+		return None
+	customers = {s.get("customer_id") for s in _samples.find("sample_code", _folded(sample_code))}
+	return customers.pop() if len(customers) == 1 else None
+
+
+@write_step()
 def create_sample(customer_id: int, sample_name: str, sample_code: str, sample_type: str, analysis_target: str, note: str) -> int:
-	data = _read()
-	samples = data.get("samples", [])
-	
-	# Validate uniqueness within the same customer
 	sample_name = sample_name.strip()
 	sample_code = sample_code.strip()
 	
-	# Check for duplicate sample name within the same customer
-	for existing_sample in samples:
-		if (existing_sample.get("customer_id") == customer_id and 
-			existing_sample.get("sample_name", "").strip().lower() == sample_name.lower()):
-			raise ValueError(f"Tên mẫu '{sample_name}' đã tồn tại cho khách hàng này")
-	
-	# Check for duplicate sample code within the same customer
-	for existing_sample in samples:
-		if (existing_sample.get("customer_id") == customer_id and 
-			existing_sample.get("sample_code", "").strip().lower() == sample_code.lower() and
-			sample_code):  # Only check if sample_code is not empty
-			raise ValueError(f"Mã hóa mẫu '{sample_code}' đã tồn tại cho khách hàng này")
-	
-	# ID is always the next sequential number (1, 2, 3, 4...)
-	sample_id = len(samples) + 1
-	
-	record = {
-		"id": sample_id,
-		"received_date": datetime.now().strftime("%Y-%m-%d"),
-		"customer_id": customer_id,
-		"sample_name": sample_name,
-		"sample_code": sample_code,
-		"sample_type": sample_type.strip(),
-		"analysis_target": analysis_target.strip(),
-		"note": note.strip(),
-	}
-	samples.append(record)
-	data["samples"] = samples
-	_write(data)
+	def build() -> List[Dict[str, Any]]:
+		# Checked under the write lock so two operators cannot take the same name or code
+		conflict = find_sample_conflict(customer_id, sample_name, sample_code)
+		if conflict:
+			raise ValueError(conflict)
+		# The table takes the ID from next_id, so IDs are never reused
+		return [{
+			"received_date": datetime.now().strftime("%Y-%m-%d"),
+			"customer_id": customer_id,
+			"sample_name": sample_name,
+			"sample_code": sample_code,
+			"sample_type": sample_type.strip(),
+			"analysis_target": analysis_target.strip(),
+			"note": note.strip(),
+		}]
+	
+	sample_id = _customer_table(customer_id).insert_many(build)[0]
+	count_change("samples", added=[customer_id])
 	return sample_id
 
 
-def update_sample(sample_id: int, customer_id: int, sample_name: str, sample_code: str, sample_type: str, analysis_target: str, note: str) -> bool:
-	data = _read()
-	found = False
-	
-	# Validate uniqueness within the same customer (excluding current sample)
+@write_step()
+def update_sample(sample_id: int, customer_id: int, sample_name: str, sample_code: str, sample_type: str, analysis_target: str, note: str, expected_version: Optional[int] = None) -> bool:
+	"""Update a sample; with expected_version set, raise VersionConflictError if it was edited meanwhile"""
 	sample_name = sample_name.strip()
 	sample_code = sample_code.strip()
 	
-	# Check for duplicate sample name within the same customer (excluding current sample)
-	for existing_sample in data.get("samples", []):
-		if (existing_sample.get("id") != sample_id and
-			existing_sample.get("customer_id") == customer_id and 
-			existing_sample.get("sample_name", "").strip().lower() == sample_name.lower()):
-			raise ValueError(f"Tên mẫu '{sample_name}' đã tồn tại cho khách hàng này")
-	
-	# Check for duplicate sample code within the same customer (excluding current sample)
-	for existing_sample in data.get("samples", []):
-		if (existing_sample.get("id") != sample_id and
-			existing_sample.get("customer_id") == customer_id and 
-			existing_sample.get("sample_code", "").strip().lower() == sample_code.lower() and
-			sample_code):  # Only check if sample_code is not empty
-			raise ValueError(f"Mã hóa mẫu '{sample_code}' đã tồn tại cho khách hàng này")
-	
-	for s in data.get("samples", []):
-		if s.get("id") == sample_id:
-			s["customer_id"] = customer_id
-			s["sample_name"] = sample_name
-			s["sample_code"] = sample_code
-			s["sample_type"] = sample_type.strip()
-			s["analysis_target"] = analysis_target.strip()
-			s["note"] = note.strip()
-			found = True
-			break
-	if not found:
+	previous = []
+	
+	def change(sample: Dict[str, Any]) -> None:
+		# Unique within the customer, excluding the sample itself
+		conflict = find_sample_conflict(customer_id, sample_name, sample_code, exclude_id=sample_id)
+		if conflict:
+			raise ValueError(conflict)
+		previous[:] = [sample.get("customer_id")]
+		sample.update({
+			"customer_id": customer_id,
+			"sample_name": sample_name,
+			"sample_code": sample_code,
+			"sample_type": sample_type.strip(),
+			"analysis_target": analysis_target.strip(),
+			"note": note.strip(),
+		})
+	
+	if not _samples.update(sample_id, change, expected_version=expected_version):
 		return False
-	_write(data)
+	count_change("samples", removed=previous, added=[customer_id])
 	return True
 
 
+@write_step()
 def delete_sample(sample_id: int) -> bool:
-	data = _read()
-	samples = data.get("samples", [])
-	
-	# Find and remove the sample
-	original_count = len(samples)
-	new_samples = [s for s in samples if s.get("id") != sample_id]
-	
-	if len(new_samples) == original_count:
-		return False  # Sample not found
-	
-	# Renumber all samples to maintain sequential IDs (1, 2, 3, 4...)
-	for i, sample in enumerate(new_samples, 1):
-		sample["id"] = i
-	
-	data["samples"] = new_samples
-	_write(data)
+	"""Delete a sample; the other samples keep their IDs. ValueError if closed boxes still refer to it"""
+	from .closed_samples_store import count_closed_samples_by_sample
+	sample = _samples.get(sample_id)
+	if sample is None:
+		return False
+	boxes = count_closed_samples_by_sample(sample_id)
+	if boxes:
+		raise ValueError(f"Không thể xóa mẫu: còn {boxes} hộp mẫu đóng")
+	if not _samples.delete(sample_id):
+		return False
+	count_change("samples", removed=[sample.get("customer_id")])
 	return True
 
 
-def import_samples_from_csv(csv_content: str) -> tuple[int, List[str]]:
-	"""Import samples from CSV content. Returns (success_count, error_messages)"""
+class _ImportCancelled(Exception):
+	"""A row of an all-or-nothing import failed: the rows written so far are dropped"""
+
+
+@write_step()
+def _insert_imported_samples(groups: Dict[Any, List[Any]], all_or_nothing: bool, errors: List[str], warnings: List[str]) -> int:
+	"""Insert the parsed CSV rows, grouped by the table that holds them, one write per group.
+
+	Each group is checked under its table's write lock against the existing
+	samples and the earlier rows of the file. Row errors and warnings are added
+	to `errors` and `warnings` in line order. With all_or_nothing the first
+	failing group raises _ImportCancelled, which drops the groups already written.
+	"""
+	# Names and codes taken by earlier rows of the file; existing samples are looked up in the index
+	names: Dict[str, int] = {}
+	codes: Dict[str, int] = {}
+	# Trigrams of the earlier rows, keyed by line number, for the likely duplicates within the file
+	file_grams = {
+		"sample_name": TokenIndex(lambda r: trigrams(r["sample_name"])),
+		"sample_code": TokenIndex(lambda r: trigrams(r["sample_code"])),
+	}
+	earlier: Dict[int, Dict[str, Any]] = {}
+	row_errors: List[Tuple[int, str]] = []  # (line number, message)
+	row_warnings: List[Tuple[int, str]] = []
+	received_date = datetime.now().strftime("%Y-%m-%d")
+	
+	def build(candidates: List[Any]) -> List[Dict[str, Any]]:
+		records = []
+		failed = len(row_errors)
+		for i, customer_id, row in candidates:
+			sample_name = row['sample_name'].strip()
+			sample_code = row.get('sample_code', '').strip()
+			name_key = unique_key(customer_id, sample_name)
+			code_key = unique_key(customer_id, sample_code)
+			conflict = None
+			for label, value, key, index, seen in (
+				("Tên mẫu", sample_name, name_key, "customer_name", names),
+				("Mã hóa mẫu", sample_code, code_key, "customer_code", codes),
+			):
+				if key is None:
+					continue
+				if key in seen:
+					conflict = f"{label} '{value}' trùng với dòng {seen[key]} trong file"
+				elif _customer_table(customer_id).count(index, key):
+					conflict = f"{label} '{value}' đã tồn tại cho khách hàng này"
+				if conflict:
+					break
+			if conflict:
+				row_errors.append((i, f"Dòng {i}: Lỗi tạo mẫu - {conflict}"))
+				continue
+			names[name_key] = i
+			if code_key is not None:
+				codes[code_key] = i
+			record = {
+				"received_date": received_date,
+				"customer_id": customer_id,
+				"sample_name": sample_name,
+				"sample_code": sample_code,
+				"sample_type": row.get('sample_type', '').strip(),
+				"analysis_target": row.get('analysis_target', '').strip(),
+				"note": row.get('note', '').strip(),
+			}
+			similar = find_similar_samples(sample_name, sample_code)
+			if similar:
+				row_warnings.append((i, f"Dòng {i}: Cảnh báo - có thể trùng với mẫu {describe_similar(similar, customer_id)}"))
+			for field, label in (("sample_name", "Tên mẫu"), ("sample_code", "Mã hóa mẫu")):
+				grams = trigrams(record[field])
+				counts = file_grams[field].overlap(grams)
+				matches = [(earlier[line], n) for line, n in counts.items() if n >= min_shared(grams)]
+				ranked = rank(record[field], matches, lambda r: r[field])
+				if ranked:
+					row_warnings.append((i, f"Dòng {i}: Cảnh báo - {label} '{record[field]}' gần giống dòng {ranked[0][0]['line']} trong file"))
+					break
+			for index in file_grams.values():
+				index.add(i, i, record)
+			earlier[i] = dict(record, line=i)
+			records.append(record)
+		if all_or_nothing and len(row_errors) > failed:
+			raise _ImportCancelled()
+		# IDs come from next_id, like create_sample
+		built[:] = records
+		return records
+	
+	built: List[Dict[str, Any]] = []
+	imported = 0
+	try:
+		for customer_id, candidates in groups.items():
+			if _customer_table(customer_id).insert_many(lambda: build(candidates)):
+				imported += len(built)
+				count_change("samples", added=[r["customer_id"] for r in built])
+	finally:
+		errors.extend(message for _, message in sorted(row_errors))
+		warnings.extend(message for _, message in sorted(row_warnings))
+	return imported
+
+
+def import_samples_from_csv(csv_content: str, all_or_nothing: bool = False) -> tuple[int, List[str]]:
+	"""Import samples from CSV content with a single write (one per customer when sharded).
+	Returns (success_count, error_messages)
+
+	Rows are checked against the customer's existing samples and against the
+	earlier rows of the file. By default the valid rows are imported and the
+	others reported; with all_or_nothing=True one bad row cancels the import.
+	Likely duplicates (see find_similar_samples) are reported as warnings at the
+	end of the list but do not block their row.
+	"""
 	errors = []
+	warnings: List[str] = []
 	success_count = 0
+	candidates = []  # (line number, customer_id, row) of the rows that parsed
 	
 	try:
 		# Use proper CSV parsing with StringIO
-		import io
 		csv_reader = csv.reader(io.StringIO(csv_content))
 		rows = list(csv_reader)
 		
@@ -233,19 +511,24 @@ def import_samples_from_csv(csv_content: str) -> tuple[int, List[str]]:
 				errors.append(f"Dòng {i}: customer_id phải là số")
 				continue
 			
-			# Create sample
+			candidates.append((i, customer_id, row))
+		
+		# One group, validated and appended under its write lock, per table written:
+		# the whole table, or each customer's shard when sharded
+		groups: Dict[Any, List[Any]] = {}
+		for candidate in candidates:
+			groups.setdefault(candidate[1] if isinstance(_samples, ShardedTable) else None, []).append(candidate)
+		if not (all_or_nothing and errors):
 			try:
-				create_sample(
-					customer_id=customer_id,
-					sample_name=row['sample_name'],
-					sample_code=row.get('sample_code', ''),
-					sample_type=row.get('sample_type', ''),
-					analysis_target=row.get('analysis_target', ''),
-					note=row.get('note', '')
-				)
-				success_count += 1
-			except Exception as e:
-				errors.append(f"Dòng {i}: Lỗi tạo mẫu - {str(e)}")
+				success_count = _insert_imported_samples(groups, all_or_nothing, errors, warnings)
+			except _ImportCancelled:
+				success_count = 0
+		if all_or_nothing and errors:
+			errors.append("Không có mẫu nào được import vì file có lỗi (chế độ tất cả hoặc không)")
+		elif warnings:
+			errors.extend(warnings[:IMPORT_WARNING_LIMIT])
+			if len(warnings) > IMPORT_WARNING_LIMIT:
+				errors.append(f"... và {len(warnings) - IMPORT_WARNING_LIMIT} cảnh báo khác")
 				
 	except Exception as e:
 		errors.append(f"Lỗi đọc file CSV: {str(e)}")
@@ -253,101 +536,61 @@ def import_samples_from_csv(csv_content: str) -> tuple[int, List[str]]:
 	return success_count, errors
 
 
-def export_samples_to_excel(customer_id: Optional[int] = None) -> str:
-	"""Export samples to Excel format. Returns CSV content for Excel."""
-	all_samples = _read().get("samples", [])
-	print(f"DEBUG: Total samples: {len(all_samples)}")
-	print(f"DEBUG: Filtering by customer_id: {customer_id}")
-	
-	# Filter by customer if specified
-	if customer_id is not None:
-		all_samples = [s for s in all_samples if s.get("customer_id") == customer_id]
-		print(f"DEBUG: Filtered samples: {len(all_samples)}")
+def iter_samples_csv(
+	customer_id: Optional[int] = None,
+	date_from: Optional[str] = None,
+	date_to: Optional[str] = None,
+	sort: Optional[str] = None,
+	descending: bool = False,
+	sample_type: str = "",
+	analysis_target: str = "",
+	q: str = "",
+	batch: int = 500,
+) -> Iterator[str]:
+	"""Export samples as CSV text, yielded `batch` rows at a time so a response can stream it.
+
+	The filters and sort are those of list_samples_paginated, so the file holds
+	the list's samples in the list's order.
+	"""
+	if sort not in SAMPLE_SORTS:
+		sort = None
+	if sort or sample_type or analysis_target or date_from or date_to or q:
+		samples: Iterable[Dict[str, Any]] = _filtered_samples(
+			customer_id, sort, descending, sample_type, analysis_target, date_from, date_to, q
+		)
+	elif customer_id is not None:
+		samples = _customer_table(customer_id).find("customer_id", customer_id)
+	elif isinstance(_samples, ShardedTable):
+		samples = _samples.iter_rows()
+	else:
+		samples = _samples.rows()
 	
-	# Create CSV content
-	import io
 	output = io.StringIO()
 	writer = csv.writer(output)
-	
-	# Write header
-	writer.writerow(['ID', 'Ngày nhận', 'ID Khách hàng', 'Tên mẫu', 'Mã hóa mẫu', 'Loại mẫu', 'Chỉ tiêu phân tích', 'Ghi chú'])
-	
-	# Write data
-	for sample in all_samples:
-		writer.writerow([
-			sample.get('id', ''),
-			sample.get('received_date', ''),
-			sample.get('customer_id', ''),
-			sample.get('sample_name', ''),
-			sample.get('sample_code', ''),
-			sample.get('sample_type', ''),
-			sample.get('analysis_target', ''),
-			sample.get('note', '')
-		])
-	
-	return output.getvalue()
+	writer.writerow(EXPORT_HEADER)
+	for i, sample in enumerate(samples, 1):
+		writer.writerow([sample.get(field, '') for field in EXPORT_FIELDS])
+		if i % batch == 0:
+			yield output.getvalue()
+			output.seek(0)
+			output.truncate()
+	yield output.getvalue()
 
 
-def save_filtered_samples_to_temp(customer_id: Optional[int] = None) -> str:
-	"""Save filtered samples to temporary file. Returns temp file path."""
-	import tempfile
-	import os
-	
-	all_samples = _read().get("samples", [])
-	
-	# Filter by customer if specified
-	if customer_id is not None:
-		all_samples = [s for s in all_samples if s.get("customer_id") == customer_id]
-	
-	# Create temporary file
-	temp_dir = os.path.join(os.path.dirname(__file__), "..", "temp")
-	os.makedirs(temp_dir, exist_ok=True)
-	
-	# Create temp file with unique name
-	import uuid
-	temp_filename = f"filtered_samples_{uuid.uuid4().hex}.json"
-	temp_path = os.path.join(temp_dir, temp_filename)
-	
-	# Save filtered samples to temp file with metadata
-	temp_data = {
-		"customer_id": customer_id,
-		"samples": all_samples,
-		"count": len(all_samples)
-	}
-	
-	with open(temp_path, 'w', encoding='utf-8') as f:
-		json.dump(temp_data, f, ensure_ascii=False, indent=2)
-	
-	print(f"DEBUG: Saved {len(all_samples)} filtered samples to {temp_path}")
-	return temp_path
-
-
-def load_filtered_samples_from_temp(temp_path: str) -> tuple[List[Dict[str, Any]], Optional[int]]:
-	"""Load filtered samples from temporary file. Returns (samples, customer_id)."""
-	try:
-		with open(temp_path, 'r', encoding='utf-8') as f:
-			temp_data = json.load(f)
-		
-		# Handle both old format (list) and new format (dict)
-		if isinstance(temp_data, list):
-			samples = temp_data
-			customer_id = None
-		else:
-			samples = temp_data.get("samples", [])
-			customer_id = temp_data.get("customer_id")
-		
-		print(f"DEBUG: Loaded {len(samples)} samples from temp file, customer_id: {customer_id}")
-		return samples, customer_id
-	except Exception as e:
-		print(f"DEBUG: Error loading temp file: {e}")
-		return [], None
+def export_samples_to_excel(customer_id: Optional[int] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export samples to Excel format. Returns CSV content for Excel."""
+	return "".join(iter_samples_csv(customer_id, date_from, date_to))
 
 
-def cleanup_temp_file(temp_path: str) -> None:
-	"""Clean up temporary file."""
-	try:
-		if os.path.exists(temp_path):
-			os.remove(temp_path)
-			print(f"DEBUG: Cleaned up temp file: {temp_path}")
-	except Exception as e:
-		print(f"DEBUG: Error cleaning up temp file: {e}")
+def cleanup_temp_files(max_age: int = TEMP_FILE_TTL) -> int:
+	"""Remove filtered-sample files older than max_age seconds left in temp/ by the old two-step export. Returns how many"""
+	removed = 0
+	cutoff = time.time() - max_age
+	for path in glob.glob(os.path.join(TEMP_DIR, "filtered_samples_*.json")):
+		try:
+			if os.path.getmtime(path) < cutoff:
+				os.remove(path)
+				removed += 1
+		except OSError:
+			pass  # already removed by another worker
+	return removed
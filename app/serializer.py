@@ -0,0 +1,34 @@
+import json
+import os
+from typing import Any, Union
+
+try:
+	import orjson
+except ImportError:  # optional: pip install orjson for faster reads and writes
+	orjson = None
+
+# Indent the data files for people reading or editing them by hand (NAA_JSON_PRETTY=1).
+# Off by default: compact files are about a third smaller and faster to parse.
+PRETTY = os.environ.get("NAA_JSON_PRETTY", "").strip().lower() in ("1", "true", "yes")
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(value: Any, pretty: bool = False) -> bytes:
+	"""Serialize to UTF-8 JSON bytes: compact on one line, or indented by 2 with pretty=True"""
+	if orjson is not None:
+		return orjson.dumps(value, option=orjson.OPT_INDENT_2 if pretty else 0)
+	if pretty:
+		text = json.dumps(value, ensure_ascii=False, indent=2)
+	else:
+		text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+	return text.encode("utf-8")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+	"""Parse JSON from bytes or text"""
+	if orjson is not None:
+		return orjson.loads(data)
+	if isinstance(data, memoryview):
+		data = data.tobytes()
+	return json.loads(data)
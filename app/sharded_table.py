@@ -0,0 +1,362 @@
+import heapq
+import os
+import re
+import threading
+from bisect import bisect_right
+from hashlib import sha1
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from . import storage
+from .table import VERSION_FIELD, Record, Table, order_key
+
+_SAFE_NAME = re.compile(r"[\w-]+")
+
+
+def shard_name(key: Any) -> str:
+	"""File-name-safe name of the shard holding the records whose shard field equals `key`"""
+	name = str(key)
+	return name if _SAFE_NAME.fullmatch(name) else "x" + sha1(name.encode("utf-8")).hexdigest()[:16]
+
+
+def _ranges(pks: Iterable[int]) -> List[List[int]]:
+	"""Integer keys collapsed into sorted [first, last] runs"""
+	return _merge([pk, pk] for pk in pks)
+
+
+def _merge(runs: Iterable[List[int]]) -> List[List[int]]:
+	merged: List[List[int]] = []
+	for first, last in sorted(runs):
+		if merged and first <= merged[-1][1] + 1:
+			merged[-1][1] = max(merged[-1][1], last)
+		else:
+			merged.append([first, last])
+	return merged
+
+
+class _Shard(Table):
+	"""One shard of a ShardedTable: a regular Table whose new keys come from the manifest"""
+
+	def __init__(self, owner: "ShardedTable", name: str, path: str, collection: str, **options: Any) -> None:
+		super().__init__(path, collection, **options)
+		self.owner = owner
+		self.name = name
+
+	def insert_many(self, records: Union[Iterable[Record], Callable[[], Iterable[Record]]]) -> List[Any]:
+		def build() -> List[Record]:
+			rows = list(records() if callable(records) else records)
+			missing = sum(1 for r in rows if r.get(self.primary_key) is None)
+			if not missing:
+				return rows
+			pks = iter(range(self.owner._allocate([self.name] * missing), 1 << 62))
+			return [r if r.get(self.primary_key) is not None else {self.primary_key: next(pks), **r} for r in rows]
+		return super().insert_many(build)
+
+	def sorted_rows(self, index: Optional[str] = None, key: Any = None) -> List[Record]:
+		"""Records (all, or those whose indexed key equals `key`) in primary key order"""
+		with self._lock:
+			self._sync()
+			return [self._by_pk[pk] for pk in self._sorted_pks(index, key)]
+
+	# Records moved in from another shard are appended out of key order: list
+	# and page in key order, like the other shards and seek()
+
+	def find(self, index: str, key: Any) -> List[Record]:
+		return self.sorted_rows(index, key)
+
+	def page(self, offset: int, limit: int, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], int]:
+		offset = max(offset, 0)
+		with self._lock:
+			self._sync()
+			pks = self._sorted_pks(index, key)
+			return [self._by_pk[pk] for pk in pks[offset:offset + limit]], len(pks)
+
+
+class ShardedTable:
+	"""A Table split into one data file per value of a field (e.g. one per customer).
+
+	The shards live next to the flat file, in `<name>.shards/<collection>.<value>.json`,
+	and are regular Tables with the same options. A small manifest.json holds
+	the next primary key and, per shard, the ranges of keys it was given, so
+	get() only opens the shards that can hold a key.
+
+	Reads and writes for one value of the field touch only its shard (see
+	shard()). The other queries merge the shards in primary key order. The
+	flat file is split into shards the first time the table is used and kept
+	as a backup; it is not read again.
+
+	Writes that span shards (insert_many, replace_all, an update moving a
+	record to another shard) are one write per shard, not one atomic write.
+	"""
+
+	def __init__(self, path: str, collection: str, shard_by: str, primary_key: str = "id", **options: Any) -> None:
+		self.path = path
+		self.collection = collection
+		self.shard_by = shard_by
+		self.primary_key = primary_key
+		self.options = dict(options, primary_key=primary_key)
+		self.options.pop("seed", None)
+		self.versioned = options.get("versioned", False)
+		self.directory = os.path.splitext(path)[0] + ".shards"
+		self.manifest_path = os.path.join(self.directory, "manifest.json")
+		self._lock = threading.Lock()
+		self._shards: Dict[str, _Shard] = {}
+		self._routes: Tuple[Optional[Record], Dict[str, Tuple[List[int], List[int]]]] = (None, {})
+
+	# Manifest
+
+	def _manifest(self) -> Record:
+		if not os.path.exists(self.manifest_path):
+			self._split()
+		return storage.read_snapshot(self.manifest_path)
+
+	def _split(self) -> None:
+		"""Move the records of the flat data file into their shards and write the manifest"""
+		with storage.file_lock(self.manifest_path):
+			if os.path.exists(self.manifest_path):
+				return
+			doc = Table(self.path, self.collection, **dict(self.options, journal=True)).document() if os.path.exists(self.path) else {}
+			groups: Dict[str, List[Record]] = {}
+			for record in doc.get(self.collection, []):
+				groups.setdefault(shard_name(record.get(self.shard_by)), []).append(record)
+			for name, rows in groups.items():
+				self._shard(name).replace_all(rows)
+			storage.write_json(self.manifest_path, self._rebuilt_manifest(groups, doc.get("next_id", 1)))
+
+	def _rebuilt_manifest(self, groups: Dict[str, List[Record]], next_id: int) -> Record:
+		pks = [r[self.primary_key] for rows in groups.values() for r in rows]
+		return {
+			"next_id": max([next_id] + [pk + 1 for pk in pks]),
+			"shards": {name: _ranges(r[self.primary_key] for r in rows) for name, rows in groups.items()},
+		}
+
+	def _allocate(self, names: List[str]) -> int:
+		"""Reserve consecutive new primary keys, the i-th for shard names[i], and return the first"""
+		self._manifest()
+		with storage.file_lock(self.manifest_path):
+			manifest = storage.read_for_update(self.manifest_path)
+			first = manifest["next_id"]
+			manifest["next_id"] = first + len(names)
+			for pk, name in enumerate(names, first):
+				self._add_range(manifest, name, pk, pk)
+			storage.write_json(self.manifest_path, manifest)
+		return first
+
+	def _claim(self, name: str, pk: int) -> None:
+		"""Record that a shard may now hold an existing key (a record moved into it)"""
+		with storage.file_lock(self.manifest_path):
+			manifest = storage.read_for_update(self.manifest_path)
+			self._add_range(manifest, name, pk, pk)
+			storage.write_json(self.manifest_path, manifest)
+
+	@staticmethod
+	def _add_range(manifest: Record, name: str, first: int, last: int) -> None:
+		runs = manifest["shards"].get(name, [])
+		if runs and runs[-1][1] + 1 == first:
+			runs[-1][1] = last
+		elif not runs or runs[-1][1] < first:
+			runs.append([first, last])
+		else:
+			runs = _merge(runs + [[first, last]])
+		manifest["shards"][name] = runs
+
+	def _owners(self, pk: Any) -> List[_Shard]:
+		"""Shards whose key ranges contain `pk`"""
+		if not isinstance(pk, int):
+			return []
+		manifest = self._manifest()
+		with self._lock:
+			snapshot, routes = self._routes
+			if snapshot is not manifest:
+				routes = {
+					name: ([run[0] for run in runs], [run[1] for run in runs])
+					for name, runs in manifest["shards"].items()
+				}
+				self._routes = (manifest, routes)
+		owners = []
+		for name, (starts, ends) in routes.items():
+			i = bisect_right(starts, pk) - 1
+			if i >= 0 and pk <= ends[i]:
+				owners.append(self._shard(name))
+		return owners
+
+	def _shard(self, name: str) -> _Shard:
+		with self._lock:
+			shard = self._shards.get(name)
+			if shard is None:
+				path = os.path.join(self.directory, f"{self.collection}.{name}.json")
+				shard = self._shards[name] = _Shard(self, name, path, self.collection, **self.options)
+			return shard
+
+	def shard(self, key: Any) -> Table:
+		"""The table holding the records whose shard field equals `key`"""
+		self._manifest()
+		return self._shard(shard_name(key))
+
+	def shards(self) -> List[Table]:
+		return [self._shard(name) for name in self._manifest()["shards"]]
+
+	# Reads
+
+	def document(self) -> Record:
+		return {"next_id": self._manifest()["next_id"], self.collection: self.rows()}
+
+	def rows(self) -> List[Record]:
+		"""All records in primary key order"""
+		return list(self.iter_rows())
+
+	def iter_rows(self, index: Optional[str] = None, key: Any = None) -> Iterator[Record]:
+		"""Records (all, or those whose indexed key equals `key`) in primary key order, shard by shard"""
+		return heapq.merge(*(s.sorted_rows(index, key) for s in self.shards()), key=lambda r: r[self.primary_key])
+
+	def get(self, pk: Any) -> Optional[Record]:
+		for shard in self._owners(pk):
+			record = shard.get(pk)
+			if record is not None:
+				return record
+		return None
+
+	def find(self, index: str, key: Any) -> List[Record]:
+		if index == self.shard_by:
+			return self.shard(key).find(index, key)
+		return list(self.iter_rows(index, key))
+
+	def count(self, index: str, key: Any) -> int:
+		if index == self.shard_by:
+			return self.shard(key).count(index, key)
+		return sum(s.count(index, key) for s in self.shards())
+
+	def size(self) -> int:
+		return sum(s.size() for s in self.shards())
+
+	def page(self, offset: int, limit: int, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], int]:
+		if index == self.shard_by:
+			return self.shard(key).page(offset, limit, index, key)
+		total = self.size() if index is None else self.count(index, key)
+		offset = max(offset, 0)
+		return list(islice(self.iter_rows(index, key), offset, offset + limit)), total
+
+	def seek(self, limit: int, after: Any = None, before: Any = None, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], bool]:
+		if index == self.shard_by:
+			return self.shard(key).seek(limit, after, before, index, key)
+		pages = [s.seek(limit, after, before, index, key) for s in self.shards()]
+		records = list(heapq.merge(*(p[0] for p in pages), key=lambda r: r[self.primary_key]))
+		more = any(p[1] for p in pages) or len(records) > limit
+		if before is not None and after is None:
+			return records[max(len(records) - limit, 0):], more
+		return records[:limit], more
+
+	def sort(self, order: str, descending: bool = False, index: Optional[str] = None, key: Any = None) -> List[Record]:
+		if index == self.shard_by:
+			return self.shard(key).sort(order, descending, index, key)
+		shards = self.shards()
+		if not shards:
+			return []
+		order_of = shards[0].indexes[order].key
+		return list(heapq.merge(
+			*(s.sort(order, descending, index, key) for s in shards),
+			key=lambda r: (order_key(order_of(r)), r[self.primary_key]),
+			reverse=descending,
+		))
+
+	def between(self, index: str, low: Any = None, high: Any = None) -> List[Record]:
+		shards = self.shards()
+		if not shards:
+			return []
+		key_of = shards[0].indexes[index].key
+		return list(heapq.merge(
+			*(s.between(index, low, high) for s in shards),
+			key=lambda r: (order_key(key_of(r)), r[self.primary_key]),
+		))
+
+	def distinct(self, index: str) -> List[Any]:
+		return sorted(set().union(*(s.distinct(index) for s in self.shards())), key=order_key)
+
+	def memo(self, name: str, compute: Callable[[List[Record]], Any]) -> Any:
+		return compute(self.rows())
+
+	def overlap(self, index: str, tokens: Iterable[Any], at_least: int = 1) -> List[Tuple[Record, int]]:
+		tokens = set(tokens)
+		matches = [m for s in self.shards() for m in s.overlap(index, tokens, at_least)]
+		return sorted(matches, key=lambda m: (-m[1], m[0][self.primary_key]))
+
+	# Writes
+
+	def insert(self, record: Record) -> Any:
+		return self.insert_many([record])[0]
+
+	def insert_many(self, records: Union[Iterable[Record], Callable[[], Iterable[Record]]]) -> List[Any]:
+		"""Insert records into their shards, one write per shard.
+
+		A function passed as `records` is not called under a write lock here:
+		to validate against the table, insert through shard() instead.
+		"""
+		rows = list(records() if callable(records) else records)
+		names = [shard_name(r.get(self.shard_by)) for r in rows]
+		missing = [i for i, r in enumerate(rows) if r.get(self.primary_key) is None]
+		if missing:
+			# Keys in input order, whichever shards the records go to
+			first = self._allocate([names[i] for i in missing])
+			for pk, i in enumerate(missing, first):
+				rows[i] = {self.primary_key: pk, **rows[i]}
+		groups: Dict[str, List[int]] = {}
+		for i, name in enumerate(names):
+			groups.setdefault(name, []).append(i)
+		pks: List[Any] = [None] * len(rows)
+		for name, positions in groups.items():
+			for i, pk in zip(positions, self._shard(name).insert_many([rows[i] for i in positions])):
+				pks[i] = pk
+		return pks
+
+	def update(
+		self,
+		pk: Any,
+		change: Union[Record, Callable[[Record], Optional[bool]]],
+		expected_version: Optional[int] = None,
+	) -> bool:
+		"""Table.update(); a record whose shard field changes moves to its new shard"""
+		moved: List[Record] = []
+		for source in self._owners(pk):
+			def update(record: Record) -> Optional[bool]:
+				if callable(change):
+					if change(record) is False:
+						return False
+				else:
+					record.update(change)
+				if shard_name(record.get(self.shard_by)) != source.name:
+					moved.append(record)
+					return False
+				return None
+			if source.update(pk, update, expected_version):
+				return True
+			if moved:
+				record = moved[0]
+				if self.versioned:
+					record[VERSION_FIELD] = record.get(VERSION_FIELD, 0) + 1
+				target = self.shard(record.get(self.shard_by))
+				self._claim(target.name, pk)
+				target.insert(record)
+				source.delete(pk)
+				return True
+		return False
+
+	def delete(self, pk: Any) -> bool:
+		return any(shard.delete(pk) for shard in self._owners(pk))
+
+	def replace_all(self, rows: Iterable[Record], **meta: Any) -> None:
+		"""Rewrite every shard and the manifest"""
+		groups: Dict[str, List[Record]] = {}
+		for record in rows:
+			groups.setdefault(shard_name(record.get(self.shard_by)), []).append(record)
+		for shard in self.shards():
+			groups.setdefault(shard.name, [])
+		for name, shard_rows in groups.items():
+			self._shard(name).replace_all(shard_rows)
+		# Shards first, manifest last: its lock is only ever taken inside a shard's
+		with storage.file_lock(self.manifest_path):
+			next_id = max(meta.get("next_id", 1), storage.read_snapshot(self.manifest_path)["next_id"])
+			storage.write_json(self.manifest_path, self._rebuilt_manifest(groups, next_id))
+
+	def compact(self) -> None:
+		for shard in self.shards():
+			shard.compact()
@@ -0,0 +1,70 @@
+import math
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Callable, FrozenSet, Iterable, List, Optional, Tuple
+
+from .table import Record
+
+# Dice coefficient of two trigram sets from which the values count as alike
+THRESHOLD = 0.6
+# Folded values kept in memory: ranking folds the candidates' names again on every lookup
+CACHE_SIZE = 65536
+
+_WORDS = re.compile(r"[^\W\d_]+|\d+")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def fold(value: Optional[str]) -> str:
+	"""Lowercase words without diacritics, punctuation or leading zeros: "Đất  nền-01" -> "dat nen 1" """
+	value = unicodedata.normalize("NFKD", (value or "").replace("đ", "d").replace("Đ", "D"))
+	value = "".join(c for c in value if not unicodedata.combining(c)).lower()
+	return " ".join((word.lstrip("0") or "0") if word.isdigit() else word for word in _WORDS.findall(value))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def trigrams(value: Optional[str]) -> FrozenSet[str]:
+	"""Trigrams of each folded word, padded like PostgreSQL's pg_trgm: "dat" -> "  d", " da", "dat", "at " """
+	grams = set()
+	for word in fold(value).split():
+		padded = "  " + word + " "
+		grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+	return frozenset(grams)
+
+
+def min_shared(grams: FrozenSet[str], threshold: float = THRESHOLD) -> int:
+	"""Fewest trigrams a value must share with `grams` to reach the threshold.
+
+	A value sharing s trigrams has at least s of its own, so its Dice score is
+	at most 2s / (len + s), which reaches t only from s >= t * len / (2 - t).
+	"""
+	return max(1, math.ceil(threshold * len(grams) / (2 - threshold) - 1e-9))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _series(value: Optional[str]) -> Tuple[str, ...]:
+	"""The numbers and single letters of a folded value, which number the samples of a series"""
+	return tuple(word for word in fold(value).split() if word.isdigit() or len(word) == 1)
+
+
+def rank(
+	value: Optional[str],
+	matches: Iterable[Tuple[Record, int]],
+	value_of: Callable[[Record], Any],
+	threshold: float = THRESHOLD,
+) -> List[Tuple[Record, float]]:
+	"""Score the (record, shared trigrams) pairs of Table.overlap() against value, best first.
+
+	The score is the Dice coefficient 2 * shared / (|A| + |B|). Records whose
+	numbers or single letters differ from value's are left out, so "Đất nền 1"
+	and "Đất nền 2", or "Mẫu A" and "Mẫu B", stay two samples of a series.
+	"""
+	grams, series = trigrams(value), _series(value)
+	ranked = []
+	for record, shared in matches:
+		other = value_of(record)
+		score = 2 * shared / (len(grams) + len(trigrams(other)))
+		if score >= threshold and _series(other) == series:
+			ranked.append((record, round(score, 2)))
+	ranked.sort(key=lambda m: -m[1])
+	return ranked
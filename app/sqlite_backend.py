@@ -0,0 +1,524 @@
+import importlib
+import os
+import sqlite3
+import threading
+import weakref
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from . import serializer, storage
+from .lines_table import LinesTable, index_path
+from .sharded_table import ShardedTable
+from .table import JOURNAL_SEQ_FIELD, VERSION_FIELD, Index, Record, Table, TokenIndex, check_version, current_unit, registered_tables
+
+DATABASE_FILE = os.environ.get("NAA_SQLITE_PATH") or storage.data_path("naa.sqlite3")
+
+# Modules declaring the tables the importer copies from data/*.json
+STORE_MODULES = (
+	"customers_store",
+	"samples_store",
+	"closed_samples_store",
+	"foil_store",
+	"standard_store",
+	"standard_inventory_store",
+	"task_assignment_store",
+	"users_store",
+	"channel_7_1_store",
+	"thermal_column_store",
+	"rotating_disk_store",
+)
+
+# PRAGMA synchronous for each storage.DURABILITY mode
+_SYNCHRONOUS = {"always": "FULL", "batched": "NORMAL", "none": "OFF"}
+
+_local = threading.local()
+# Replaced by a new object on every commit made by this process, see SqliteTable.memo
+_committed = object()
+# Every SqliteTable, so a write step can create the schemas before it begins
+_tables: "weakref.WeakSet[SqliteTable]" = weakref.WeakSet()
+
+
+def connect() -> sqlite3.Connection:
+	"""Return this thread's connection to the database (WAL mode, autocommit)"""
+	conn = getattr(_local, "conn", None)
+	if conn is None:
+		os.makedirs(os.path.dirname(os.path.abspath(DATABASE_FILE)), exist_ok=True)
+		conn = sqlite3.connect(DATABASE_FILE, timeout=30, isolation_level=None)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS[storage.DURABILITY]}")
+		conn.execute(
+			"CREATE TABLE IF NOT EXISTS _meta ("
+			"tbl TEXT NOT NULL, key TEXT NOT NULL, value TEXT, PRIMARY KEY (tbl, key))"
+		)
+		_local.conn = conn
+	return conn
+
+
+class _Transaction:
+	"""BEGIN IMMEDIATE ... COMMIT/ROLLBACK on this thread's connection.
+
+	Inside a write step (see table.write_step) the transaction lasts until the
+	outermost step ends, so the step's writes commit or roll back together as
+	on the file backends. Each call then runs in a SAVEPOINT, undone alone if
+	it raises. join=False keeps the call out of a step not yet begun.
+	"""
+
+	def __init__(self, join: bool = True) -> None:
+		self.join = join
+
+	def __enter__(self) -> sqlite3.Connection:
+		self.conn = connect()
+		unit = current_unit() if self.join else None
+		self.savepoint = self.conn.in_transaction
+		if not self.savepoint and unit is not None and unit.steps:
+			# Schemas first: their DDL must not be rolled back with the step
+			_ready_tables()
+			self.conn.execute("BEGIN IMMEDIATE")
+			unit.enlist(_end_step)
+			self.savepoint = True
+		if self.savepoint:
+			self.conn.execute("SAVEPOINT call")
+		else:
+			self.conn.execute("BEGIN IMMEDIATE")
+		return self.conn
+
+	def __exit__(self, exc_type, exc, tb) -> None:
+		global _committed
+		if self.savepoint:
+			if exc_type:
+				self.conn.execute("ROLLBACK TO call")
+			self.conn.execute("RELEASE call")
+		else:
+			self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+		if not exc_type:
+			_committed = object()
+
+
+def _end_step(ok: bool) -> None:
+	global _committed
+	conn = connect()
+	if conn.in_transaction:
+		conn.execute("COMMIT" if ok else "ROLLBACK")
+	_committed = object()
+	if not ok:
+		# A table first used inside the step had its schema rolled back too
+		for table in list(_tables):
+			table._ready = False
+
+
+def _ready_tables() -> None:
+	for table in list(_tables):
+		table._conn()
+
+
+def _text(value: Any) -> str:
+	return serializer.dumps(value).decode("utf-8")
+
+
+def _quote(name: str) -> str:
+	return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteTable:
+	"""Same API as table.Table, persisted to one SQLite table per data file.
+
+	The primary key and every declared index get a real column with an SQL
+	index; the full record is kept as JSON next to them. Rows keep their
+	insertion order through the `seq` column, like records in a JSON list.
+	A TokenIndex gets a side table of (token, pk) rows instead of a column.
+	"""
+
+	def __init__(
+		self,
+		path: str,
+		collection: str,
+		seed: Union[Record, Callable[[], Record], None] = None,
+		primary_key: str = "id",
+		indexes: Optional[Dict[str, Union[Index, Callable[[Record], Any]]]] = None,
+		stamp_field: Optional[str] = None,
+		versioned: bool = False,
+	) -> None:
+		self.path = path
+		self.collection = collection
+		self.seed = seed if seed is not None else {collection: []}
+		self.primary_key = primary_key
+		self.indexes: Dict[str, Callable[[Record], Any]] = {
+			name: spec.key if isinstance(spec, Index) else spec
+			for name, spec in (indexes or {}).items()
+			if not isinstance(spec, TokenIndex)
+		}
+		self.token_indexes: Dict[str, Callable[[Record], Iterable[Any]]] = {
+			name: spec.key for name, spec in (indexes or {}).items() if isinstance(spec, TokenIndex)
+		}
+		self.stamp_field = stamp_field
+		self.versioned = versioned
+		self.name = os.path.splitext(os.path.basename(path))[0]
+		self._table = _quote(self.name)
+		self._ready = False
+		self._lock = threading.Lock()
+		self._memos = threading.local()
+		_tables.add(self)
+
+	# Schema
+
+	def _column(self, index: str) -> str:
+		return _quote("ix_" + index)
+
+	def _tokens(self, index: str) -> str:
+		return _quote(self.name + "__" + index)
+
+	def _conn(self) -> sqlite3.Connection:
+		if not self._ready:
+			with self._lock:
+				if not self._ready:
+					self._create_schema()
+					self._ready = True
+		return connect()
+
+	def _create_schema(self) -> None:
+		conn = connect()
+		exists = conn.execute(
+			"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.name,)
+		).fetchone()
+		if not exists:
+			columns = "".join(f", {self._column(name)}" for name in self.indexes)
+			conn.execute(
+				f"CREATE TABLE IF NOT EXISTS {self._table} ("
+				f"seq INTEGER PRIMARY KEY AUTOINCREMENT, pk{columns}, data TEXT NOT NULL)"
+			)
+		else:
+			# Indexes declared after the table was created: add and backfill their columns
+			present = {row[1] for row in conn.execute(f"PRAGMA table_info({self._table})")}
+			missing = [name for name in self.indexes if "ix_" + name not in present]
+			if missing:
+				with _Transaction(join=False) as tx:
+					for name in missing:
+						tx.execute(f"ALTER TABLE {self._table} ADD COLUMN {self._column(name)}")
+					for seq, data in tx.execute(f"SELECT seq, data FROM {self._table}").fetchall():
+						record = serializer.loads(data)
+						tx.execute(
+							f"UPDATE {self._table} SET "
+							+ ", ".join(f"{self._column(name)} = ?" for name in missing)
+							+ " WHERE seq = ?",
+							[self.indexes[name](record) for name in missing] + [seq],
+						)
+		conn.execute(
+			f"CREATE INDEX IF NOT EXISTS {_quote(self.name + '__pk')} ON {self._table} (pk)"
+		)
+		for name in self.indexes:
+			conn.execute(
+				f"CREATE INDEX IF NOT EXISTS {_quote(self.name + '__' + name)} "
+				f"ON {self._table} ({self._column(name)}, seq)"
+			)
+			# Keyset pages (seek) walk the matching records in primary key order
+			conn.execute(
+				f"CREATE INDEX IF NOT EXISTS {_quote(self.name + '__' + name + '__pk')} "
+				f"ON {self._table} ({self._column(name)}, pk)"
+			)
+		for name in self.token_indexes:
+			filled = conn.execute(
+				"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.name + "__" + name,)
+			).fetchone()
+			conn.execute(f"CREATE TABLE IF NOT EXISTS {self._tokens(name)} (token NOT NULL, pk NOT NULL)")
+			conn.execute(
+				f"CREATE INDEX IF NOT EXISTS {_quote(self.name + '__' + name + '__token')} "
+				f"ON {self._tokens(name)} (token, pk)"
+			)
+			conn.execute(
+				f"CREATE INDEX IF NOT EXISTS {_quote(self.name + '__' + name + '__pk')} "
+				f"ON {self._tokens(name)} (pk)"
+			)
+			if exists and not filled:
+				# Declared after the table was created: backfill from the records
+				with _Transaction(join=False) as tx:
+					records = [serializer.loads(data) for (data,) in tx.execute(f"SELECT data FROM {self._table}")]
+					self._insert_tokens(tx, records, [name])
+		if not exists:
+			seed = self.seed() if callable(self.seed) else self.seed
+			meta = {k: v for k, v in seed.items() if k != self.collection}
+			with _Transaction(join=False) as tx:
+				self._insert_rows(tx, seed.get(self.collection, []))
+				self._write_meta(tx, meta)
+
+	# Helpers
+
+	def _meta(self, conn: sqlite3.Connection) -> Record:
+		return {
+			key: serializer.loads(value)
+			for key, value in conn.execute("SELECT key, value FROM _meta WHERE tbl = ?", (self.name,))
+		}
+
+	def _write_meta(self, conn: sqlite3.Connection, meta: Record) -> None:
+		if self.stamp_field:
+			meta = dict(meta)
+			meta[self.stamp_field] = datetime.now().isoformat()
+		conn.executemany(
+			"INSERT OR REPLACE INTO _meta (tbl, key, value) VALUES (?, ?, ?)",
+			[(self.name, key, _text(value)) for key, value in meta.items()],
+		)
+
+	def _values(self, record: Record) -> List[Any]:
+		return (
+			[record.get(self.primary_key)]
+			+ [key(record) for key in self.indexes.values()]
+			+ [_text(record)]
+		)
+
+	def _insert_rows(self, conn: sqlite3.Connection, records: Iterable[Record]) -> None:
+		columns = ", ".join(["pk"] + [self._column(name) for name in self.indexes] + ["data"])
+		marks = ", ".join("?" * (len(self.indexes) + 2))
+		records = list(records)
+		conn.executemany(
+			f"INSERT INTO {self._table} ({columns}) VALUES ({marks})",
+			[self._values(record) for record in records],
+		)
+		self._insert_tokens(conn, records)
+
+	def _insert_tokens(self, conn: sqlite3.Connection, records: List[Record], names: Optional[Iterable[str]] = None) -> None:
+		for name in self.token_indexes if names is None else names:
+			key = self.token_indexes[name]
+			conn.executemany(
+				f"INSERT INTO {self._tokens(name)} (token, pk) VALUES (?, ?)",
+				[(token, record.get(self.primary_key)) for record in records for token in set(key(record))],
+			)
+
+	def _delete_tokens(self, conn: sqlite3.Connection, pk: Any) -> None:
+		for name in self.token_indexes:
+			conn.execute(f"DELETE FROM {self._tokens(name)} WHERE pk = ?", (pk,))
+
+	def _select(self, where: str = "", params: Tuple = (), limit: str = "") -> List[Record]:
+		rows = self._conn().execute(
+			f"SELECT data FROM {self._table} {where} ORDER BY seq {limit}", params
+		)
+		return [storage.freeze(serializer.loads(data)) for (data,) in rows]
+
+	def _where(self, index: Optional[str], key: Any) -> Tuple[str, Tuple]:
+		if index is None:
+			return "", ()
+		if index not in self.indexes:
+			raise KeyError(index)
+		return f"WHERE {self._column(index)} IS ?", (key,)
+
+	# Reads
+
+	def document(self) -> Record:
+		"""The whole collection plus its document fields (next_id, last_updated, ...)"""
+		doc = self._meta(self._conn())
+		doc[self.collection] = storage.FrozenList(self.rows())
+		return storage.freeze(doc)
+
+	def rows(self) -> List[Record]:
+		return self._select()
+
+	def size(self) -> int:
+		return self._conn().execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+	def get(self, pk: Any) -> Optional[Record]:
+		rows = self._select("WHERE pk = ?", (pk,), "LIMIT 1")
+		return rows[0] if rows else None
+
+	def find(self, index: str, key: Any) -> List[Record]:
+		return self._select(*self._where(index, key))
+
+	def count(self, index: str, key: Any) -> int:
+		where, params = self._where(index, key)
+		return self._conn().execute(f"SELECT COUNT(*) FROM {self._table} {where}", params).fetchone()[0]
+
+	def page(self, offset: int, limit: int, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], int]:
+		where, params = self._where(index, key)
+		total = self._conn().execute(f"SELECT COUNT(*) FROM {self._table} {where}", params).fetchone()[0]
+		rows = self._select(where, params + (limit, max(offset, 0)), "LIMIT ? OFFSET ?")
+		return rows, total
+
+	def seek(self, limit: int, after: Any = None, before: Any = None, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], bool]:
+		"""Keyset page in primary key order: a range scan of the (column, pk) index instead of OFFSET"""
+		where, params = self._where(index, key)
+		order = "pk"
+		if after is not None or before is not None:
+			where += (" AND " if where else "WHERE ") + ("pk > ?" if after is not None else "pk < ?")
+			params += (after if after is not None else before,)
+			order = "pk" if after is not None else "pk DESC"
+		rows = self._conn().execute(
+			f"SELECT data FROM {self._table} {where} ORDER BY {order} LIMIT ?", params + (limit + 1,)
+		).fetchall()
+		records = [storage.freeze(serializer.loads(data)) for (data,) in rows[:limit]]
+		if order == "pk DESC":
+			records.reverse()
+		return records, len(rows) > limit
+
+	def sort(self, order: str, descending: bool = False, index: Optional[str] = None, key: Any = None) -> List[Record]:
+		"""Records (all, or those whose indexed key equals `key`) ordered by index `order`, then by primary key"""
+		if order not in self.indexes:
+			raise KeyError(order)
+		where, params = self._where(index, key)
+		direction = " DESC" if descending else ""
+		rows = self._conn().execute(
+			f"SELECT data FROM {self._table} {where} ORDER BY {self._column(order)}{direction}, pk{direction}", params
+		)
+		return [storage.freeze(serializer.loads(data)) for (data,) in rows]
+
+	def between(self, index: str, low: Any = None, high: Any = None) -> List[Record]:
+		"""Records whose key in `index` lies between low and high (inclusive, None for no bound): a range scan of its SQL index"""
+		if index not in self.indexes:
+			raise KeyError(index)
+		column = self._column(index)
+		bounds = [(f"{column} >= ?", low), (f"{column} <= ?", high)]
+		where = " AND ".join(cond for cond, value in bounds if value is not None)
+		rows = self._conn().execute(
+			f"SELECT data FROM {self._table} {'WHERE ' + where if where else ''} ORDER BY {column}, pk",
+			tuple(value for _, value in bounds if value is not None),
+		)
+		return [storage.freeze(serializer.loads(data)) for (data,) in rows]
+
+	def distinct(self, index: str) -> List[Any]:
+		"""The distinct keys of an index, sorted: a scan of its SQL index only"""
+		if index not in self.indexes:
+			raise KeyError(index)
+		column = self._column(index)
+		return [key for (key,) in self._conn().execute(f"SELECT DISTINCT {column} FROM {self._table} ORDER BY {column}")]
+
+	def memo(self, name: str, compute: Callable[[List[Record]], Any]) -> Any:
+		"""compute(rows), kept per thread until a commit: one of this process (any
+		table) or one of another connection, which PRAGMA data_version reports.
+		"""
+		conn = self._conn()
+		token = (conn.execute("PRAGMA data_version").fetchone()[0], _committed)
+		cached = getattr(self._memos, name, None)
+		if cached is None or cached[0] != token:
+			cached = (token, compute(self.rows()))
+			setattr(self._memos, name, cached)
+		return cached[1]
+
+	def overlap(self, index: str, tokens: Iterable[Any], at_least: int = 1) -> List[Tuple[Record, int]]:
+		"""Records filed under at least `at_least` of `tokens` in a TokenIndex, with how many, most first: a GROUP BY over its side table"""
+		if index not in self.token_indexes:
+			raise KeyError(index)
+		tokens = list(set(tokens))
+		if not tokens:
+			return []
+		marks = ", ".join("?" * len(tokens))
+		rows = self._conn().execute(
+			f"SELECT t.data, m.n FROM (SELECT pk, COUNT(*) AS n FROM {self._tokens(index)} "
+			f"WHERE token IN ({marks}) GROUP BY pk HAVING COUNT(*) >= ?) m "
+			f"JOIN {self._table} t ON t.pk = m.pk ORDER BY m.n DESC, m.pk",
+			tokens + [at_least],
+		)
+		return [(storage.freeze(serializer.loads(data)), n) for data, n in rows]
+
+	# Writes
+
+	def insert(self, record: Record) -> Any:
+		return self.insert_many([record])[0]
+
+	def insert_many(self, records: Union[Iterable[Record], Callable[[], Iterable[Record]]]) -> List[Any]:
+		self._conn()
+		with _Transaction() as tx:
+			# A function is called inside the transaction, like the mutators of update()
+			records = list(records() if callable(records) else records)
+			meta = self._meta(tx)
+			new_records = []
+			top = None  # highest primary key so far, for tables numbered max+1
+			explicit = [r[self.primary_key] for r in records if isinstance(r.get(self.primary_key), int)]
+			for record in records:
+				if record.get(self.primary_key) is None:
+					if "next_id" in meta:
+						pk = meta["next_id"]
+						while tx.execute(f"SELECT 1 FROM {self._table} WHERE pk = ?", (pk,)).fetchone():
+							pk += 1
+						meta["next_id"] = pk + 1
+					else:
+						if top is None:
+							current = tx.execute(f"SELECT MAX(pk) FROM {self._table}").fetchone()[0]
+							top = max([current or 0] + explicit)
+						top += 1
+						pk = top
+					# Keep the primary key as the first field, like the hand-written records
+					record = {self.primary_key: pk, **record}
+				if self.versioned and VERSION_FIELD not in record:
+					record = {**record, VERSION_FIELD: 1}
+				new_records.append(record)
+			self._insert_rows(tx, new_records)
+			self._write_meta(tx, {"next_id": meta["next_id"]} if "next_id" in meta else {})
+		return [r[self.primary_key] for r in new_records]
+
+	def update(
+		self,
+		pk: Any,
+		change: Union[Record, Callable[[Record], Optional[bool]]],
+		expected_version: Optional[int] = None,
+	) -> bool:
+		self._conn()
+		with _Transaction() as tx:
+			row = tx.execute(
+				f"SELECT seq, data FROM {self._table} WHERE pk = ? ORDER BY seq LIMIT 1", (pk,)
+			).fetchone()
+			if row is None:
+				return False
+			seq, data = row
+			record = serializer.loads(data)
+			check_version(pk, record, expected_version)
+			version = record.get(VERSION_FIELD, 0)
+			if callable(change):
+				if change(record) is False:
+					return False
+			else:
+				record.update(change)
+			if self.versioned:
+				record[VERSION_FIELD] = version + 1
+			assignments = ", ".join(
+				["pk = ?"] + [f"{self._column(name)} = ?" for name in self.indexes] + ["data = ?"]
+			)
+			tx.execute(f"UPDATE {self._table} SET {assignments} WHERE seq = ?", self._values(record) + [seq])
+			if self.token_indexes:
+				self._delete_tokens(tx, pk)
+				self._insert_tokens(tx, [record])
+			self._write_meta(tx, {})
+		return True
+
+	def delete(self, pk: Any) -> bool:
+		self._conn()
+		with _Transaction() as tx:
+			deleted = tx.execute(f"DELETE FROM {self._table} WHERE pk = ?", (pk,)).rowcount
+			if deleted:
+				self._delete_tokens(tx, pk)
+				self._write_meta(tx, {})
+		return bool(deleted)
+
+	def replace_all(self, rows: Iterable[Record], **meta: Any) -> None:
+		self._conn()
+		with _Transaction() as tx:
+			tx.execute(f"DELETE FROM {self._table}")
+			for name in self.token_indexes:
+				tx.execute(f"DELETE FROM {self._tokens(name)}")
+			self._insert_rows(tx, rows)
+			self._write_meta(tx, meta)
+
+
+def import_json_files() -> Dict[str, int]:
+	"""Copy every store's data/*.json file into the SQLite database, replacing its rows.
+
+	Returns the number of records imported per table.
+	"""
+	for module in STORE_MODULES:
+		importlib.import_module(f"{__package__}.{module}")
+
+	imported = {}
+	for path, collection, options in registered_tables():
+		options = dict(options)
+		lines = options.pop("lines", False)
+		shard_by = options.pop("shard_by", None)
+		sharded = ShardedTable(path, collection, shard_by, journal=True, **options) if shard_by else None
+		if sharded and os.path.exists(sharded.manifest_path):
+			doc = sharded.document()
+		elif lines and os.path.exists(index_path(path)):
+			doc = LinesTable(path, collection, **options).document()
+		elif os.path.exists(path):
+			# Read through a journaled table so entries not yet compacted come along too
+			doc = Table(path, collection, journal=True, **options).document()
+		else:
+			continue
+		table = SqliteTable(path, collection, **options)
+		meta = {k: storage.thaw(v) for k, v in doc.items() if k not in (collection, JOURNAL_SEQ_FIELD)}
+		table.replace_all([storage.thaw(r) for r in doc.get(collection, [])], **meta)
+		imported[table.name] = table.size()
+	return imported
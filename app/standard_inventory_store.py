@@ -1,102 +1,74 @@
-import json
 import os
 import shutil
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 from werkzeug.utils import secure_filename
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-INVENTORIES_FILE = os.path.join(DATA_DIR, "standard_inventories.json")
+from .pagination import Page, paginate
+from .storage import data_path
+from .table import open_table
+
+INVENTORIES_FILE = data_path("standard_inventories.json")
 CERTIFICATES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "certificates")
 
 # Ensure certificates directory exists
 os.makedirs(CERTIFICATES_DIR, exist_ok=True)
 
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(INVENTORIES_FILE):
-		with open(INVENTORIES_FILE, "w", encoding="utf-8") as f:
-			json.dump({"next_id": 1, "inventories": []}, f, ensure_ascii=False, indent=2)
+_inventories = open_table(
+	INVENTORIES_FILE,
+	"inventories",
+	seed={"next_id": 1, "inventories": []},
+	indexes={
+		"standard_type": lambda i: (i.get("standard_type") or "").lower(),
+		# Types as written, for the filter dropdown (Table.distinct)
+		"standard_types": lambda i: i.get("standard_type") or None,
+	},
+	versioned=True,
+)
 
 
-def _read() -> Dict[str, Any]:
-	_ensure_store()
-	with open(INVENTORIES_FILE, "r", encoding="utf-8") as f:
-		return json.load(f)
+def _used_weight(standard_name: str) -> float:
+	"""Sum the weight of the closed standards taken from one reference material"""
+	from app.standard_store import list_standards_by_name
+	return sum(standard.get("weight", 0) for standard in list_standards_by_name(standard_name))
 
 
-def _write(data: Dict[str, Any]) -> None:
-	with open(INVENTORIES_FILE, "w", encoding="utf-8") as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+def _with_weights(inventory: Dict[str, Any]) -> Dict[str, Any]:
+	"""Copy an inventory record and fill in its used and remaining weight"""
+	inventory = dict(inventory)
+	used_weight = _used_weight(inventory.get("standard_name", ""))
+	inventory["used_weight"] = used_weight
+	inventory["remaining_weight"] = inventory.get("total_weight", 0) - used_weight
+	return inventory
 
 
 def list_inventories() -> List[Dict[str, Any]]:
 	"""Get all standard inventories with calculated used weight from standards"""
-	from app.standard_store import list_standards
-	
-	data = _read()
-	inventories = data.get("inventories", [])
-	
-	# Get all standards to calculate used weight
-	standards = list_standards()
-	
-	# Calculate used weight for each inventory
-	for inventory in inventories:
-		standard_name = inventory.get("standard_name", "")
-		used_weight = 0
-		
-		# Sum up weight from standards with matching standard_name
-		for standard in standards:
-			if standard.get("standard_name") == standard_name:
-				used_weight += standard.get("weight", 0)
-		
-		# Update used weight and calculate remaining weight
-		inventory["used_weight"] = used_weight
-		total_weight = inventory.get("total_weight", 0)
-		inventory["remaining_weight"] = total_weight - used_weight
-	
-	return inventories
+	return [_with_weights(i) for i in _inventories.rows()]
 
 
-def list_inventories_paginated(page: int = 1, per_page: int = 20, standard_type: Optional[str] = None) -> tuple[List[Dict[str, Any]], int, int]:
-	"""Get paginated inventories with optional type filter. Returns (inventories, total_pages, total_count)"""
-	from app.standard_store import list_standards
-	
-	all_inventories = _read().get("inventories", [])
-	
-	# Filter by standard type if specified
+def list_inventory_types() -> List[str]:
+	"""The standard types of the inventories, sorted, each once (from the index, without a scan)"""
+	return [standard_type for standard_type in _inventories.distinct("standard_types") if standard_type]
+
+
+def list_inventories_paginated(page: int = 1, per_page: int = 20, standard_type: Optional[str] = None, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True) -> Page:
+	"""Get paginated inventories with optional type filter. Returns (inventories, total_pages, total_count, cursors)
+
+	With an after/before cursor token the page is found by key at the same cost
+	at any depth; with_total=False skips counting (see pagination.paginate).
+	"""
+	# Filter by standard type if specified; the table cuts the page itself
 	if standard_type:
-		all_inventories = [i for i in all_inventories if i.get("standard_type", "").lower() == standard_type.lower()]
-	
-	total_count = len(all_inventories)
-	total_pages = (total_count + per_page - 1) // per_page
+		inventories, total_pages, total_count, cursors = paginate(_inventories, page, per_page, after, before, "standard_type", standard_type.lower(), with_total)
+	else:
+		inventories, total_pages, total_count, cursors = paginate(_inventories, page, per_page, after, before, with_total=with_total)
 	
-	# Calculate offset
-	offset = (page - 1) * per_page
+	# Get inventories for current page with their used/remaining weight
+	inventories = [_with_weights(i) for i in inventories]
 	
-	# Get inventories for current page
-	inventories = all_inventories[offset:offset + per_page]
-	
-	# Get all standards to calculate used weight
-	standards = list_standards()
-	
-	# Calculate used weight for each inventory
-	for inventory in inventories:
-		standard_name = inventory.get("standard_name", "")
-		used_weight = 0
-		
-		# Sum up weight from standards with matching standard_name
-		for standard in standards:
-			if standard.get("standard_name") == standard_name:
-				used_weight += standard.get("weight", 0)
-		
-		# Update used weight and calculate remaining weight
-		inventory["used_weight"] = used_weight
-		total_weight = inventory.get("total_weight", 0)
-		inventory["remaining_weight"] = total_weight - used_weight
-	
-	return inventories, total_pages, total_count
+	return inventories, total_pages, total_count, cursors
 
 
 def create_inventory(
@@ -108,24 +80,13 @@ def create_inventory(
 	note: str = ""
 ) -> int:
 	"""Create a new standard inventory record"""
-	data = _read()
-	inventory_id = data["next_id"]
-	
 	# Calculate used weight from standards
-	from app.standard_store import list_standards
-	standards = list_standards()
-	used_weight = 0
-	
-	# Sum up weight from standards with matching standard_name
-	for standard in standards:
-		if standard.get("standard_name") == standard_name:
-			used_weight += standard.get("weight", 0)
+	used_weight = _used_weight(standard_name)
 	
 	# Calculate remaining weight
 	remaining_weight = total_weight - used_weight
 	
 	inventory = {
-		"id": inventory_id,
 		"standard_name": standard_name,
 		"box_symbol": box_symbol,
 		"total_weight": total_weight,
@@ -138,20 +99,13 @@ def create_inventory(
 		"updated_at": datetime.now().isoformat()
 	}
 	
-	data["inventories"].append(inventory)
-	data["next_id"] += 1
-	_write(data)
-	
-	return inventory_id
+	return _inventories.insert(inventory)
 
 
 def get_inventory(inventory_id: int) -> Optional[Dict[str, Any]]:
 	"""Get a specific inventory by ID"""
-	inventories = list_inventories()
-	for inventory in inventories:
-		if inventory["id"] == inventory_id:
-			return inventory
-	return None
+	inventory = _inventories.get(inventory_id)
+	return _with_weights(inventory) if inventory is not None else None
 
 
 def update_inventory(
@@ -160,71 +114,51 @@ def update_inventory(
 	box_symbol: str,
 	total_weight: float,
 	standard_type: str = "",
-	note: str = ""
+	note: str = "",
+	expected_version: Optional[int] = None
 ) -> bool:
-	"""Update an existing inventory"""
-	data = _read()
-	for inventory in data["inventories"]:
-		if inventory["id"] == inventory_id:
-			# Calculate used weight from standards
-			from app.standard_store import list_standards
-			standards = list_standards()
-			used_weight = 0
-			
-			# Sum up weight from standards with matching standard_name
-			for standard in standards:
-				if standard.get("standard_name") == standard_name:
-					used_weight += standard.get("weight", 0)
-			
-			# Calculate remaining weight
-			remaining_weight = total_weight - used_weight
-			
-			inventory["standard_name"] = standard_name
-			inventory["box_symbol"] = box_symbol
-			inventory["total_weight"] = total_weight
-			inventory["used_weight"] = used_weight
-			inventory["remaining_weight"] = remaining_weight
-			inventory["standard_type"] = standard_type
-			inventory["note"] = note
-			inventory["updated_at"] = datetime.now().isoformat()
-			
-			_write(data)
-			return True
-	return False
+	"""Update an existing inventory (VersionConflictError if expected_version is stale)"""
+	if _inventories.get(inventory_id) is None:
+		return False
+	
+	# Calculate used weight from standards
+	used_weight = _used_weight(standard_name)
+	
+	return _inventories.update(inventory_id, {
+		"standard_name": standard_name,
+		"box_symbol": box_symbol,
+		"total_weight": total_weight,
+		"used_weight": used_weight,
+		"remaining_weight": total_weight - used_weight,
+		"standard_type": standard_type,
+		"note": note,
+		"updated_at": datetime.now().isoformat(),
+	}, expected_version=expected_version)
 
 
 def update_used_weight(inventory_id: int, used_weight: float) -> bool:
 	"""Update used weight and recalculate remaining weight"""
-	data = _read()
-	for inventory in data["inventories"]:
-		if inventory["id"] == inventory_id:
-			total_weight = inventory["total_weight"]
-			remaining_weight = total_weight - used_weight
-			
-			inventory["used_weight"] = used_weight
-			inventory["remaining_weight"] = remaining_weight
-			inventory["updated_at"] = datetime.now().isoformat()
-			
-			_write(data)
-			return True
-	return False
+	def apply(inventory: Dict[str, Any]) -> None:
+		inventory["used_weight"] = used_weight
+		inventory["remaining_weight"] = inventory["total_weight"] - used_weight
+		inventory["updated_at"] = datetime.now().isoformat()
+	
+	return _inventories.update(inventory_id, apply)
 
 
 def delete_inventory(inventory_id: int) -> bool:
 	"""Delete an inventory and its certificate file"""
-	data = _read()
-	for inventory in data["inventories"]:
-		if inventory["id"] == inventory_id:
-			# Delete certificate file if exists
-			if inventory.get("certificate_file"):
-				certificate_path = os.path.join(CERTIFICATES_DIR, inventory["certificate_file"])
-				if os.path.exists(certificate_path):
-					os.remove(certificate_path)
-			
-			data["inventories"] = [i for i in data["inventories"] if i["id"] != inventory_id]
-			_write(data)
-			return True
-	return False
+	inventory = _inventories.get(inventory_id)
+	if inventory is None:
+		return False
+	
+	# Delete certificate file if exists
+	if inventory.get("certificate_file"):
+		certificate_path = os.path.join(CERTIFICATES_DIR, inventory["certificate_file"])
+		if os.path.exists(certificate_path):
+			os.remove(certificate_path)
+	
+	return _inventories.delete(inventory_id)
 
 
 def upload_certificate(inventory_id: int, file) -> bool:
@@ -247,20 +181,17 @@ def upload_certificate(inventory_id: int, file) -> bool:
 	file.save(file_path)
 	
 	# Update inventory record
-	data = _read()
-	for inventory in data["inventories"]:
-		if inventory["id"] == inventory_id:
-			# Delete old certificate if exists
-			if inventory.get("certificate_file"):
-				old_certificate_path = os.path.join(CERTIFICATES_DIR, inventory["certificate_file"])
-				if os.path.exists(old_certificate_path):
-					os.remove(old_certificate_path)
-			
-			inventory["certificate_file"] = filename
-			inventory["updated_at"] = datetime.now().isoformat()
-			_write(data)
-			return True
-	return False
+	def apply(inventory: Dict[str, Any]) -> None:
+		# Delete old certificate if exists
+		if inventory.get("certificate_file"):
+			old_certificate_path = os.path.join(CERTIFICATES_DIR, inventory["certificate_file"])
+			if os.path.exists(old_certificate_path):
+				os.remove(old_certificate_path)
+		
+		inventory["certificate_file"] = filename
+		inventory["updated_at"] = datetime.now().isoformat()
+	
+	return _inventories.update(inventory_id, apply)
 
 
 def get_certificate_path(inventory_id: int) -> Optional[str]:
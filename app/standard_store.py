@@ -1,53 +1,61 @@
-import json
-import os
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-STANDARDS_FILE = os.path.join(DATA_DIR, "standards.json")
+from .pagination import Page, paginate, paginate_range
+from .storage import data_path
+from .table import open_table
 
+STANDARDS_FILE = data_path("standards.json")
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(STANDARDS_FILE):
-		with open(STANDARDS_FILE, "w", encoding="utf-8") as f:
-			json.dump({"next_id": 1, "standards": []}, f, ensure_ascii=False, indent=2)
+def _closing_date(record: Dict[str, Any]) -> str:
+	return record.get("closing_date") or ""
 
 
-def _read() -> Dict[str, Any]:
-	_ensure_store()
-	with open(STANDARDS_FILE, "r", encoding="utf-8") as f:
-		return json.load(f)
-
-
-def _write(data: Dict[str, Any]) -> None:
-	with open(STANDARDS_FILE, "w", encoding="utf-8") as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+_standards = open_table(
+	STANDARDS_FILE,
+	"standards",
+	seed={"next_id": 1, "standards": []},
+	indexes={
+		"standard_name": lambda s: s.get("standard_name"),
+		"standard_type": lambda s: (s.get("standard_type") or "").lower(),
+		# Types as written, for the filter dropdown (Table.distinct)
+		"standard_types": lambda s: s.get("standard_type") or None,
+		# Sorted by date for range queries (Table.between)
+		"closing_date": _closing_date,
+	},
+)
 
 
 def list_standards() -> List[Dict[str, Any]]:
 	"""Get all standards"""
-	return _read().get("standards", [])
+	return _standards.rows()
 
 
-def list_standards_paginated(page: int = 1, per_page: int = 20, standard_type: Optional[str] = None) -> tuple[List[Dict[str, Any]], int, int]:
-	"""Get paginated standards with optional type filter. Returns (standards, total_pages, total_count)"""
-	all_standards = _read().get("standards", [])
-	
-	# Filter by standard type if specified
+def list_standard_types() -> List[str]:
+	"""The standard types of the closed standards, sorted, each once (from the index, without a scan)"""
+	return [standard_type for standard_type in _standards.distinct("standard_types") if standard_type]
+
+
+def list_standards_between(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+	"""Standards closed between two dates (YYYY-MM-DD, inclusive, None for no bound), in date order"""
+	return _standards.between("closing_date", date_from or None, date_to or None)
+
+
+def list_standards_paginated(page: int = 1, per_page: int = 20, standard_type: Optional[str] = None, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Page:
+	"""Get paginated standards with optional type filter. Returns (standards, total_pages, total_count, cursors)
+
+	With an after/before cursor token the page is found by key at the same cost
+	at any depth; with_total=False skips counting (see pagination.paginate).
+	date_from/date_to (YYYY-MM-DD, inclusive) keep the standards closed on those
+	days, found by binary search on the closing date index, in date order.
+	"""
+	if date_from or date_to:
+		where = (lambda r: (r.get("standard_type") or "").lower() == standard_type.lower()) if standard_type else None
+		return paginate_range(_standards, "closing_date", _closing_date, date_from or None, date_to or None, page, per_page, after, before, where)
+	# Filter by standard type if specified; the table cuts the page itself
 	if standard_type:
-		all_standards = [s for s in all_standards if s.get("standard_type", "").lower() == standard_type.lower()]
-	
-	total_count = len(all_standards)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	# Calculate offset
-	offset = (page - 1) * per_page
-	
-	# Get standards for current page
-	standards = all_standards[offset:offset + per_page]
-	
-	return standards, total_pages, total_count
+		return paginate(_standards, page, per_page, after, before, "standard_type", standard_type.lower(), with_total)
+	return paginate(_standards, page, per_page, after, before, with_total=with_total)
 
 
 def create_standard(
@@ -58,15 +66,11 @@ def create_standard(
 	note: str = ""
 ) -> int:
 	"""Create a new standard record"""
-	data = _read()
-	standard_id = data["next_id"]
-	
 	# Calculate corrected weight (weight - moisture weight)
 	moisture_weight = weight * (moisture / 100) if moisture > 0 else 0
 	corrected_weight = weight - moisture_weight
 	
 	standard = {
-		"id": standard_id,
 		"standard_name": standard_name,
 		"box_name": box_name,
 		"weight": weight,
@@ -77,20 +81,17 @@ def create_standard(
 		"created_at": datetime.now().isoformat()
 	}
 	
-	data["standards"].append(standard)
-	data["next_id"] += 1
-	_write(data)
-	
-	return standard_id
+	return _standards.insert(standard)
 
 
 def get_standard(standard_id: int) -> Optional[Dict[str, Any]]:
 	"""Get a specific standard by ID"""
-	standards = list_standards()
-	for standard in standards:
-		if standard["id"] == standard_id:
-			return standard
-	return None
+	return _standards.get(standard_id)
+
+
+def list_standards_by_name(standard_name: str) -> List[Dict[str, Any]]:
+	"""Get all closed standards taken from one reference material (index lookup)"""
+	return _standards.find("standard_name", standard_name)
 
 
 def update_standard(
@@ -102,39 +103,32 @@ def update_standard(
 	note: str = ""
 ) -> bool:
 	"""Update an existing standard"""
-	data = _read()
-	for standard in data["standards"]:
-		if standard["id"] == standard_id:
-			# Calculate corrected weight
-			moisture_weight = weight * (moisture / 100) if moisture > 0 else 0
-			corrected_weight = weight - moisture_weight
-			
-			standard["standard_name"] = standard_name
-			standard["box_name"] = box_name
-			standard["weight"] = weight
-			standard["moisture"] = moisture
-			standard["corrected_weight"] = corrected_weight
-			standard["note"] = note
-			
-			_write(data)
-			return True
-	return False
+	# Calculate corrected weight
+	moisture_weight = weight * (moisture / 100) if moisture > 0 else 0
+	corrected_weight = weight - moisture_weight
+	
+	return _standards.update(standard_id, {
+		"standard_name": standard_name,
+		"box_name": box_name,
+		"weight": weight,
+		"moisture": moisture,
+		"corrected_weight": corrected_weight,
+		"note": note,
+	})
 
 
 def delete_standard(standard_id: int) -> bool:
 	"""Delete a standard"""
-	data = _read()
-	data["standards"] = [s for s in data["standards"] if s["id"] != standard_id]
-	_write(data)
+	_standards.delete(standard_id)
 	return True
 
 
-def export_standards_to_excel() -> str:
-	"""Export standards to Excel format"""
+def export_standards_to_excel(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export standards (optionally only those closed between two dates) to Excel format"""
 	import io
 	import pandas as pd
 	
-	standards = list_standards()
+	standards = list_standards_between(date_from, date_to) if date_from or date_to else list_standards()
 	
 	# Create DataFrame
 	df = pd.DataFrame(standards)
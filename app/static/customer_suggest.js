@@ -0,0 +1,40 @@
+// Fill a customer <select> with the matches of the search box above it instead of every customer
+document.addEventListener('DOMContentLoaded', function() {
+	document.querySelectorAll('input[data-customer-suggest]').forEach(function(input) {
+		const select = document.querySelector(input.dataset.customerSuggest);
+		// The first option is the placeholder; the options after it are the current selection, if any
+		const placeholder = select.options[0];
+		let latest = 0;
+
+		function load() {
+			const params = new URLSearchParams({q: input.value.trim()});
+			const request = ++latest;
+			fetch(input.dataset.suggestUrl + '?' + params.toString())
+				.then(function(response) { return response.ok ? response.json() : []; })
+				.then(function(customers) {
+					if (request !== latest) {
+						return;
+					}
+					const selected = select.selectedIndex > 0 ? select.options[select.selectedIndex] : null;
+					select.replaceChildren(placeholder);
+					if (selected && !customers.some(function(c) { return String(c.id) === selected.value; })) {
+						select.appendChild(selected);
+					}
+					customers.forEach(function(customer) {
+						const option = document.createElement('option');
+						option.value = customer.id;
+						option.textContent = customer.name;
+						select.appendChild(option);
+					});
+					select.value = selected ? selected.value : '';
+				})
+				.catch(function() {});
+		}
+
+		input.addEventListener('input', function() {
+			clearTimeout(input.timer);
+			input.timer = setTimeout(load, 200);
+		});
+		load();
+	});
+});
@@ -0,0 +1,54 @@
+// Check the sample name and code against the customer's samples while the operator types
+document.addEventListener('DOMContentLoaded', function() {
+	document.querySelectorAll('form[data-check-url]').forEach(function(form) {
+		const customerSelect = form.querySelector('[name="customer_id"]');
+		const fields = ['sample_name', 'sample_code'].map(function(name) {
+			const input = form.querySelector('[name="' + name + '"]');
+			const feedback = document.createElement('div');
+			feedback.className = 'invalid-feedback';
+			input.insertAdjacentElement('afterend', feedback);
+			// Likely duplicates only warn: the form can still be submitted
+			const warning = document.createElement('div');
+			warning.className = 'form-text text-warning';
+			feedback.insertAdjacentElement('afterend', warning);
+			return {name: name, input: input, feedback: feedback, warning: warning, latest: 0};
+		});
+
+		function check(field) {
+			const value = field.input.value.trim();
+			if (!customerSelect.value || !value) {
+				field.latest++;
+				field.input.classList.remove('is-invalid');
+				field.warning.textContent = '';
+				return;
+			}
+			const params = new URLSearchParams({customer_id: customerSelect.value});
+			params.set(field.name, value);
+			if (form.dataset.excludeId) {
+				params.set('exclude_id', form.dataset.excludeId);
+			}
+			const request = ++field.latest;
+			fetch(form.dataset.checkUrl + '?' + params.toString())
+				.then(function(response) { return response.ok ? response.json() : null; })
+				.then(function(result) {
+					if (!result || request !== field.latest) {
+						return;
+					}
+					field.feedback.textContent = result.message || '';
+					field.input.classList.toggle('is-invalid', !result.available);
+					field.warning.textContent = result.warning || '';
+				})
+				.catch(function() {});
+		}
+
+		fields.forEach(function(field) {
+			field.input.addEventListener('input', function() {
+				clearTimeout(field.timer);
+				field.timer = setTimeout(function() { check(field); }, 250);
+			});
+		});
+		customerSelect.addEventListener('change', function() {
+			fields.forEach(check);
+		});
+	});
+});
@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+from . import serializer
+
+try:
+	import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker there
+	fcntl = None
+
+# Parsed snapshot of every JSON data file, keyed by absolute path.
+# Each entry is (signature, frozen_data); the signature is the cheap
+# os.stat() fingerprint used to notice writes made by other processes.
+_snapshots: Dict[str, Tuple[Tuple[int, int, int], Any]] = {}
+_stats = {"hits": 0, "misses": 0, "writes": 0}
+_lock = threading.Lock()
+
+# Data files whose cross-process lock the current thread already holds
+_held = threading.local()
+
+# Directory of the data files; NAA_DATA_DIR moves it elsewhere, e.g. a temporary one for the tests
+DATA_DIR = os.environ.get("NAA_DATA_DIR") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# When writes reach the disk: "always" (fsync every write), "batched" (at most
+# one fsync per file every NAA_FSYNC_INTERVAL_MS, a crash may lose the writes
+# since) or "none" (leave it to the OS)
+DURABILITY = os.environ.get("NAA_DURABILITY", "always").strip().lower()
+FSYNC_INTERVAL = int(os.environ.get("NAA_FSYNC_INTERVAL_MS", 1000)) / 1000
+if DURABILITY not in ("always", "batched", "none"):
+	raise ValueError(f"Unknown durability mode: {DURABILITY}")
+
+# Time of the last fsync per file, for the batched mode
+_last_fsync: Dict[str, float] = {}
+
+
+def data_path(name: str) -> str:
+	"""Path of a data file in DATA_DIR"""
+	return os.path.join(DATA_DIR, name)
+
+
+def _readonly(self, *args: Any, **kwargs: Any) -> None:
+	raise TypeError("Cached store data is read-only; use storage.thaw() for a mutable copy")
+
+
+class FrozenDict(dict):
+	"""Read-only dict handed out by the snapshot cache"""
+	__slots__ = ()
+
+	__setitem__ = _readonly
+	__delitem__ = _readonly
+	__ior__ = _readonly
+	clear = _readonly
+	pop = _readonly
+	popitem = _readonly
+	setdefault = _readonly
+	update = _readonly
+
+	def copy(self) -> Dict[str, Any]:
+		return dict(self)
+
+
+class FrozenList(list):
+	"""Read-only list handed out by the snapshot cache"""
+	__slots__ = ()
+
+	__setitem__ = _readonly
+	__delitem__ = _readonly
+	__iadd__ = _readonly
+	__imul__ = _readonly
+	append = _readonly
+	extend = _readonly
+	insert = _readonly
+	remove = _readonly
+	pop = _readonly
+	clear = _readonly
+	sort = _readonly
+	reverse = _readonly
+
+	def copy(self) -> list:
+		return list(self)
+
+
+def freeze(value: Any) -> Any:
+	"""Return a read-only deep copy of parsed JSON data (already frozen parts are shared, not copied)"""
+	if isinstance(value, (FrozenDict, FrozenList)):
+		return value
+	if isinstance(value, dict):
+		return FrozenDict((k, freeze(v)) for k, v in value.items())
+	if isinstance(value, list):
+		return FrozenList(freeze(v) for v in value)
+	return value
+
+
+def thaw(value: Any) -> Any:
+	"""Return a plain, mutable deep copy of (possibly frozen) JSON data"""
+	if isinstance(value, dict):
+		return {k: thaw(v) for k, v in value.items()}
+	if isinstance(value, list):
+		return [thaw(v) for v in value]
+	return value
+
+
+def _signature(path: str) -> Tuple[int, int, int]:
+	st = os.stat(path)
+	return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def read_snapshot(path: str) -> Any:
+	"""Return the cached read-only snapshot of a JSON file, re-parsing it only when it changed on disk"""
+	path = os.path.abspath(path)
+	signature = _signature(path)
+	with _lock:
+		cached = _snapshots.get(path)
+		if cached is not None and cached[0] == signature:
+			_stats["hits"] += 1
+			return cached[1]
+		_stats["misses"] += 1
+
+	with open(path, "rb") as f:
+		data = freeze(serializer.loads(f.read()))
+
+	with _lock:
+		_snapshots[path] = (signature, data)
+	return data
+
+
+def read_for_update(path: str) -> Any:
+	"""Return a mutable copy of a JSON file for read-modify-write cycles"""
+	return thaw(read_snapshot(path))
+
+
+def _fsync_dir(directory: str) -> None:
+	if not hasattr(os, "O_DIRECTORY"):
+		return
+	fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+def fsync_due(path: str) -> bool:
+	"""Whether a write to `path` should be fsynced now under the durability mode"""
+	if DURABILITY == "always":
+		return True
+	if DURABILITY == "none":
+		return False
+	path = os.path.abspath(path)
+	now = time.monotonic()
+	with _lock:
+		if now - _last_fsync.get(path, float("-inf")) < FSYNC_INTERVAL:
+			return False
+		_last_fsync[path] = now
+	return True
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[None]:
+	"""Hold an exclusive lock on a data file across processes (gunicorn workers).
+
+	Wrap whole read-modify-write cycles in it. Re-entrant within a thread.
+	With blocking=False, raises BlockingIOError instead of waiting for it.
+	"""
+	path = os.path.abspath(path)
+	held = _held.__dict__.setdefault("paths", set())
+	if fcntl is None or path in held:
+		yield
+		return
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o666)
+	try:
+		fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+		held.add(path)
+		try:
+			yield
+		finally:
+			held.discard(path)
+			fcntl.flock(fd, fcntl.LOCK_UN)
+	finally:
+		os.close(fd)
+
+
+def write_bytes(path: str, content: bytes) -> None:
+	"""Atomically replace a file with `content`.
+
+	The data goes to a temporary file in the same directory, is fsynced and
+	then renamed over the target, so a crash leaves either the old or the new
+	file, never a truncated one. With DURABILITY "batched" or "none" the
+	fsyncs are skipped when not due: the rename stays atomic for readers, but
+	a crash may bring back an older version of the file.
+	"""
+	path = os.path.abspath(path)
+	durable = fsync_due(path)
+	directory = os.path.dirname(path)
+	os.makedirs(directory, exist_ok=True)
+	tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+	fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(content)
+			f.flush()
+			if durable:
+				os.fsync(f.fileno())
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	if durable:
+		_fsync_dir(directory)
+
+
+def write_json(path: str, data: Any) -> Any:
+	"""Atomically replace a JSON file (see write_bytes), refresh its cached snapshot and return that snapshot"""
+	path = os.path.abspath(path)
+	write_bytes(path, serializer.dumps(data, pretty=serializer.PRETTY))
+
+	frozen = freeze(data)
+	signature = _signature(path)
+	with _lock:
+		_snapshots[path] = (signature, frozen)
+		_stats["writes"] += 1
+	return frozen
+
+
+def invalidate(path: str = None) -> None:
+	"""Drop one cached snapshot, or all of them"""
+	with _lock:
+		if path is None:
+			_snapshots.clear()
+		else:
+			_snapshots.pop(os.path.abspath(path), None)
+
+
+def cache_stats() -> Dict[str, Any]:
+	"""Return hit/miss counters of the snapshot cache"""
+	with _lock:
+		stats = dict(_stats)
+		stats["files"] = len(_snapshots)
+	lookups = stats["hits"] + stats["misses"]
+	stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+	return stats
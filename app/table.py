@@ -0,0 +1,911 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from . import serializer, storage
+
+if TYPE_CHECKING:
+	from .sharded_table import ShardedTable
+	from .sqlite_backend import SqliteTable
+
+Record = Dict[str, Any]
+
+# "json" (data/*.json files), "journal" (data/*.json plus an append-only
+# log per file) or "sqlite" (one database, see sqlite_backend)
+STORAGE_BACKEND = os.environ.get("NAA_STORAGE_BACKEND", "json").strip().lower()
+
+# Journal size at which it is folded back into the data file
+JOURNAL_COMPACT_BYTES = int(os.environ.get("NAA_JOURNAL_COMPACT_BYTES", 1024 * 1024))
+
+# Group commit window: writes arriving within it are flushed together (0 = off)
+GROUP_COMMIT_MS = float(os.environ.get("NAA_GROUP_COMMIT_MS", 0))
+
+# Data file field recording the last journal entry folded into it
+JOURNAL_SEQ_FIELD = "journal_seq"
+
+# Per-record counter of versioned tables, bumped by every update
+VERSION_FIELD = "version"
+
+
+class VersionConflictError(ValueError):
+	"""The record was changed by someone else since the caller read it"""
+
+	def __init__(self, pk: Any, expected: int, actual: int) -> None:
+		super().__init__(
+			f"Bản ghi đã được người khác cập nhật (phiên bản {actual}, bạn đang sửa phiên bản {expected}). "
+			"Vui lòng tải lại và thử lại."
+		)
+		self.pk = pk
+		self.expected = expected
+		self.actual = actual
+
+
+def check_version(pk: Any, record: Record, expected_version: Optional[int]) -> None:
+	"""Raise VersionConflictError unless the record is still at expected_version (None skips the check)"""
+	actual = record.get(VERSION_FIELD, 0)
+	if expected_version is not None and actual != expected_version:
+		raise VersionConflictError(pk, expected_version, actual)
+
+
+def keyset_bounds(keys: Sequence[Any], limit: int, after: Any = None, before: Any = None) -> Tuple[int, int, bool]:
+	"""Slice [start, end) of the sorted `keys` holding a keyset page, and whether more keys lie beyond it.
+
+	The page follows `after` or precedes `before` (neither: the first page);
+	the cursor key itself need not be present any more.
+	"""
+	if after is not None:
+		start = bisect.bisect_right(keys, after)
+		end = min(start + limit, len(keys))
+		return start, end, end < len(keys)
+	if before is not None:
+		end = bisect.bisect_left(keys, before)
+		start = max(end - limit, 0)
+		return start, end, start > 0
+	end = min(limit, len(keys))
+	return 0, end, end < len(keys)
+
+
+# (path, collection, options) of every table opened by the stores
+_registry: List[Tuple[str, str, Record]] = []
+
+
+class Index:
+	"""Hash index mapping key(record) to the primary keys of the matching records.
+
+	Buckets keep the records in file order, so filtered lists come back in the
+	same order a full scan would produce.
+	"""
+
+	def __init__(self, key: Callable[[Record], Any]) -> None:
+		self.key = key
+		self._buckets: Dict[Any, List[tuple]] = {}
+
+	def clear(self) -> None:
+		self._buckets = {}
+
+	def add(self, seq: int, pk: Any, record: Record) -> None:
+		self._file(self.key(record), seq, pk)
+
+	def remove(self, seq: int, pk: Any, record: Record) -> None:
+		self._unfile(self.key(record), seq)
+
+	def _file(self, key: Any, seq: int, pk: Any) -> None:
+		bucket = self._buckets.setdefault(key, [])
+		if not bucket or bucket[-1][0] < seq:
+			bucket.append((seq, pk))
+		else:
+			bucket.insert(bisect.bisect_left(bucket, (seq,)), (seq, pk))
+
+	def _unfile(self, key: Any, seq: int) -> None:
+		bucket = self._buckets.get(key)
+		if not bucket:
+			return
+		i = bisect.bisect_left(bucket, (seq,))
+		if i < len(bucket) and bucket[i][0] == seq:
+			del bucket[i]
+		if not bucket:
+			del self._buckets[key]
+
+	def lookup(self, key: Any) -> List[Any]:
+		return [pk for _, pk in self._buckets.get(key, ())]
+
+	def count(self, key: Any) -> int:
+		return len(self._buckets.get(key, ()))
+
+	def keys(self) -> List[Any]:
+		"""The distinct keys, sorted"""
+		return sorted(self._buckets, key=order_key)
+
+	def ordered(self, pks: Optional[Iterable[Any]] = None) -> List[Any]:
+		"""Primary keys sorted by their key here, then by primary key (only those in `pks` if given)"""
+		wanted = set(pks) if pks is not None else None
+		ordered: List[Any] = []
+		for key in self.keys():
+			ordered.extend(sorted(pk for _, pk in self._buckets[key] if wanted is None or pk in wanted))
+		return ordered
+
+
+class TokenIndex(Index):
+	"""Inverted index: key(record) returns several keys (e.g. the trigrams of a
+	name) and the record is filed under each of them.
+	"""
+
+	def add(self, seq: int, pk: Any, record: Record) -> None:
+		for token in set(self.key(record)):
+			self._file(token, seq, pk)
+
+	def remove(self, seq: int, pk: Any, record: Record) -> None:
+		for token in set(self.key(record)):
+			self._unfile(token, seq)
+
+	def overlap(self, tokens: Iterable[Any]) -> Dict[Any, int]:
+		"""How many of `tokens` each record is filed under, for the records under any; only their buckets are read"""
+		counts: Dict[Any, int] = {}
+		for token in set(tokens):
+			for _, pk in self._buckets.get(token, ()):
+				counts[pk] = counts.get(pk, 0) + 1
+		return counts
+
+
+def order_key(value: Any) -> Tuple[bool, Any]:
+	"""Sort key for index values: None first, like NULL in SQLite"""
+	return (value is not None, value)
+
+
+def key_range(keys: Sequence[Tuple[bool, Any]], low: Any = None, high: Any = None) -> Tuple[int, int]:
+	"""Slice of sorted order_key()s between low and high (inclusive, None for no bound)"""
+	start = bisect.bisect_left(keys, order_key(low)) if low is not None else 0
+	end = bisect.bisect_right(keys, order_key(high)) if high is not None else len(keys)
+	return start, max(start, end)
+
+
+class _Batch:
+	"""Mutations flushed together, holding the data file's lock until they are"""
+
+	def __init__(self, path: str, blocking: bool = True) -> None:
+		self.done = threading.Event()
+		self.error: Optional[BaseException] = None
+		self.owner: Optional["UnitOfWork"] = None  # write step holding it, which may drop it
+		self._stack = ExitStack()
+		self._stack.enter_context(storage.file_lock(path, blocking))
+
+	def release(self) -> None:
+		try:
+			self._stack.close()
+		finally:
+			self.done.set()
+
+
+# Unit of work of the request running on each thread
+_units = threading.local()
+
+
+def current_unit() -> Optional["UnitOfWork"]:
+	return getattr(_units, "unit", None)
+
+
+class UnitOfWork:
+	"""The reads and writes of one request (see create_app).
+
+	While it is open on a thread, each table is read from disk at most once:
+	later reads reuse what the first one loaded. Writes are flushed by the
+	call making them, as outside a unit, so no lock outlives a store call.
+
+	Inside a write step (see write_step) the first write to a table makes the
+	unit leader of that table's batch and holds its file lock. Further writes
+	of the step are applied in memory; other threads wait for the step rather
+	than build on writes it may drop. commit() then flushes every touched
+	table once, discard() drops them. Backends with their own transactions
+	(see sqlite_backend) enlist an end callback that commits or rolls back.
+
+	The unit never waits for a table's lock while holding another one. If a
+	lock is busy, it commits what it has first, so two steps writing the
+	same tables in a different order cannot deadlock.
+	"""
+
+	def __init__(self) -> None:
+		self.synced: Dict["Table", Any] = {}  # table -> state token of its last read
+		self.steps = 0  # write steps open
+		self._led: List[Tuple["Table", _Batch]] = []
+		self._joined: List[_Batch] = []  # other threads' batches our writes went into
+		self._errors: List[Optional[BaseException]] = []
+		self._ends: List[Callable[[bool], None]] = []  # see enlist
+
+	def begin(self) -> "UnitOfWork":
+		_units.unit = self
+		return self
+
+	def _lead(self, table: "Table", batch: _Batch) -> None:
+		self._led.append((table, batch))
+
+	def _join(self, batch: _Batch) -> None:
+		if batch not in self._joined and all(batch is not led for _, led in self._led):
+			self._joined.append(batch)
+
+	def enlist(self, end: Callable[[bool], None]) -> None:
+		"""Call end(True) when the step commits, end(False) when it is dropped"""
+		self._ends.append(end)
+
+	def _end(self, ok: bool) -> None:
+		ends, self._ends = self._ends, []
+		for end in ends:
+			end(ok)
+
+	def commit(self) -> None:
+		"""Flush the tables written so far and wait for the batches joined; raise the first write error"""
+		self._flush_led()
+		joined, self._joined = self._joined, []
+		errors, self._errors = self._errors, []
+		for batch in joined:
+			batch.done.wait()
+			errors.append(batch.error)
+		self._end(all(error is None for error in errors))
+		for error in errors:
+			if error is not None:
+				raise error
+
+	def _flush_led(self) -> None:
+		led, self._led = self._led, []
+		for table, batch in led:
+			with table._lock:
+				table._batch = None
+				table._finish(batch)
+			self._errors.append(batch.error)
+
+	def discard(self) -> None:
+		"""Drop the unflushed writes of the tables the unit leads; the next reads start over from the disk.
+
+		Writes that went into another thread's group commit are flushed with it.
+		"""
+		led, self._led = self._led, []
+		self._joined, self._errors = [], []
+		for table, batch in led:
+			with table._lock:
+				table._batch = None
+				table._discard()
+				batch.release()
+		self._end(False)
+
+	def close(self, discard: bool = False) -> None:
+		"""Commit (or with discard=True drop) what is left and detach the unit from this thread"""
+		try:
+			if discard:
+				self.discard()
+			else:
+				self.commit()
+		finally:
+			if current_unit() is self:
+				_units.unit = None
+
+
+@contextmanager
+def write_step() -> Iterator[None]:
+	"""Hold the writes made in the block and flush them together when it ends, or drop
+	them if it raises. Nested steps join the outermost one. Usable as a decorator.
+
+	Keep steps inside the stores: the file locks (or the SQLite write transaction)
+	are held until the step ends.
+	"""
+	unit = current_unit()
+	own = unit is None
+	if own:
+		unit = UnitOfWork().begin()
+	unit.steps += 1
+	ok = False
+	try:
+		yield
+		ok = True
+	finally:
+		unit.steps -= 1
+		try:
+			if not unit.steps:
+				if ok:
+					unit.commit()
+				else:
+					unit.discard()
+		finally:
+			if own:
+				unit.close(discard=True)
+
+
+class Table:
+	"""One collection of records inside a JSON data file, with declared indexes.
+
+	Reads are served from the shared snapshot cache; the primary key map and the
+	secondary indexes are built once per snapshot and kept up to date by
+	insert/update/delete instead of being rebuilt on every write.
+
+	With journal=True a mutation appends one compact line to `<file>.log`
+	instead of rewriting the data file. Reads replay the log on top of the
+	data file, and once the log passes JOURNAL_COMPACT_BYTES it is folded back
+	into the data file by a background thread.
+
+	With versioned=True records carry a `version` counter (1 on insert, +1 on
+	every update) and update() can refuse stale edits via expected_version.
+
+	Writes from several threads are coalesced when GROUP_COMMIT_MS is set, see
+	_mutate().
+	"""
+
+	def __init__(
+		self,
+		path: str,
+		collection: str,
+		seed: Union[Record, Callable[[], Record], None] = None,
+		primary_key: str = "id",
+		indexes: Optional[Dict[str, Union[Index, Callable[[Record], Any]]]] = None,
+		stamp_field: Optional[str] = None,
+		journal: bool = False,
+		versioned: bool = False,
+	) -> None:
+		self.path = path
+		self.collection = collection
+		self.seed = seed if seed is not None else {collection: []}
+		self.primary_key = primary_key
+		# An Index given as spec is copied: the same spec can serve several tables (shards)
+		self.indexes: Dict[str, Index] = {
+			name: type(spec)(spec.key) if isinstance(spec, Index) else Index(spec)
+			for name, spec in (indexes or {}).items()
+		}
+		self.stamp_field = stamp_field
+		self.journal = journal
+		self.versioned = versioned
+		self.log_path = path + ".log"
+		self._lock = threading.RLock()
+		self._base: Optional[Record] = None  # snapshot of the data file
+		self._doc: Optional[Record] = None  # the data file plus the replayed log
+		self._by_pk: Dict[Any, Record] = {}
+		self._seq: Dict[Any, int] = {}
+		self._counter = itertools.count()
+		self._log_pos = 0
+		self._log_seq = 0
+		self._log_ino: Optional[int] = None
+		self._compacting = False
+		self._batch: Optional[_Batch] = None  # open group commit
+		self._pending: List[bytes] = []  # journal lines not flushed yet
+		self._dirty = False
+		self._sorted: Tuple[Optional[Record], Dict[tuple, List[Any]]] = (None, {})  # (document, sorted keys)
+		self._memos: Dict[str, Tuple[Any, Any]] = {}  # name -> (rows it was computed from, value)
+
+	# Index maintenance
+
+	def _ensure_store(self) -> None:
+		if not os.path.exists(self.path):
+			with storage.file_lock(self.path):
+				if not os.path.exists(self.path):
+					storage.write_json(self.path, self.seed() if callable(self.seed) else self.seed)
+
+	def _sync(self, force: bool = False) -> Record:
+		"""Return the current document, once per unit of work unless forced"""
+		unit = current_unit()
+		if unit is not None and not force:
+			token = unit.synced.get(self)
+			if token is not None and token is self._token():
+				return self._doc
+		doc = self._refresh()
+		if unit is not None:
+			unit.synced[self] = self._token()
+		return doc
+
+	def _token(self) -> Any:
+		"""Changes whenever the in-memory state is reloaded or dropped"""
+		return self._base
+
+	def _refresh(self) -> Record:
+		"""Rebuild the indexes if the file changed underneath us"""
+		self._ensure_store()
+		base = storage.read_snapshot(self.path)
+		if base is not self._base:
+			self._rebuild(base)
+		if self.journal:
+			self._replay()
+		return self._doc
+
+	def _rebuild(self, doc: Record) -> None:
+		self._base = doc
+		self._log_pos = 0
+		self._log_seq = doc.get(JOURNAL_SEQ_FIELD, 0)
+		self._log_ino = None
+		self._reindex(doc)
+
+	def _reindex(self, doc: Record) -> None:
+		self._doc = doc
+		self._by_pk = {}
+		self._seq = {}
+		self._counter = itertools.count()
+		for index in self.indexes.values():
+			index.clear()
+		for record in doc.get(self.collection, []):
+			# First match wins, like the linear scans this replaces
+			if record.get(self.primary_key) not in self._by_pk:
+				self._add(record)
+
+	def _add(self, record: Record, seq: Optional[int] = None) -> None:
+		pk = record.get(self.primary_key)
+		if seq is None:
+			seq = next(self._counter)
+		self._by_pk[pk] = record
+		self._seq[pk] = seq
+		for index in self.indexes.values():
+			index.add(seq, pk, record)
+
+	def _remove(self, pk: Any) -> int:
+		record = self._by_pk.pop(pk)
+		seq = self._seq.pop(pk)
+		for index in self.indexes.values():
+			index.remove(seq, pk, record)
+		return seq
+
+	def _materialize(self, rows: List[Record], meta: Optional[Record]) -> None:
+		doc = dict(self._doc)
+		doc[self.collection] = storage.FrozenList(rows)
+		if meta:
+			doc.update(meta)
+		self._doc = storage.freeze(doc)
+
+	def _apply(self, entry: Record) -> None:
+		"""Apply one mutation (a journal entry) to the in-memory document and indexes"""
+		op = entry["op"]
+		rows = self._doc.get(self.collection, [])
+		if op == "insert":
+			records = [storage.freeze(r) for r in entry["records"]]
+			self._materialize(list(rows) + records, entry.get("meta"))
+			for record in records:
+				self._add(record)
+		elif op == "update":
+			old = self._by_pk.get(entry["pk"])
+			if old is None:
+				return
+			new = storage.freeze(entry["record"])
+			self._materialize([new if r is old else r for r in rows], entry.get("meta"))
+			seq = self._remove(entry["pk"])
+			self._add(new, seq)
+		elif op == "delete":
+			pk = entry["pk"]
+			self._materialize([r for r in rows if r.get(self.primary_key) != pk], entry.get("meta"))
+			if pk in self._by_pk:
+				self._remove(pk)
+
+	def _meta(self, meta: Optional[Record] = None) -> Record:
+		meta = dict(meta or {})
+		if self.stamp_field:
+			meta[self.stamp_field] = datetime.now().isoformat()
+		return meta
+
+	def _write(self, entry: Record) -> None:
+		"""Apply one mutation in memory and queue it for the next flush"""
+		if self.journal:
+			entry = {"n": self._log_seq + 1, **{k: v for k, v in entry.items() if v or k != "meta"}}
+			self._pending.append(serializer.dumps(entry) + b"\n")
+			self._apply(entry)
+			self._log_seq = entry["n"]
+		else:
+			self._apply(entry)
+		self._dirty = True
+
+	def _flush(self) -> None:
+		"""Persist the queued mutations: append them to the journal, or rewrite the data file"""
+		if not self._dirty:
+			return
+		if self.journal:
+			self._append(self._pending)
+		else:
+			self._base = self._doc = storage.write_json(self.path, self._doc)
+		self._pending = []
+		self._dirty = False
+
+	def _mutate(self, mutation: Callable[[], Any]) -> Any:
+		"""Run a read-check-write mutation under the thread and file locks and return its result.
+
+		The caller is only answered once the mutation is on disk. With group
+		commit (GROUP_COMMIT_MS) the first writer of a window becomes the leader:
+		it keeps the file lock for the window, the writers arriving meanwhile
+		apply their mutations in memory, and one flush persists all of them.
+		Inside a write step the window lasts until the step ends, and write
+		errors are raised when it commits instead.
+		"""
+		unit = current_unit()
+		held = unit if unit is not None and unit.steps else None
+		group = held is None and GROUP_COMMIT_MS > 0
+		error: Optional[BaseException] = None
+		result = None
+		taken: Optional[_Batch] = None  # file lock taken while not holding the thread lock
+		while True:
+			busy: Optional[_Batch] = None
+			with self._lock:
+				batch = self._batch
+				if batch is not None and batch.owner is not None and batch.owner is not held:
+					# Another thread's write step, which may still drop its writes
+					busy = batch
+				else:
+					if batch is None and taken is None:
+						try:
+							taken = _Batch(self.path, blocking=False)
+						except BlockingIOError:
+							pass
+					if batch is not None or taken is not None:
+						leader = batch is None
+						if leader:
+							batch = taken
+							batch.owner = held
+							if group or held is not None:
+								self._batch = batch
+							if held is not None:
+								held._lead(self, batch)
+						elif held is not None:
+							held._join(batch)
+						try:
+							# A new leader has just taken the file lock: catch up with other processes
+							self._sync(force=leader)
+							result = mutation()
+						except BaseException as e:
+							error = e
+						if leader and held is None and not group:
+							self._finish(batch)
+						break
+			# Never wait for a file lock while holding a thread lock (or, in a write
+			# step, other file locks): another process may be waiting the other way round
+			if held is not None:
+				held._flush_led()
+			if busy is not None:
+				busy.done.wait()
+			else:
+				taken = _Batch(self.path)
+		if group and leader:
+			time.sleep(GROUP_COMMIT_MS / 1000)
+			with self._lock:
+				self._batch = None
+				self._finish(batch)
+		if held is None:
+			batch.done.wait()
+		if error is not None:
+			raise error
+		if held is None and batch.error is not None:
+			raise batch.error
+		return result
+
+	def _finish(self, batch: "_Batch") -> None:
+		try:
+			self._flush()
+		except BaseException as e:
+			batch.error = e
+			self._discard()
+		finally:
+			batch.release()
+
+	def _discard(self) -> None:
+		"""Drop the unwritten state; the next read starts over from the disk"""
+		self._pending = []
+		self._dirty = False
+		self._base = None
+
+	def _next_pk(self, doc: Record, rows: Iterable[Record], meta: Record) -> Any:
+		if "next_id" in doc:
+			pk = meta.get("next_id", doc["next_id"])
+			# Skip keys still in use under a counter older than the records
+			while pk in self._by_pk:
+				pk += 1
+			meta["next_id"] = pk + 1
+			return pk
+		return max((r.get(self.primary_key, 0) for r in rows), default=0) + 1
+
+	# Journal
+
+	def _append(self, lines: List[bytes]) -> None:
+		data = b"".join(lines)
+		with open(self.log_path, "ab") as f:
+			if f.tell() != self._log_pos:
+				# Terminate a line left half-written by a crashed writer
+				data = b"\n" + data
+			f.write(data)
+			f.flush()
+			if storage.fsync_due(self.log_path):
+				os.fsync(f.fileno())
+			self._log_pos = f.tell()
+			self._log_ino = os.fstat(f.fileno()).st_ino
+		if self._log_pos >= JOURNAL_COMPACT_BYTES and not self._compacting:
+			self._compacting = True
+			threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+	def _replay(self) -> None:
+		"""Apply the journal lines written since the last read"""
+		try:
+			st = os.stat(self.log_path)
+		except FileNotFoundError:
+			return
+		if self._log_ino is not None and (st.st_ino != self._log_ino or st.st_size < self._log_pos):
+			# The log was folded and restarted by someone else
+			self._rebuild(self._base)
+		if st.st_size == self._log_pos:
+			return
+		with open(self.log_path, "rb") as f:
+			f.seek(self._log_pos)
+			chunk = f.read()
+		# A last line without its newline is still being written
+		end = chunk.rfind(b"\n") + 1
+		for line in chunk[:end].splitlines():
+			try:
+				entry = serializer.loads(line)
+			except ValueError:
+				continue
+			if entry.get("n", 0) <= self._log_seq:
+				continue
+			self._apply(entry)
+			self._log_seq = entry["n"]
+		self._log_pos += end
+		self._log_ino = st.st_ino
+
+	def _compact_in_background(self) -> None:
+		try:
+			self.compact()
+		finally:
+			self._compacting = False
+
+	def _fold(self) -> None:
+		doc = dict(self._doc)
+		doc[JOURNAL_SEQ_FIELD] = self._log_seq
+		self._base = self._doc = storage.write_json(self.path, doc)
+		if os.path.exists(self.log_path):
+			os.remove(self.log_path)
+		self._log_pos = 0
+		self._log_ino = None
+		# Queued lines are part of the folded document now
+		self._pending = []
+		self._dirty = False
+
+	def compact(self) -> None:
+		"""Fold the journal into the data file and start a new, empty log"""
+		def fold() -> None:
+			if self.journal and (self._pending or os.path.exists(self.log_path)):
+				self._fold()
+		self._mutate(fold)
+
+	# Reads
+
+	def document(self) -> Record:
+		"""The whole (read-only) data file"""
+		with self._lock:
+			return self._sync()
+
+	def rows(self) -> List[Record]:
+		"""All records in file order (read-only)"""
+		return self.document().get(self.collection, [])
+
+	def get(self, pk: Any) -> Optional[Record]:
+		with self._lock:
+			self._sync()
+			return self._by_pk.get(pk)
+
+	def find(self, index: str, key: Any) -> List[Record]:
+		"""Records whose indexed key equals `key`, in file order"""
+		with self._lock:
+			self._sync()
+			return [self._by_pk[pk] for pk in self.indexes[index].lookup(key)]
+
+	def count(self, index: str, key: Any) -> int:
+		with self._lock:
+			self._sync()
+			return self.indexes[index].count(key)
+
+	def size(self) -> int:
+		return len(self.rows())
+
+	def page(self, offset: int, limit: int, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], int]:
+		"""One page of records (all, or those whose indexed key equals `key`) and the total count"""
+		offset = max(offset, 0)
+		with self._lock:
+			doc = self._sync()
+			if index is None:
+				records = doc.get(self.collection, [])
+				return records[offset:offset + limit], len(records)
+			pks = self.indexes[index].lookup(key)
+			return [self._by_pk[pk] for pk in pks[offset:offset + limit]], len(pks)
+
+	def seek(self, limit: int, after: Any = None, before: Any = None, index: Optional[str] = None, key: Any = None) -> Tuple[List[Record], bool]:
+		"""Keyset page in primary key order: up to `limit` records with keys above
+		`after` (or below `before`), and whether more lie beyond them.
+
+		Unlike page(), the cost does not grow with the depth of the page.
+		"""
+		with self._lock:
+			self._sync()
+			pks = self._sorted_pks(index, key)
+			start, end, more = keyset_bounds(pks, limit, after, before)
+			return [self._by_pk[pk] for pk in pks[start:end]], more
+
+	def sort(self, order: str, descending: bool = False, index: Optional[str] = None, key: Any = None) -> List[Record]:
+		"""Records (all, or those whose indexed key equals `key`) ordered by their key in
+		index `order`, then by primary key. The order is kept until the next change.
+		"""
+		with self._lock:
+			self._sync()
+			pks = self._cached_order(
+				("sort", order, index, key),
+				lambda: self.indexes[order].ordered(None if index is None else self.indexes[index].lookup(key)),
+			)
+			records = [self._by_pk[pk] for pk in pks]
+		return records[::-1] if descending else records
+
+	def between(self, index: str, low: Any = None, high: Any = None) -> List[Record]:
+		"""Records whose key in `index` lies between low and high (inclusive, None for
+		no bound), in key order. Binary search over the order kept by sort().
+		"""
+		with self._lock:
+			self._sync()
+			pks = self._cached_order(("sort", index, None, None), lambda: self.indexes[index].ordered())
+			keys = self._cached_order(("keys", index), lambda: [order_key(self.indexes[index].key(self._by_pk[pk])) for pk in pks])
+			start, end = key_range(keys, low, high)
+			return [self._by_pk[pk] for pk in pks[start:end]]
+
+	def distinct(self, index: str) -> List[Any]:
+		"""The distinct keys of an index, sorted, e.g. the choices of a filter dropdown.
+
+		The index keeps a bucket per key with its records, updated by every
+		write, and drops the key with its last record: no scan is needed. The
+		sorted list is kept until the next change.
+		"""
+		with self._lock:
+			self._sync()
+			return self._cached_order(("distinct", index), self.indexes[index].keys)
+
+	def memo(self, name: str, compute: Callable[[List[Record]], Any]) -> Any:
+		"""compute(rows), e.g. a lookup map, computed once and again only after the records change"""
+		with self._lock:
+			rows = self.rows()
+			token, value = self._memos.get(name, (None, None))
+			if token is not rows:
+				value = compute(rows)
+				self._memos[name] = (rows, value)
+			return value
+
+	def overlap(self, index: str, tokens: Iterable[Any], at_least: int = 1) -> List[Tuple[Record, int]]:
+		"""Records filed under at least `at_least` of `tokens` in a TokenIndex, with how
+		many, most first (then by primary key). Only the tokens' buckets are read.
+		"""
+		with self._lock:
+			self._sync()
+			counts = self.indexes[index].overlap(tokens)
+			pks = sorted((pk for pk, n in counts.items() if n >= at_least), key=lambda pk: (-counts[pk], pk))
+			return [(self._by_pk[pk], counts[pk]) for pk in pks]
+
+	def _sorted_pks(self, index: Optional[str], key: Any) -> List[Any]:
+		"""Primary keys (of all records, or of one index bucket) in order, kept until the next change"""
+		return self._cached_order(
+			(index, key), lambda: sorted(self._by_pk if index is None else self.indexes[index].lookup(key))
+		)
+
+	def _cached_order(self, name: tuple, compute: Callable[[], List[Any]]) -> List[Any]:
+		doc, cache = self._sorted
+		if doc is not self._doc:
+			cache = {}
+			self._sorted = (self._doc, cache)
+		pks = cache.get(name)
+		if pks is None:
+			pks = cache[name] = compute()
+		return pks
+
+	# Writes
+	#
+	# Every write holds the data file's cross-process lock from the read to the
+	# write (see _mutate), so concurrent workers serialize instead of losing each
+	# other's updates.
+
+	def insert(self, record: Record) -> Any:
+		"""Append a record and return its primary key (taken from next_id or max+1 when missing)"""
+		return self.insert_many([record])[0]
+
+	def insert_many(self, records: Union[Iterable[Record], Callable[[], Iterable[Record]]]) -> List[Any]:
+		"""Append several records with a single write.
+
+		`records` may be a function returning them, called under the write lock
+		so it can validate against the table (its reads see the current data).
+		"""
+		def insert() -> List[Any]:
+			new_rows = records() if callable(records) else records
+			doc = self._doc
+			rows = list(doc.get(self.collection, []))
+			meta: Record = {}
+			new_records = []
+			for record in new_rows:
+				if record.get(self.primary_key) is None:
+					# Keep the primary key as the first field, like the hand-written records
+					record = {self.primary_key: self._next_pk(doc, rows, meta), **record}
+				if self.versioned and VERSION_FIELD not in record:
+					record = {**record, VERSION_FIELD: 1}
+				rows.append(record)
+				new_records.append(record)
+			if not new_records:
+				return []
+			self._write({"op": "insert", "records": new_records, "meta": self._meta(meta)})
+			return [r[self.primary_key] for r in new_records]
+		return self._mutate(insert)
+
+	def update(
+		self,
+		pk: Any,
+		change: Union[Record, Callable[[Record], Optional[bool]]],
+		expected_version: Optional[int] = None,
+	) -> bool:
+		"""Update one record with a dict of fields or a mutator function.
+
+		The mutator receives a mutable copy of the record and may return False
+		to abort without writing. With expected_version set, the update fails
+		fast with VersionConflictError if the record has moved on since.
+		"""
+		def update() -> bool:
+			old = self._by_pk.get(pk)
+			if old is None:
+				return False
+			check_version(pk, old, expected_version)
+			record = storage.thaw(old)
+			if callable(change):
+				if change(record) is False:
+					return False
+			else:
+				record.update(change)
+			if self.versioned:
+				record[VERSION_FIELD] = old.get(VERSION_FIELD, 0) + 1
+			self._write({"op": "update", "pk": pk, "record": record, "meta": self._meta()})
+			return True
+		return self._mutate(update)
+
+	def delete(self, pk: Any) -> bool:
+		def delete() -> bool:
+			if pk not in self._by_pk:
+				return False
+			self._write({"op": "delete", "pk": pk, "meta": self._meta()})
+			return True
+		return self._mutate(delete)
+
+	def replace_all(self, rows: Iterable[Record], **meta: Any) -> None:
+		"""Rewrite the whole collection (and optional document fields) and rebuild the indexes"""
+		def replace() -> None:
+			self._materialize([storage.freeze(r) for r in rows], self._meta(meta))
+			if self.journal:
+				# Nothing in the log matters any more: fold straight into the data file
+				self._fold()
+				self._rebuild(self._doc)
+			else:
+				self._reindex(self._doc)
+				self._dirty = True
+		self._mutate(replace)
+
+
+def open_table(
+	path: str,
+	collection: str,
+	lines: bool = False,
+	journal: bool = False,
+	shard_by: Optional[str] = None,
+	**options: Any,
+) -> Union[Table, "SqliteTable", "ShardedTable"]:
+	"""Open a store's table on the configured backend (NAA_STORAGE_BACKEND=json|journal|sqlite).
+
+	lines=True keeps a large collection as JSON Lines with an offset index
+	(see lines_table) on the json and journal backends. journal=True journals
+	the table on the json backend too, for collections deleted from one
+	record at a time. shard_by splits it into one file per value of that
+	field (see sharded_table) on the json and journal backends.
+	"""
+	_registry.append((path, collection, dict(options, lines=lines, shard_by=shard_by)))
+	if STORAGE_BACKEND == "sqlite":
+		from .sqlite_backend import SqliteTable
+		return SqliteTable(path, collection, **options)
+	if STORAGE_BACKEND not in ("json", "journal"):
+		raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+	if lines:
+		from .lines_table import LinesTable
+		return LinesTable(path, collection, **options)
+	if shard_by:
+		from .sharded_table import ShardedTable
+		return ShardedTable(path, collection, shard_by, journal=journal or STORAGE_BACKEND == "journal", **options)
+	return Table(path, collection, journal=journal or STORAGE_BACKEND == "journal", **options)
+
+
+def registered_tables() -> List[Tuple[str, str, Record]]:
+	return list(_registry)
@@ -1,13 +1,15 @@
-import json
 import os
 import uuid
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
+from .pagination import Page, paginate_sorted
+from .storage import data_path
+from .table import VersionConflictError, open_table
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-TASK_ASSIGNMENTS_FILE = os.path.join(DATA_DIR, "task_assignments.json")
+
+TASK_ASSIGNMENTS_FILE = data_path("task_assignments.json")
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads", "task_files")
 
 # Cấu hình file upload
@@ -22,12 +24,17 @@ ALLOWED_EXTENSIONS = {
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
 
-def _ensure_store() -> None:
-    """Đảm bảo thư mục data và file tồn tại"""
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(TASK_ASSIGNMENTS_FILE):
-        with open(TASK_ASSIGNMENTS_FILE, "w", encoding="utf-8") as f:
-            json.dump({"task_assignments": []}, f, ensure_ascii=False, indent=2)
+_tasks = open_table(
+    TASK_ASSIGNMENTS_FILE,
+    "task_assignments",
+    seed={"task_assignments": []},
+    indexes={
+        "assigned_to": lambda t: t.get("assigned_to"),
+        "assigned_by": lambda t: t.get("assigned_by"),
+    },
+    versioned=True,
+    lines=True,
+)
 
 
 def _ensure_upload_dir() -> None:
@@ -58,26 +65,13 @@ def _get_file_size_mb(size_bytes: int) -> float:
 
 
 def load_task_assignments() -> List[Dict[str, Any]]:
-    """Tải danh sách tất cả công việc được giao"""
-    _ensure_store()
-    with open(TASK_ASSIGNMENTS_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get("task_assignments", [])
+    """Tải danh sách tất cả công việc được giao (chỉ đọc, dùng chung bộ nhớ đệm)"""
+    return _tasks.rows()
 
 
 def save_task_assignments(task_assignments: List[Dict[str, Any]]) -> None:
     """Lưu danh sách công việc được giao"""
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(TASK_ASSIGNMENTS_FILE, "w", encoding="utf-8") as f:
-        json.dump({"task_assignments": task_assignments}, f, ensure_ascii=False, indent=2)
-
-
-def get_next_task_id() -> int:
-    """Lấy ID tiếp theo cho công việc mới"""
-    tasks = load_task_assignments()
-    if not tasks:
-        return 1
-    return max(task.get("id", 0) for task in tasks) + 1
+    _tasks.replace_all(task_assignments)
 
 
 def create_task_assignment(
@@ -92,11 +86,10 @@ def create_task_assignment(
 ) -> bool:
     """Tạo công việc mới được giao"""
     try:
-        task_id = get_next_task_id()
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
+        # ID do bảng cấp (max + 1) trong lúc giữ khóa ghi
         task_assignment = {
-            "id": task_id,
             "title": title.strip(),
             "description": description.strip(),
             "assigned_to": assigned_to,
@@ -111,9 +104,7 @@ def create_task_assignment(
             "handover_history": []  # Lịch sử bàn giao
         }
         
-        tasks = load_task_assignments()
-        tasks.append(task_assignment)
-        save_task_assignments(tasks)
+        _tasks.insert(task_assignment)
         return True
     except Exception as e:
         print(f"Error creating task assignment: {e}")
@@ -122,11 +113,7 @@ def create_task_assignment(
 
 def get_task_assignment(task_id: int) -> Optional[Dict[str, Any]]:
     """Lấy thông tin một công việc theo ID"""
-    tasks = load_task_assignments()
-    for task in tasks:
-        if task.get("id") == task_id:
-            return task
-    return None
+    return _tasks.get(task_id)
 
 
 def update_task_assignment(
@@ -138,34 +125,34 @@ def update_task_assignment(
     status: str = None,
     due_date: str = None,
     category: str = None,
-    note: str = None
+    note: str = None,
+    expected_version: int = None
 ) -> bool:
-    """Cập nhật thông tin công việc"""
+    """Cập nhật thông tin công việc (VersionConflictError nếu expected_version đã cũ)"""
     try:
-        tasks = load_task_assignments()
-        for task in tasks:
-            if task.get("id") == task_id:
-                if title is not None:
-                    task["title"] = title.strip()
-                if description is not None:
-                    task["description"] = description.strip()
-                if assigned_to is not None:
-                    task["assigned_to"] = assigned_to
-                if priority is not None:
-                    task["priority"] = priority
-                if status is not None:
-                    task["status"] = status
-                if due_date is not None:
-                    task["due_date"] = due_date
-                if category is not None:
-                    task["category"] = category
-                if note is not None:
-                    task["note"] = note
-                
-                task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                save_task_assignments(tasks)
-                return True
-        return False
+        def apply(task: Dict[str, Any]) -> None:
+            if title is not None:
+                task["title"] = title.strip()
+            if description is not None:
+                task["description"] = description.strip()
+            if assigned_to is not None:
+                task["assigned_to"] = assigned_to
+            if priority is not None:
+                task["priority"] = priority
+            if status is not None:
+                task["status"] = status
+            if due_date is not None:
+                task["due_date"] = due_date
+            if category is not None:
+                task["category"] = category
+            if note is not None:
+                task["note"] = note
+            
+            task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        return _tasks.update(task_id, apply, expected_version=expected_version)
+    except VersionConflictError:
+        raise
     except Exception as e:
         print(f"Error updating task assignment: {e}")
         return False
@@ -174,12 +161,7 @@ def update_task_assignment(
 def delete_task_assignment(task_id: int) -> bool:
     """Xóa công việc"""
     try:
-        tasks = load_task_assignments()
-        new_tasks = [task for task in tasks if task.get("id") != task_id]
-        if len(new_tasks) == len(tasks):
-            return False
-        save_task_assignments(new_tasks)
-        return True
+        return _tasks.delete(task_id)
     except Exception as e:
         print(f"Error deleting task assignment: {e}")
         return False
@@ -187,14 +169,12 @@ def delete_task_assignment(task_id: int) -> bool:
 
 def get_tasks_by_user(username: str) -> List[Dict[str, Any]]:
     """Lấy danh sách công việc của một người dùng"""
-    tasks = load_task_assignments()
-    return [task for task in tasks if task.get("assigned_to") == username]
+    return _tasks.find("assigned_to", username)
 
 
 def get_tasks_assigned_by_user(username: str) -> List[Dict[str, Any]]:
     """Lấy danh sách công việc được giao bởi một người dùng"""
-    tasks = load_task_assignments()
-    return [task for task in tasks if task.get("assigned_by") == username]
+    return _tasks.find("assigned_by", username)
 
 
 def is_workflow_completed(task: Dict[str, Any]) -> bool:
@@ -213,67 +193,66 @@ def can_handover_task(task: Dict[str, Any]) -> bool:
     return not is_workflow_completed(task)
 
 
-def handover_task(task_id: int, from_user: str, to_user: str, handover_note: str = None) -> bool:
-    """Bàn giao công việc từ người này sang người khác"""
+def handover_task(task_id: int, from_user: str, to_user: str, handover_note: str = None, expected_version: int = None) -> bool:
+    """Bàn giao công việc từ người này sang người khác (VersionConflictError nếu expected_version đã cũ)"""
     try:
-        tasks = load_task_assignments()
-        for task in tasks:
-            if task.get("id") == task_id:
-                # Kiểm tra quyền bàn giao
-                if task.get("assigned_to") != from_user:
-                    return False
-                
-                # Kiểm tra xem công việc có thể bàn giao được không
-                if not can_handover_task(task):
-                    return False
-                
-                # Thêm vào lịch sử bàn giao
-                handover_record = {
-                    "from_user": from_user,
-                    "to_user": to_user,
-                    "handover_note": handover_note,
-                    "handover_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "is_self_handover": from_user == to_user  # Đánh dấu nếu bàn giao cho chính mình
-                }
-                
-                if "handover_history" not in task:
-                    task["handover_history"] = []
-                task["handover_history"].append(handover_record)
-                
-                # Cập nhật người được giao
-                task["assigned_to"] = to_user
-                task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Cập nhật tiêu đề công việc theo công đoạn
-                original_title = task.get("original_title", task.get("title", ""))
-                if not task.get("original_title"):
-                    task["original_title"] = original_title
-                
-                # Đếm số lần bàn giao để xác định công đoạn
-                handover_count = len(task.get("handover_history", []))
-                stage_names = ["Nhận mẫu", "Đóng mẫu", "Chiếu mẫu", "Xử lý số liệu", "Kiểm tra và duyệt kết quả"]
-                
-                if handover_count < len(stage_names):
-                    stage = stage_names[handover_count]
-                    task["title"] = f"{original_title} - Công đoạn {handover_count + 1}: {stage}"
-                else:
-                    task["title"] = f"{original_title} - Công đoạn {handover_count + 1}: Lưu kết quả"
-                
-                # Kiểm tra xem có phải sau giai đoạn cuối không
-                if handover_count > len(stage_names) - 1:
-                    # Đã hoàn thành giai đoạn cuối, đặt trạng thái completed
-                    task["status"] = "completed"
-                    task["completion_note"] = handover_note or "Đã hoàn thành toàn bộ quy trình"
-                    task["completed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    # Nếu công việc đã hoàn thành trước đó, reset về trạng thái pending để người nhận có thể tiếp tục
-                    if task.get("status") == "completed":
-                        task["status"] = "pending"
-                        task["completion_note"] = handover_note or "Đã bàn giao từ người hoàn thành"
-                
-                save_task_assignments(tasks)
-                return True
-        return False
+        def apply(task: Dict[str, Any]) -> bool:
+            # Kiểm tra quyền bàn giao
+            if task.get("assigned_to") != from_user:
+                return False
+            
+            # Kiểm tra xem công việc có thể bàn giao được không
+            if not can_handover_task(task):
+                return False
+            
+            # Thêm vào lịch sử bàn giao
+            handover_record = {
+                "from_user": from_user,
+                "to_user": to_user,
+                "handover_note": handover_note,
+                "handover_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "is_self_handover": from_user == to_user  # Đánh dấu nếu bàn giao cho chính mình
+            }
+            
+            if "handover_history" not in task:
+                task["handover_history"] = []
+            task["handover_history"].append(handover_record)
+            
+            # Cập nhật người được giao
+            task["assigned_to"] = to_user
+            task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            
+            # Cập nhật tiêu đề công việc theo công đoạn
+            original_title = task.get("original_title", task.get("title", ""))
+            if not task.get("original_title"):
+                task["original_title"] = original_title
+            
+            # Đếm số lần bàn giao để xác định công đoạn
+            handover_count = len(task.get("handover_history", []))
+            stage_names = ["Nhận mẫu", "Đóng mẫu", "Chiếu mẫu", "Xử lý số liệu", "Kiểm tra và duyệt kết quả"]
+            
+            if handover_count < len(stage_names):
+                stage = stage_names[handover_count]
+                task["title"] = f"{original_title} - Công đoạn {handover_count + 1}: {stage}"
+            else:
+                task["title"] = f"{original_title} - Công đoạn {handover_count + 1}: Lưu kết quả"
+            
+            # Kiểm tra xem có phải sau giai đoạn cuối không
+            if handover_count > len(stage_names) - 1:
+                # Đã hoàn thành giai đoạn cuối, đặt trạng thái completed
+                task["status"] = "completed"
+                task["completion_note"] = handover_note or "Đã hoàn thành toàn bộ quy trình"
+                task["completed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                # Nếu công việc đã hoàn thành trước đó, reset về trạng thái pending để người nhận có thể tiếp tục
+                if task.get("status") == "completed":
+                    task["status"] = "pending"
+                    task["completion_note"] = handover_note or "Đã bàn giao từ người hoàn thành"
+            return True
+        
+        return _tasks.update(task_id, apply, expected_version=expected_version)
+    except VersionConflictError:
+        raise
     except Exception as e:
         print(f"Error handing over task: {e}")
         return False
@@ -281,10 +260,7 @@ def handover_task(task_id: int, from_user: str, to_user: str, handover_note: str
 
 def get_task_statistics(username: str = None) -> Dict[str, Any]:
     """Lấy thống kê công việc"""
-    tasks = load_task_assignments()
-    
-    if username:
-        tasks = [task for task in tasks if task.get("assigned_to") == username]
+    tasks = _tasks.find("assigned_to", username) if username else load_task_assignments()
     
     stats = {
         "total": len(tasks),
@@ -310,38 +286,37 @@ def get_task_statistics(username: str = None) -> Dict[str, Any]:
     return stats
 
 
-def get_tasks_paginated(page: int = 1, per_page: int = 20, status: str = None, priority: str = None, assigned_to: str = None) -> tuple:
-    """Lấy danh sách công việc có phân trang và lọc"""
-    tasks = load_task_assignments()
+def get_tasks_paginated(page: int = 1, per_page: int = 20, status: str = None, priority: str = None, assigned_to: str = None,
+                        after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True) -> Page:
+    """Lấy danh sách công việc có phân trang và lọc, theo số trang hoặc con trỏ after/before. Trả về (tasks, total_pages, total_count, cursors)
+
+    with_total=False bỏ qua tổng số: total_pages và total_count khi đó là None (xem pagination.paginate).
+    """
+    tasks = _tasks.find("assigned_to", assigned_to) if assigned_to else load_task_assignments()
     
     # Lọc theo điều kiện
     if status:
         tasks = [task for task in tasks if task.get("status") == status]
     if priority:
         tasks = [task for task in tasks if task.get("priority") == priority]
-    if assigned_to:
-        tasks = [task for task in tasks if task.get("assigned_to") == assigned_to]
     
-    # Sắp xếp theo ngày tạo mới nhất
-    tasks.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+    # Sắp xếp theo ngày tạo mới nhất (ID phân định các công việc tạo cùng lúc)
+    tasks = sorted(tasks, key=_task_sort_key, reverse=True)
     
     # Phân trang
-    total_count = len(tasks)
-    total_pages = (total_count + per_page - 1) // per_page
-    start_index = (page - 1) * per_page
-    end_index = start_index + per_page
-    
-    paginated_tasks = tasks[start_index:end_index]
-    
-    return paginated_tasks, total_pages, total_count
+    tasks, total_pages, total_count, cursors = paginate_sorted(tasks, _task_sort_key, page, per_page, after, before, reverse=True)
+    if not with_total:
+        total_pages = total_count = None
+    return tasks, total_pages, total_count, cursors
+
+
+def _task_sort_key(task: Dict[str, Any]) -> List[Any]:
+    return [task.get("created_at", ""), task.get("id", 0)]
 
 
 def search_tasks(query: str, username: str = None) -> List[Dict[str, Any]]:
     """Tìm kiếm công việc theo từ khóa"""
-    tasks = load_task_assignments()
-    
-    if username:
-        tasks = [task for task in tasks if task.get("assigned_to") == username]
+    tasks = _tasks.find("assigned_to", username) if username else load_task_assignments()
     
     query = query.lower().strip()
     if not query:
@@ -459,15 +434,14 @@ def upload_task_file(task_id: int, file, stage_name: str, uploaded_by: str, desc
         }
         
         # Cập nhật task với file info
-        tasks = load_task_assignments()
-        for task in tasks:
-            if task.get("id") == task_id:
-                if "files" not in task:
-                    task["files"] = []
-                task["files"].append(file_info)
-                task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                save_task_assignments(tasks)
-                return {"success": True, "file_info": file_info}
+        def apply(task: Dict[str, Any]) -> None:
+            if "files" not in task:
+                task["files"] = []
+            task["files"].append(file_info)
+            task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        if _tasks.update(task_id, apply):
+            return {"success": True, "file_info": file_info}
         
         return {"success": False, "error": "Không tìm thấy công việc"}
         
@@ -477,37 +451,35 @@ def upload_task_file(task_id: int, file, stage_name: str, uploaded_by: str, desc
 
 def get_task_files(task_id: int, stage_name: str = None) -> List[Dict[str, Any]]:
     """Lấy danh sách file của một công việc"""
-    tasks = load_task_assignments()
-    for task in tasks:
-        if task.get("id") == task_id:
-            files = task.get("files", [])
-            if stage_name:
-                return [f for f in files if f.get("stage_name") == stage_name]
-            return files
-    return []
+    task = _tasks.get(task_id)
+    if task is None:
+        return []
+    files = task.get("files", [])
+    if stage_name:
+        return [f for f in files if f.get("stage_name") == stage_name]
+    return files
 
 
 def delete_task_file(task_id: int, file_id: str) -> bool:
     """Xóa file của một công việc"""
     try:
-        tasks = load_task_assignments()
-        for task in tasks:
-            if task.get("id") == task_id:
-                files = task.get("files", [])
-                for i, file_info in enumerate(files):
-                    if file_info.get("id") == file_id:
-                        # Xóa file vật lý
-                        file_path = file_info.get("file_path")
-                        if file_path and os.path.exists(file_path):
-                            os.remove(file_path)
-                        
-                        # Xóa khỏi danh sách
-                        files.pop(i)
-                        task["files"] = files
-                        task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        save_task_assignments(tasks)
-                        return True
-        return False
+        def apply(task: Dict[str, Any]) -> bool:
+            files = task.get("files", [])
+            for i, file_info in enumerate(files):
+                if file_info.get("id") == file_id:
+                    # Xóa file vật lý
+                    file_path = file_info.get("file_path")
+                    if file_path and os.path.exists(file_path):
+                        os.remove(file_path)
+                    
+                    # Xóa khỏi danh sách
+                    files.pop(i)
+                    task["files"] = files
+                    task["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    return True
+            return False
+        
+        return _tasks.update(task_id, apply)
     except Exception as e:
         print(f"Error deleting file: {e}")
         return False
@@ -518,9 +490,7 @@ def export_task_assignments_to_excel(username: str = None) -> str:
     import io
     import csv
     
-    tasks = load_task_assignments()
-    if username:
-        tasks = [task for task in tasks if task.get("assigned_to") == username]
+    tasks = _tasks.find("assigned_to", username) if username else load_task_assignments()
     
     output = io.StringIO()
     writer = csv.writer(output)
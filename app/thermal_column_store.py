@@ -1,67 +1,61 @@
 import json
-import os
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional
 
-DATA_FILE = "data/thermal_column_irradiations.json"
+from .customers_store import count_change, irradiation_customer
+from .pagination import Page, paginate, paginate_range
+from .storage import data_path
+from .table import open_table, write_step
+
+DATA_FILE = data_path("thermal_column_irradiations.json")
+
+def _created_date(record: Dict) -> str:
+	"""Day part (YYYY-MM-DD) of created_at"""
+	return (record.get('created_at') or '')[:10]
+
+# Sorted by day for range queries (Table.between)
+_irradiations = open_table(DATA_FILE, "irradiations", seed={"irradiations": []}, stamp_field="last_updated", indexes={"created_date": _created_date})
 
 def load_thermal_column_irradiations() -> List[Dict]:
 	"""Load thermal column irradiations from JSON file"""
-	if not os.path.exists(DATA_FILE):
-		return []
-	
 	try:
-		with open(DATA_FILE, 'r', encoding='utf-8') as f:
-			data = json.load(f)
-			return data.get('irradiations', [])
-	except (json.JSONDecodeError, FileNotFoundError):
+		return _irradiations.rows()
+	except json.JSONDecodeError:
 		return []
 
+@write_step()
 def save_thermal_column_irradiations(irradiations: List[Dict]) -> None:
 	"""Save thermal column irradiations to JSON file"""
-	os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-	
-	data = {
-		'irradiations': irradiations,
-		'last_updated': datetime.now().isoformat()
-	}
-	
-	with open(DATA_FILE, 'w', encoding='utf-8') as f:
-		json.dump(data, f, ensure_ascii=False, indent=2)
+	old = _irradiations.rows()
+	_irradiations.replace_all(irradiations)
+	count_change("irradiations", removed=[irradiation_customer(r) for r in old], added=[irradiation_customer(r) for r in irradiations])
 
 def list_thermal_column_irradiations() -> List[Dict]:
 	"""Get all thermal column irradiations"""
 	return load_thermal_column_irradiations()
 
-def list_thermal_column_irradiations_paginated(page: int = 1, per_page: int = 20) -> Tuple[List[Dict], int, int]:
-	"""Get paginated thermal column irradiations"""
-	irradiations = load_thermal_column_irradiations()
-	
-	# Calculate pagination
-	total_count = len(irradiations)
-	total_pages = (total_count + per_page - 1) // per_page
-	
-	# Get page data
-	start_idx = (page - 1) * per_page
-	end_idx = start_idx + per_page
-	page_irradiations = irradiations[start_idx:end_idx]
-	
-	return page_irradiations, total_pages, total_count
+def list_thermal_column_irradiations_between(date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict]:
+	"""Thermal column irradiations created between two dates (YYYY-MM-DD, inclusive, None for no bound), by date"""
+	return _irradiations.between("created_date", date_from or None, date_to or None)
+
+def list_thermal_column_irradiations_paginated(page: int = 1, per_page: int = 20, after: Optional[str] = None, before: Optional[str] = None, with_total: bool = True, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Page:
+	"""Get paginated thermal column irradiations (see pagination.paginate for the cursors), optionally created between two dates"""
+	if date_from or date_to:
+		return paginate_range(_irradiations, "created_date", _created_date, date_from or None, date_to or None, page, per_page, after, before)
+	return paginate(_irradiations, page, per_page, after, before, with_total=with_total)
 
+@write_step()
 def create_thermal_column_irradiation(sample_code: str, sample_name: str, irradiation_type: str, 
 									position: str, irradiation_time: float, power: float, 
 									temperature: float = None, pressure: float = None, 
 									note: str = "") -> Dict:
 	"""Create a new thermal column irradiation"""
-	irradiations = load_thermal_column_irradiations()
-	
-	# Generate new ID
-	next_id = max([i.get('id', 0) for i in irradiations], default=0) + 1
-	
+	# The table numbers it max(id) + 1
 	irradiation = {
-		'id': next_id,
 		'sample_code': sample_code,
 		'sample_name': sample_name,
+		# Counted for this customer until the record is deleted
+		'customer_id': irradiation_customer({'sample_code': sample_code}),
 		'irradiation_type': irradiation_type,
 		'position': position,
 		'irradiation_time': irradiation_time,
@@ -72,65 +66,57 @@ def create_thermal_column_irradiation(sample_code: str, sample_name: str, irradi
 		'created_at': datetime.now().isoformat()
 	}
 	
-	irradiations.append(irradiation)
-	save_thermal_column_irradiations(irradiations)
+	irradiation_id = _irradiations.insert(irradiation)
+	count_change("irradiations", added=[irradiation['customer_id']])
 	
-	return irradiation
+	return _irradiations.get(irradiation_id)
 
 def get_thermal_column_irradiation(irradiation_id: int) -> Optional[Dict]:
 	"""Get a specific thermal column irradiation by ID"""
-	irradiations = load_thermal_column_irradiations()
-	
-	for irradiation in irradiations:
-		if irradiation.get('id') == irradiation_id:
-			return irradiation
-	
-	return None
+	return _irradiations.get(irradiation_id)
 
+@write_step()
 def update_thermal_column_irradiation(irradiation_id: int, sample_code: str, sample_name: str, 
 									  irradiation_type: str, position: str, irradiation_time: float, 
 									  power: float, temperature: float = None, pressure: float = None, 
 									  note: str = "") -> bool:
 	"""Update a thermal column irradiation"""
-	irradiations = load_thermal_column_irradiations()
-	
-	for i, irradiation in enumerate(irradiations):
-		if irradiation.get('id') == irradiation_id:
-			irradiations[i].update({
-				'sample_code': sample_code,
-				'sample_name': sample_name,
-				'irradiation_type': irradiation_type,
-				'position': position,
-				'irradiation_time': irradiation_time,
-				'power': power,
-				'temperature': temperature,
-				'pressure': pressure,
-				'note': note,
-				'updated_at': datetime.now().isoformat()
-			})
-			save_thermal_column_irradiations(irradiations)
-			return True
-	
-	return False
+	old = _irradiations.get(irradiation_id)
+	if old is None:
+		return False
+	customer_id = irradiation_customer(old) if old.get('sample_code') == sample_code else irradiation_customer({'sample_code': sample_code})
+	if not _irradiations.update(irradiation_id, {
+		'sample_code': sample_code,
+		'sample_name': sample_name,
+		'customer_id': customer_id,
+		'irradiation_type': irradiation_type,
+		'position': position,
+		'irradiation_time': irradiation_time,
+		'power': power,
+		'temperature': temperature,
+		'pressure': pressure,
+		'note': note,
+		'updated_at': datetime.now().isoformat()
+	}):
+		return False
+	count_change("irradiations", removed=[irradiation_customer(old)], added=[customer_id])
+	return True
 
+@write_step()
 def delete_thermal_column_irradiation(irradiation_id: int) -> bool:
 	"""Delete a thermal column irradiation"""
-	irradiations = load_thermal_column_irradiations()
-	
-	for i, irradiation in enumerate(irradiations):
-		if irradiation.get('id') == irradiation_id:
-			del irradiations[i]
-			save_thermal_column_irradiations(irradiations)
-			return True
-	
-	return False
+	old = _irradiations.get(irradiation_id)
+	if old is None or not _irradiations.delete(irradiation_id):
+		return False
+	count_change("irradiations", removed=[irradiation_customer(old)])
+	return True
 
-def export_thermal_column_irradiations_to_excel() -> str:
-	"""Export thermal column irradiations to Excel format"""
+def export_thermal_column_irradiations_to_excel(date_from: Optional[str] = None, date_to: Optional[str] = None) -> str:
+	"""Export thermal column irradiations (optionally only those created between two dates) to Excel format"""
 	import io
 	from openpyxl import Workbook
 	
-	irradiations = load_thermal_column_irradiations()
+	irradiations = list_thermal_column_irradiations_between(date_from, date_to) if date_from or date_to else load_thermal_column_irradiations()
 	
 	wb = Workbook()
 	ws = wb.active
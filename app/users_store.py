@@ -1,11 +1,11 @@
-import json
-import os
 from typing import Dict, Any, List, Optional
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from .storage import data_path
+from .table import open_table
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
+
+USERS_FILE = data_path("users.json")
 
 
 DEFAULT_SECTIONS = [
@@ -27,15 +27,8 @@ WORKFLOW_ROLES = [
 ]
 
 
-def _ensure_store() -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	if not os.path.exists(USERS_FILE):
-		seed_admin()
-
-
-def seed_admin() -> None:
-	"""Create the initial Admin user if file does not exist."""
-	os.makedirs(DATA_DIR, exist_ok=True)
+def _admin_seed() -> Dict[str, Any]:
+	"""Initial users file holding only the Admin user."""
 	admin_record = {
 		"username": "Admin",
 		"password_hash": generate_password_hash("admin"),
@@ -44,28 +37,27 @@ def seed_admin() -> None:
 		"workflow_roles": [role[0] for role in WORKFLOW_ROLES],  # Admin có tất cả vai trò
 		"active": True,
 	}
-	with open(USERS_FILE, "w", encoding="utf-8") as f:
-		json.dump({"users": [admin_record]}, f, ensure_ascii=False, indent=2)
+	return {"users": [admin_record]}
+
+
+_users = open_table(USERS_FILE, "users", seed=_admin_seed, primary_key="username")
+
+
+def seed_admin() -> None:
+	"""Create the initial Admin user if file does not exist."""
+	_users.replace_all(_admin_seed()["users"])
 
 
 def load_users() -> List[Dict[str, Any]]:
-	_ensure_store()
-	with open(USERS_FILE, "r", encoding="utf-8") as f:
-		data = json.load(f)
-	return data.get("users", [])
+	return _users.rows()
 
 
 def save_users(users: List[Dict[str, Any]]) -> None:
-	os.makedirs(DATA_DIR, exist_ok=True)
-	with open(USERS_FILE, "w", encoding="utf-8") as f:
-		json.dump({"users": users}, f, ensure_ascii=False, indent=2)
+	_users.replace_all(users)
 
 
 def get_user(username: str) -> Optional[Dict[str, Any]]:
-	for user in load_users():
-		if user.get("username") == username:
-			return user
-	return None
+	return _users.get(username)
 
 
 def create_user(username: str, password: str, role: str, permissions: List[str], workflow_roles: List[str] = None, detailed_permissions: dict = None) -> bool:
@@ -91,21 +83,14 @@ def create_user(username: str, password: str, role: str, permissions: List[str],
 		"workflow_roles": workflow_roles or [],
 		"active": True,
 	}
-	users = load_users()
-	users.append(user)
-	save_users(users)
+	_users.insert(user)
 	return True
 
 
 def delete_user(username: str) -> bool:
 	if username == "Admin":
 		return False
-	users = load_users()
-	new_users = [u for u in users if u.get("username") != username]
-	if len(new_users) == len(users):
-		return False
-	save_users(new_users)
-	return True
+	return _users.delete(username)
 
 
 def verify_user_credentials(username: str, password: str) -> bool:
@@ -180,13 +165,7 @@ def has_workflow_role(username: str, workflow_role: str) -> bool:
 
 def update_user_workflow_roles(username: str, workflow_roles: List[str]) -> bool:
 	"""Cập nhật vai trò quy trình cho người dùng"""
-	users = load_users()
-	for user in users:
-		if user.get("username") == username:
-			user["workflow_roles"] = workflow_roles
-			save_users(users)
-			return True
-	return False
+	return _users.update(username, {"workflow_roles": workflow_roles})
 
 
 def get_workflow_roles() -> List[tuple]:
@@ -196,30 +175,20 @@ def get_workflow_roles() -> List[tuple]:
 
 def update_user(username: str, password: str = None, role: str = None, permissions: List[str] = None, workflow_roles: List[str] = None, detailed_permissions: dict = None) -> bool:
 	"""Cập nhật thông tin người dùng"""
-	users = load_users()
-	for user in users:
-		if user.get("username") == username:
-			if password:
-				user["password_hash"] = generate_password_hash(password)
-			if role:
-				user["role"] = role
-			if permissions is not None:
-				user["permissions"] = permissions
-			if workflow_roles is not None:
-				user["workflow_roles"] = workflow_roles
-			if detailed_permissions is not None:
-				user["detailed_permissions"] = detailed_permissions
-			save_users(users)
-			return True
-	return False
+	changes: Dict[str, Any] = {}
+	if password:
+		changes["password_hash"] = generate_password_hash(password)
+	if role:
+		changes["role"] = role
+	if permissions is not None:
+		changes["permissions"] = permissions
+	if workflow_roles is not None:
+		changes["workflow_roles"] = workflow_roles
+	if detailed_permissions is not None:
+		changes["detailed_permissions"] = detailed_permissions
+	return _users.update(username, changes)
 
 
 def update_user_password(username: str, new_password: str) -> bool:
 	"""Cập nhật mật khẩu người dùng"""
-	users = load_users()
-	for user in users:
-		if user.get("username") == username:
-			user["password_hash"] = generate_password_hash(new_password)
-			save_users(users)
-			return True
-	return False
+	return _users.update(username, {"password_hash": generate_password_hash(new_password)})
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+So sánh tốc độ ghi/đọc và kích thước file dữ liệu JSON giữa các cách tuần tự hóa
+Sử dụng: python bench_serializer.py [số_bản_ghi]   (mặc định 50000)
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import serializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def generate_samples(count):
+    """Tạo dữ liệu giống data/samples.json"""
+    random.seed(42)
+    types = ["Đất", "Nước", "Trầm tích", "Thực vật", "Quặng"]
+    targets = ["Au, Ag", "U, Th", "Nguyên tố vết", "Kim loại nặng"]
+    samples = []
+    for i in range(1, count + 1):
+        samples.append({
+            "id": i,
+            "received_date": f"2025-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            "customer_id": random.randint(1, 200),
+            "sample_name": f"Mẫu {random.choice(types).lower()} số {i}",
+            "sample_code": f"NAA-{i:06d}",
+            "sample_type": random.choice(types),
+            "analysis_target": random.choice(targets),
+            "note": "Ghi chú cho mẫu" if i % 3 == 0 else "",
+            "version": 1,
+        })
+    return {"next_id": count + 1, "samples": samples}
+
+
+def best_of(func, repeat=3):
+    """Thời gian nhỏ nhất (ms) sau vài lần chạy"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = generate_samples(count)
+
+    candidates = [
+        ("json indent=2 (định dạng cũ)",
+         lambda d: json.dumps(d, ensure_ascii=False, indent=2).encode("utf-8"), json.loads),
+        ("json gọn (separators)",
+         lambda d: json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), json.loads),
+    ]
+    if orjson is not None:
+        candidates.append(("orjson gọn", orjson.dumps, orjson.loads))
+        candidates.append(("orjson indent=2", lambda d: orjson.dumps(d, option=orjson.OPT_INDENT_2), orjson.loads))
+    else:
+        print("(chưa cài orjson: pip install orjson để so sánh thêm)")
+
+    print(f"Serializer đang dùng: {serializer.BACKEND} | {count} bản ghi")
+    print(f"{'Cách tuần tự hóa':32} {'Ghi (ms)':>10} {'Đọc (ms)':>10} {'Kích thước (KB)':>16}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, dump, load in candidates:
+            path = os.path.join(tmp, "samples.json")
+
+            def write():
+                with open(path, "wb") as f:
+                    f.write(dump(data))
+
+            def read():
+                with open(path, "rb") as f:
+                    return load(f.read())
+
+            write_ms = best_of(write)
+            read_ms = best_of(read)
+            assert read() == data
+            size = os.path.getsize(path)
+            baseline = baseline or size
+            print(f"{name:32} {write_ms:10.1f} {read_ms:10.1f} {size / 1024:12.0f} ({size / baseline:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sqlite_backend, storage  # noqa: E402
+from app.lines_table import LinesTable  # noqa: E402
+from app.sharded_table import ShardedTable  # noqa: E402
+from app.similarity import trigrams  # noqa: E402
+from app.table import Table, TokenIndex  # noqa: E402
+
+BACKENDS = ("json", "journal", "lines", "sharded", "sqlite")
+
+# Modules opening tables at import (or importing those that do), imported again for each app
+_STORE_MODULES = set(sqlite_backend.STORE_MODULES) | {"auth", "routes"}
+
+
+def _close_connection() -> None:
+	conn = getattr(sqlite_backend._local, "conn", None)
+	if conn is not None:
+		conn.close()
+		sqlite_backend._local.conn = None
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+	"""An empty data directory, holding the SQLite database too"""
+	_close_connection()
+	monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+	monkeypatch.setattr(sqlite_backend, "DATABASE_FILE", str(tmp_path / "naa.sqlite3"))
+	yield str(tmp_path)
+	_close_connection()
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+	return request.param
+
+
+@pytest.fixture
+def open_items(data_dir):
+	"""open_items(backend) -> the "items" table of data_dir on that backend.
+
+	Records have a `group` (the shard field), a `date` and a `name`, indexed
+	by value and, for the name, by trigrams.
+	"""
+	def open_items(backend: str, name: str = "items", **options):
+		path = os.path.join(data_dir, name + ".json")
+		options = {
+			"seed": {"next_id": 1, "items": []},
+			"indexes": {
+				"group": lambda r: r.get("group"),
+				"date": lambda r: r.get("date") or "",
+				"name_grams": TokenIndex(lambda r: trigrams(r.get("name"))),
+			},
+			**options,
+		}
+		if backend == "sqlite":
+			return sqlite_backend.SqliteTable(path, "items", **options)
+		if backend == "sharded":
+			return ShardedTable(path, "items", "group", journal=True, **options)
+		if backend == "lines":
+			return LinesTable(path, "items", **options)
+		return Table(path, "items", journal=backend == "journal", **options)
+	return open_items
+
+
+@pytest.fixture
+def app(data_dir):
+	"""The Flask app with its stores in data_dir (json backend).
+
+	The store modules are imported again, so their tables open in data_dir
+	and start out empty.
+	"""
+	for name in [m for m in sys.modules if m.startswith("app.") and m[4:] in _STORE_MODULES]:
+		del sys.modules[name]
+	from app import create_app
+	flask_app = create_app()
+	flask_app.config["TESTING"] = True
+	return flask_app
+
+
+@pytest.fixture
+def client(app):
+	"""Test client logged in as the seeded Admin user"""
+	client = app.test_client()
+	with client.session_transaction() as session:
+		session["user_id"] = "Admin"
+		session["username"] = "Admin"
+	return client
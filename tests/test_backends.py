@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from app.similarity import trigrams
+
+WORDS = ("dat", "nen", "la", "che", "tra", "lua", "gao", "nuoc")
+
+
+def _fill(table, seed: int = 7) -> None:
+	"""The same inserts, updates and deletes on any backend"""
+	rnd = random.Random(seed)
+	live = []
+	for _ in range(300):
+		roll = rnd.random()
+		if roll < 0.7 or not live:
+			live.append(table.insert({
+				"group": rnd.randint(0, 3),
+				"date": f"2025-01-{rnd.randint(1, 20):02d}",
+				"name": " ".join(rnd.sample(WORDS, 2)),
+			}))
+		elif roll < 0.85:
+			table.delete(live.pop(rnd.randrange(len(live))))
+		else:
+			table.update(rnd.choice(live), {"date": f"2025-02-{rnd.randint(1, 9):02d}", "group": rnd.randint(0, 3)})
+
+
+def _ids(records):
+	return [r["id"] for r in records]
+
+
+def _walk(table, forward: bool, limit: int = 7, **filter):
+	"""Every id, reached page by page through seek() from the first or the last"""
+	seen = []
+	cursor = None if forward else 1 << 62
+	while True:
+		if forward:
+			records, more = table.seek(limit, after=cursor, **filter)
+			seen += _ids(records)
+			cursor = seen[-1] if records else None
+		else:
+			records, more = table.seek(limit, before=cursor, **filter)
+			seen = _ids(records) + seen
+			cursor = seen[0] if records else None
+		if not more:
+			return seen
+
+
+@pytest.fixture
+def tables(open_items, backend):
+	reference = open_items("json", name="reference")
+	other = open_items(backend)
+	_fill(reference)
+	_fill(other)
+	return reference, other
+
+
+def test_seek_matches_json(tables):
+	reference, other = tables
+	for forward in (True, False):
+		assert _walk(other, forward) == _walk(reference, forward)
+		for group in range(4):
+			assert _walk(other, forward, index="group", key=group) == _walk(reference, forward, index="group", key=group)
+	assert _walk(reference, True) == _walk(reference, False) == sorted(_ids(reference.rows()))
+
+
+def test_sort_matches_json(tables):
+	reference, other = tables
+	for descending in (False, True):
+		assert _ids(other.sort("date", descending)) == _ids(reference.sort("date", descending))
+		assert _ids(other.sort("date", descending, index="group", key=2)) == _ids(reference.sort("date", descending, index="group", key=2))
+
+
+def test_between_matches_json(tables):
+	reference, other = tables
+	for low, high in (("2025-01-05", "2025-01-12"), (None, "2025-01-03"), ("2025-02-01", None), ("2025-03-01", None)):
+		expected = _ids(reference.between("date", low, high))
+		assert expected or low == "2025-03-01"
+		assert _ids(other.between("date", low, high)) == expected
+
+
+def test_overlap_matches_json(tables):
+	reference, other = tables
+	for value in ("dat nen", "la che", "nuoc"):
+		for at_least in (1, 3):
+			expected = [(r["id"], n) for r, n in reference.overlap("name_grams", trigrams(value), at_least)]
+			assert expected
+			assert [(r["id"], n) for r, n in other.overlap("name_grams", trigrams(value), at_least)] == expected
+
+
+def test_distinct_matches_json(tables):
+	reference, other = tables
+	assert other.distinct("group") == reference.distinct("group") == [0, 1, 2, 3]
+	assert other.distinct("date") == reference.distinct("date")
@@ -0,0 +1,91 @@
+import pytest
+
+
+def _received(name="Khách A", sample_name="Đất nền", sample_code="DN1"):
+	from app.customers_store import create_customer
+	from app.samples_store import create_sample
+	customer = create_customer(name, "", "", "", "")
+	return customer, create_sample(customer, sample_name, sample_code, "soil", "Fe", "")
+
+
+def _boxes(customer_name, sample_name, encoding, **ids):
+	from app.closed_samples_store import create_closed_sample_with_boxes
+	return create_closed_sample_with_boxes("2026-01-01", customer_name, sample_name, encoding, [{"box_symbol": "A", "weight": 1}, {"box_symbol": "B", "weight": 2}], **ids)
+
+
+def test_boxes_keep_their_links_through_renames(app, client):
+	from app.closed_samples_store import get_closed_sample, list_closed_samples_by_customer, list_closed_samples_by_sample, update_closed_sample
+	from app.customers_store import update_customer
+	from app.samples_store import update_sample
+	customer, sample = _received()
+	boxes = _boxes("Khách A", "Đất nền", "DN1", customer_id=customer, sample_id=sample)
+
+	update_customer(customer, "Khách A mới", "", "", "", "")
+	update_sample(sample, customer, "Đất nền đỏ", "DN1x", "soil", "Fe", "")
+	update_closed_sample(boxes[0], "2026-01-02", "Khách A", "Đất nền", "DN1", "A", 1, 0, "sửa")
+	assert get_closed_sample(boxes[0])["sample_id"] == sample
+	assert [r["id"] for r in list_closed_samples_by_sample(sample)] == boxes
+	assert [r["id"] for r in list_closed_samples_by_customer(customer)] == boxes
+	assert [r["id"] for r in client.get(f"/api/samples/{sample}/closed-samples").get_json()] == boxes
+
+
+def test_update_relinks_to_the_given_sample(app):
+	from app.closed_samples_store import get_closed_sample, update_closed_sample
+	from app.customers_store import customer_counts
+	first, sample = _received("Khách A")
+	second, other = _received("Khách B", "Lá chè", "LC1")
+	box = _boxes("Khách A", "Đất nền", "DN1", customer_id=first, sample_id=sample)[0]
+
+	update_closed_sample(box, "2026-01-01", "Khách B", "Lá chè", "LC1", "A", 1, 0, customer_id=second, sample_id=other)
+	assert (get_closed_sample(box)["customer_id"], get_closed_sample(box)["sample_id"]) == (second, other)
+	assert customer_counts()[first]["closed_boxes"] == 1 and customer_counts()[second]["closed_boxes"] == 1
+
+
+def test_unlinked_boxes_are_linked_once_their_sample_exists(app):
+	from app.closed_samples_store import get_closed_sample, link_closed_samples
+	from app.customers_store import create_customer, customer_counts
+	from app.samples_store import create_sample
+	customer = create_customer("Khách A", "", "", "", "")
+	box = _boxes("Khách A", "Gạo", "G1")[0]
+	assert get_closed_sample(box)["sample_id"] is None
+	# Counted for the customer with its name until then
+	assert customer_counts()[customer]["closed_boxes"] == 2
+
+	sample = create_sample(customer, "Gạo", "G1", "rice", "As", "")
+	assert link_closed_samples() == 2
+	assert (get_closed_sample(box)["customer_id"], get_closed_sample(box)["sample_id"]) == (customer, sample)
+	assert link_closed_samples() == 0
+	assert customer_counts()[customer]["closed_boxes"] == 2
+
+
+def test_sample_with_boxes_cannot_be_deleted(app, client):
+	from app.closed_samples_store import delete_closed_sample
+	from app.samples_store import delete_sample, get_sample
+	customer, sample = _received()
+	boxes = _boxes("Khách A", "Đất nền", "DN1", customer_id=customer, sample_id=sample)
+
+	with pytest.raises(ValueError, match="còn 2 hộp mẫu đóng"):
+		delete_sample(sample)
+	response = client.post(f"/receiving/delete/{sample}", follow_redirects=True)
+	assert "Không thể xóa mẫu" in response.get_data(as_text=True)
+	assert get_sample(sample)
+
+	for pk in boxes:
+		delete_closed_sample(pk)
+	assert delete_sample(sample)
+
+
+def test_closing_form_links_the_chosen_sample(app, client):
+	from app.closed_samples_store import list_closed_samples
+	customer, sample = _received()
+	client.post("/closing/regular/add", data={
+		"closing_date": "2026-01-01",
+		"customer_id": customer,
+		"customer_name": "Khách A",
+		"sample_id": sample,
+		"sample_name": "Đất nền",
+		"encoding": "DN1",
+		"boxes[0][box_symbol]": "A",
+		"boxes[0][weight]": "1.5",
+	})
+	assert [(r["customer_id"], r["sample_id"]) for r in list_closed_samples()] == [(customer, sample)]
@@ -0,0 +1,86 @@
+import pytest
+
+
+def _customers(*names, organization=""):
+	from app.customers_store import create_customer
+	return [create_customer(name, organization, "", "", "") for name in names]
+
+
+def test_suggest_matches_prefixes_of_names_words_and_organizations(app):
+	from app.customers_store import suggest_customers, update_customer
+	viet, dai, an = _customers("Công ty Đất Việt", "Đại Nam", "An Phát")
+	update_customer(an, "An Phát", "Viện Hóa học", "", "", "")
+
+	def ids(q, **kwargs):
+		return [c["id"] for c in suggest_customers(q, **kwargs)]
+
+	assert ids("cong ty") == [viet]
+	assert ids("dat v") == [viet]
+	# Whole-name matches first, then word and organization matches
+	assert ids("d") == [dai, viet]
+	assert ids("VIEN hoa") == [an]
+	assert ids("d", limit=1) == [dai]
+	assert ids("xyz") == []
+	assert suggest_customers("dai") == [{"id": dai, "name": "Đại Nam"}]
+
+
+def test_suggest_endpoint(app, client):
+	dai, = _customers("Đại Nam")
+	assert client.get("/api/customers/suggest?q=Dai").get_json() == [{"id": dai, "name": "Đại Nam"}]
+	assert client.get("/api/customers/suggest?q=&limit=0").status_code == 200
+
+
+def test_suggest_endpoint_needs_receiving_or_closing(app, client):
+	from app.users_store import create_user
+	create_user("ktv", "secret", "user", ["tasks"])
+	with client.session_transaction() as session:
+		session["user_id"] = "ktv"
+	assert client.get("/api/customers/suggest?q=a").status_code == 403
+
+
+def test_counters_follow_the_writes(app):
+	from app.channel_7_1_store import create_channel_7_1_irradiation, delete_channel_7_1_irradiation
+	from app.closed_samples_store import create_closed_sample_with_boxes, delete_closed_sample
+	from app.customers_store import customer_counts, rebuild_customer_counts
+	from app.samples_store import create_sample, delete_sample, import_samples_from_csv, update_sample
+	first, second = _customers("Khách A", "Khách B")
+
+	def counts(customer):
+		return dict(customer_counts().get(customer, {"samples": 0, "closed_boxes": 0, "irradiations": 0}))
+
+	sample = create_sample(first, "Đất nền", "DN1", "soil", "Fe", "")
+	moved = create_sample(first, "Lá chè", "LC1", "leaf", "K", "")
+	import_samples_from_csv(f"ID Khách hàng,Tên mẫu,Mã hóa mẫu\n{second},Gạo,G1\n")
+	update_sample(moved, second, "Lá chè", "LC1", "leaf", "K", "")
+	boxes = create_closed_sample_with_boxes("2026-01-01", "Khách A", "Đất nền", "DN1", [{"box_symbol": "A", "weight": 1}, {"box_symbol": "B", "weight": 2}], customer_id=first, sample_id=sample)
+	irradiation = create_channel_7_1_irradiation("DN1", "Đất nền", "P1", 1, 1)
+	assert counts(first) == {"samples": 1, "closed_boxes": 2, "irradiations": 1}
+	assert counts(second) == {"samples": 2, "closed_boxes": 0, "irradiations": 0}
+
+	# The kept counters equal a full recount
+	kept = {pk: dict(c) for pk, c in customer_counts().items()}
+	rebuild_customer_counts()
+	assert {pk: dict(c) for pk, c in customer_counts().items()} == kept
+
+	for pk in boxes:
+		delete_closed_sample(pk)
+	delete_channel_7_1_irradiation(irradiation["id"])
+	delete_sample(sample)
+	assert counts(first) == {"samples": 0, "closed_boxes": 0, "irradiations": 0}
+
+
+def test_customer_with_records_cannot_be_deleted(app, client):
+	from app.customers_store import delete_customer, get_customer
+	from app.samples_store import create_sample, delete_sample
+	customer, = _customers("Khách A")
+	sample = create_sample(customer, "Đất nền", "DN1", "soil", "Fe", "")
+
+	with pytest.raises(ValueError, match="còn 1 mẫu"):
+		delete_customer(customer)
+	response = client.post(f"/customers/delete/{customer}", follow_redirects=True)
+	assert "Không thể xóa khách hàng" in response.get_data(as_text=True)
+	assert get_customer(customer)
+
+	delete_sample(sample)
+	assert delete_customer(customer)
+	assert get_customer(customer) is None
@@ -0,0 +1,54 @@
+from urllib.parse import parse_qs, urlparse
+
+
+def _samples(app):
+	from app.customers_store import create_customer
+	from app.samples_store import create_sample
+	first = create_customer("Khách A", "", "", "", "")
+	second = create_customer("Khách B", "", "", "", "")
+	create_sample(first, "Đất nền", "DN1", "soil", "Fe", "")
+	create_sample(second, "Lá chè", "LC1", "leaf", "K", "")
+	return first, second
+
+
+def _token(client, query: str) -> str:
+	url = client.get(f"/receiving/save-filtered?{query}").get_json()["url"]
+	return parse_qs(urlparse(url).query)["token"][0]
+
+
+def test_signed_link_exports_the_filtered_samples(app, client):
+	first, _ = _samples(app)
+	response = client.get(f"/receiving/export?token={_token(client, f'customer_id={first}')}")
+	assert response.status_code == 200
+	body = response.get_data().decode("utf-8-sig")
+	assert "DN1" in body and "LC1" not in body
+	assert "mau_khach_hang_Khach_A.csv" in response.headers["Content-Disposition"]
+
+
+def test_signed_link_keeps_the_list_filters_and_sort(app, client):
+	from app.samples_store import create_sample
+	first, _ = _samples(app)
+	create_sample(first, "Đất đồi", "DD1", "soil", "Fe", "")
+	create_sample(first, "Đất ruộng", "DR1", "soil", "P", "")
+	token = _token(client, "q=%C4%91%E1%BA%A5t&sample_type=SOIL&analysis_target=fe&sort=sample_code&dir=desc")
+	body = client.get(f"/receiving/export?token={token}").get_data().decode("utf-8-sig")
+	codes = [line.split(",")[4] for line in body.splitlines()[1:]]
+	assert codes == ["DN1", "DD1"]
+
+def test_tampered_token_is_refused(app, client):
+	first, second = _samples(app)
+	token = _token(client, f"customer_id={first}")
+	# Swapping in another payload breaks the signature
+	forged = _token(client, f"customer_id={second}").split(".")[0] + "." + token.split(".", 1)[1]
+	for bad in (forged, token[:-2], "not-a-token"):
+		response = client.get(f"/receiving/export?token={bad}")
+		assert response.status_code == 302 and response.headers["Location"].endswith("/receiving")
+
+
+def test_expired_token_is_refused(app, client, monkeypatch):
+	from app import routes
+	first, _ = _samples(app)
+	token = _token(client, f"customer_id={first}")
+	monkeypatch.setattr(routes, "EXPORT_TOKEN_MAX_AGE", -1)
+	response = client.get(f"/receiving/export?token={token}", follow_redirects=True)
+	assert "hết hạn" in response.get_data(as_text=True)
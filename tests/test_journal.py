@@ -0,0 +1,61 @@
+import threading
+
+
+def _names(table):
+	return {r["id"]: r["name"] for r in table.rows()}
+
+
+def test_replay_skips_a_line_cut_by_a_crash(open_items):
+	items = open_items("journal")
+	a, b, c = (items.insert({"group": 0, "name": name}) for name in ("a", "b", "c"))
+	items.update(a, {"name": "a2"})
+	items.delete(b)
+	# A writer died halfway through its line
+	with open(items.log_path, "ab") as f:
+		f.write(b'{"n":99,"op":"insert","records":[{"id":')
+
+	reopened = open_items("journal")
+	assert _names(reopened) == {a: "a2", c: "c"}
+	d = reopened.insert({"group": 0, "name": "d"})
+	assert d == c + 1
+
+	# The cut line was terminated by the next append and is skipped on replay
+	assert _names(open_items("journal")) == {a: "a2", c: "c", d: "d"}
+
+
+def test_compaction_racing_writes_keeps_them_all(open_items):
+	writer = open_items("journal")
+	compactor = open_items("journal")  # another worker sharing the files
+	stop = threading.Event()
+
+	def compact() -> None:
+		while not stop.is_set():
+			compactor.compact()
+
+	thread = threading.Thread(target=compact)
+	thread.start()
+	try:
+		ids = [writer.insert({"group": i % 3, "name": f"n{i}"}) for i in range(200)]
+		for pk in ids[::4]:
+			writer.update(pk, {"name": "updated"})
+		for pk in ids[1::4]:
+			writer.delete(pk)
+	finally:
+		stop.set()
+		thread.join()
+
+	assert ids == list(range(1, 201))
+	expected = {pk: "updated" if i % 4 == 0 else f"n{i}" for i, pk in enumerate(ids) if i % 4 != 1}
+	assert _names(writer) == expected
+	assert _names(open_items("journal")) == expected
+	compactor.compact()
+	assert _names(open_items("journal")) == expected
+
+
+def test_compacted_journal_replays_onto_the_folded_file(open_items):
+	items = open_items("journal")
+	first = [items.insert({"group": 0, "name": f"n{i}"}) for i in range(5)]
+	items.compact()
+	items.delete(first[0])
+	later = items.insert({"group": 0, "name": "later"})
+	assert _names(open_items("journal")) == {**{pk: f"n{i}" for i, pk in enumerate(first) if i}, later: "later"}
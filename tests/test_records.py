@@ -0,0 +1,55 @@
+import pytest
+
+from app.table import VersionConflictError, write_step
+
+
+def test_stale_version_is_refused(open_items, backend):
+	items = open_items(backend, versioned=True)
+	pk = items.insert({"group": 0, "name": "first"})
+	assert items.get(pk)["version"] == 1
+
+	assert items.update(pk, {"name": "second"}, expected_version=1)
+	assert items.get(pk)["version"] == 2
+	with pytest.raises(VersionConflictError) as conflict:
+		items.update(pk, {"name": "lost"}, expected_version=1)
+	assert (conflict.value.expected, conflict.value.actual) == (1, 2)
+	assert items.get(pk)["name"] == "second"
+
+	# Without an expected version the update always applies
+	assert items.update(pk, {"name": "third"})
+	assert open_items(backend, versioned=True).get(pk)["version"] == 3
+
+
+def test_ids_are_not_reused_after_delete(open_items, backend):
+	items = open_items(backend)
+	ids = [items.insert({"group": i % 2, "name": f"n{i}"}) for i in range(5)]
+	assert ids == [1, 2, 3, 4, 5]
+	items.delete(5)
+	items.delete(2)
+	assert items.insert({"group": 0, "name": "new"}) == 6
+	assert [r["name"] for r in (items.get(pk) for pk in (1, 3, 4))] == ["n0", "n2", "n3"]
+
+	reopened = open_items(backend)
+	assert reopened.get(2) is None and reopened.get(5) is None
+	assert reopened.insert({"group": 1, "name": "after restart"}) == 7
+
+
+def test_failed_write_step_is_rolled_back(open_items, backend):
+	items = open_items(backend)
+	kept = items.insert({"group": 0, "name": "kept"})
+
+	with pytest.raises(RuntimeError):
+		with write_step():
+			items.insert({"group": 1, "name": "dropped"})
+			items.update(kept, {"name": "changed"})
+			raise RuntimeError("step failed")
+	for table in (items, open_items(backend)):
+		assert table.get(kept)["name"] == "kept"
+		assert table.get(kept + 1) is None
+
+	with write_step():
+		added = items.insert({"group": 1, "name": "added"})
+		items.update(kept, {"name": "changed"})
+	reopened = open_items(backend)
+	assert reopened.get(kept)["name"] == "changed"
+	assert reopened.get(added)["name"] == "added"
@@ -0,0 +1,79 @@
+import pytest
+
+CSV_HEADER = "ID Khách hàng,Tên mẫu,Mã hóa mẫu,Loại mẫu,Chỉ tiêu phân tích,Ghi chú\n"
+
+
+def _csv(*rows):
+	return CSV_HEADER + "".join(",".join(map(str, row)) + "\n" for row in rows)
+
+
+def _customer(name="Khách A"):
+	from app.customers_store import create_customer
+	return create_customer(name, "", "", "", "")
+
+
+def test_import_writes_the_valid_rows_and_reports_the_others(app):
+	from app.samples_store import create_sample, import_samples_from_csv, list_samples
+	customer = _customer()
+	create_sample(customer, "Đất nền", "DN1", "soil", "Fe", "")
+
+	count, errors = import_samples_from_csv(_csv(
+		(customer, "Lá chè", "LC1", "leaf", "K", ""),
+		(customer, "Đất nền", "DN9", "soil", "Fe", ""),  # name already taken
+		("x", "Gạo", "G1", "rice", "As", ""),  # not a customer id
+		(customer, "Lúa", "LC1", "rice", "As", ""),  # code taken by an earlier row
+	))
+	assert count == 1
+	assert [e.split(":")[0] for e in errors] == ["Dòng 4", "Dòng 3", "Dòng 5"]
+	assert sorted(s["sample_name"] for s in list_samples()) == ["Lá chè", "Đất nền"]
+
+
+def test_all_or_nothing_import_writes_nothing_on_error(app):
+	from app.customers_store import customer_counts
+	from app.samples_store import create_sample, import_samples_from_csv, list_samples
+	first, second = _customer("Khách A"), _customer("Khách B")
+	create_sample(second, "Mẫu cũ", "OLD", "soil", "Fe", "")
+	rows = [(first, "Mới 1", "N1", "soil", "Fe", ""), (second, "Mẫu cũ", "N2", "soil", "Fe", ""), (first, "Mới 2", "N3", "soil", "Fe", "")]
+
+	count, errors = import_samples_from_csv(_csv(*rows), all_or_nothing=True)
+	assert count == 0
+	assert errors[-1].startswith("Không có mẫu nào được import")
+	assert [s["sample_name"] for s in list_samples()] == ["Mẫu cũ"]
+	assert customer_counts().get(first, {}).get("samples", 0) == 0
+
+	count, errors = import_samples_from_csv(_csv(*rows))
+	assert count == 2 and len(errors) == 1
+	assert customer_counts()[first]["samples"] == 2
+
+
+def test_name_and_code_are_unique_per_customer(app):
+	from app.samples_store import create_sample, find_sample_conflict, update_sample
+	first, second = _customer("Khách A"), _customer("Khách B")
+	sample = create_sample(first, "Đất nền", "DN1", "soil", "Fe", "")
+
+	with pytest.raises(ValueError, match="Tên mẫu 'đất NỀN' đã tồn tại"):
+		create_sample(first, "  đất NỀN ", "DN2", "soil", "Fe", "")
+	with pytest.raises(ValueError, match="Mã hóa mẫu 'dn1' đã tồn tại"):
+		create_sample(first, "Lá chè", "dn1", "leaf", "K", "")
+	# Another customer may use them, and a sample keeps its own
+	assert create_sample(second, "Đất nền", "DN1", "soil", "Fe", "")
+	assert find_sample_conflict(first, "Đất nền", "DN1", exclude_id=sample) is None
+	assert update_sample(sample, first, "Đất nền", "DN1", "soil", "Cu", "")
+
+	other = create_sample(first, "Lá chè", "LC1", "leaf", "K", "")
+	with pytest.raises(ValueError):
+		update_sample(other, first, "Lá chè", "DN1", "leaf", "K", "")
+
+
+def test_check_code_endpoint(app, client):
+	from app.samples_store import create_sample
+	customer = _customer()
+	sample = create_sample(customer, "Đất nền", "DN1", "soil", "Fe", "")
+
+	taken = client.get(f"/api/samples/check-code?customer_id={customer}&sample_code=dn1").get_json()
+	assert taken["available"] is False and "DN1" in taken["message"].upper()
+	own = client.get(f"/api/samples/check-code?customer_id={customer}&sample_code=DN1&exclude_id={sample}").get_json()
+	assert own["available"] is True
+	free = client.get(f"/api/samples/check-code?customer_id={customer}&sample_code=DN2&sample_name=Lúa").get_json()
+	assert free["available"] is True and free["message"] is None
+	assert client.get("/api/samples/check-code?sample_code=DN1").status_code == 400
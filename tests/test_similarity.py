@@ -0,0 +1,50 @@
+import pytest
+
+from app.similarity import THRESHOLD, fold, min_shared, rank, trigrams
+
+
+def _rank(value, *others):
+	"""rank() over the shared trigram counts Table.overlap() would give"""
+	grams = trigrams(value)
+	return [(r["name"], score) for r, score in rank(value, [({"name": o}, len(grams & trigrams(o))) for o in others], lambda r: r["name"])]
+
+
+def test_fold_ignores_case_diacritics_spacing_and_leading_zeros():
+	assert fold("Đất  nền-01") == "dat nen 1"
+	assert fold(" LÁ CHÈ ") == "la che"
+	assert fold(None) == ""
+
+
+@pytest.mark.parametrize("value, other", [
+	("Đất nền 01", "dat nen 1"),
+	("Lá chè", "LA CHE"),
+	("Mẫu A", "mau a"),
+])
+def test_same_sample_written_differently_scores_one(value, other):
+	assert _rank(value, other) == [(other, 1.0)]
+
+
+@pytest.mark.parametrize("value, other", [
+	("Đất nền 1", "Đất nền 2"),
+	("Mẫu A", "Mẫu B"),
+	("Mẫu A", "Mau C"),
+	("Mẫu A1", "Mẫu A2"),
+])
+def test_samples_of_a_series_are_not_alike(value, other):
+	assert _rank(value, other) == []
+
+
+def test_best_match_first_and_threshold():
+	ranked = _rank("Đất nền đỏ", "dat nen do", "dat nen xam", "la che")
+	assert [name for name, _ in ranked][:1] == ["dat nen do"]
+	assert all(score >= THRESHOLD for _, score in ranked)
+	assert "la che" not in [name for name, _ in ranked]
+
+
+def test_min_shared_is_a_lower_bound():
+	value = "dat nen do"
+	grams = trigrams(value)
+	for other in ("dat nen do", "dat nen", "dat nen xam"):
+		shared = len(grams & trigrams(other))
+		if _rank(value, other):
+			assert shared >= min_shared(grams)
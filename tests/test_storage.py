@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from app import storage
+from app.table import Table
+
+
+def test_snapshot_is_shared_until_the_file_changes(data_dir):
+	path = os.path.join(data_dir, "things.json")
+	written = storage.write_json(path, {"things": [1, 2]})
+	assert storage.read_snapshot(path) is written
+	assert storage.read_snapshot(path) is storage.read_snapshot(path)
+
+	# Rewritten by another process: a new mtime, size or inode is noticed
+	with open(path, "w") as f:
+		f.write('{"things": [1, 2, 3]}')
+	assert storage.read_snapshot(path) == {"things": [1, 2, 3]}
+
+
+def test_snapshot_is_read_only(data_dir):
+	path = os.path.join(data_dir, "things.json")
+	storage.write_json(path, {"things": [{"name": "a"}]})
+	snapshot = storage.read_snapshot(path)
+	with pytest.raises(TypeError):
+		snapshot["things"].append({"name": "b"})
+	with pytest.raises(TypeError):
+		snapshot["things"][0]["name"] = "b"
+
+	copy = storage.read_for_update(path)
+	copy["things"][0]["name"] = "b"
+	assert storage.read_snapshot(path) == {"things": [{"name": "a"}]}
+
+
+def test_table_sees_writes_of_another_instance(data_dir):
+	path = os.path.join(data_dir, "things.json")
+	first = Table(path, "things", seed={"next_id": 1, "things": []})
+	second = Table(path, "things", seed={"next_id": 1, "things": []})
+	pk = first.insert({"name": "a"})
+	assert second.get(pk)["name"] == "a"
+	second.update(pk, {"name": "b"})
+	assert first.get(pk)["name"] == "b"